@@ -0,0 +1,53 @@
+"""
+Benchmarks of the auction hot paths.
+
+``python -m benchmarks`` seeds a synthetic marketplace (benchmarks/data.py)
+into the configured database, measures the page and API renders, concurrent
+``BidService.place_bid`` and ``close_expired_auctions``, removes the data
+again and prints the results as JSON (``--out`` writes them to a file).
+``python -m benchmarks.compare`` diffs two such files, so a run on each
+commit shows what regressed.
+
+The remaining modules are standalone before/after comparisons of single
+optimizations: search.py, api_payload.py, money.py and bid_stream.py (the
+last one against a running ASGI server). metrics.py measures what recording
+a Prometheus sample costs per call.
+
+The benchmarks write (and close) listings, so they only run against a
+scratch database named in BENCHMARK_DATABASE_URL, which is migrated first.
+They refuse to start without it, or when it is the site's DATABASE_URL.
+"""
+import os
+import sys
+
+
+def setup(database=True, **environ):
+    """
+    Configures Django for a benchmark run. Background work that would need
+    a broker is off unless ``environ`` turns it back on. With ``database``
+    the default database is BENCHMARK_DATABASE_URL, or the run exits.
+    """
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'nexus_core.settings')
+    for name in ('AUCTION_SCHEDULER_ENABLED', 'INVOICE_PRERENDER_ENABLED', 'IMAGE_PIPELINE_ENABLED'):
+        os.environ.setdefault(name, 'False')
+    os.environ.update(environ)
+
+    if database:
+        from dotenv import load_dotenv
+
+        # Compare against the DATABASE_URL settings.py would load
+        load_dotenv()
+        url = os.environ.get('BENCHMARK_DATABASE_URL')
+        if not url:
+            sys.exit("Set BENCHMARK_DATABASE_URL to a scratch database: the benchmarks seed, "
+                     "bid on and close listings in it.")
+        if url == os.environ.get('DATABASE_URL'):
+            sys.exit("BENCHMARK_DATABASE_URL is the site's DATABASE_URL, point it at a scratch database.")
+        os.environ['DATABASE_URL'] = url
+
+    import django
+    django.setup()
+
+    if database:
+        from django.core.management import call_command
+        call_command('migrate', interactive=False, verbosity=0)
@@ -0,0 +1,57 @@
+import sys
+import argparse
+from benchmarks import setup
+
+setup()
+
+
+from benchmarks import bids, closing, data, pages
+from benchmarks.report import environment, write
+
+SUITES = ('pages', 'bids', 'closing')
+
+
+def main(args):
+    data.cleanup()
+    print(f"Seeding {args.users} users, {args.products} listings and {args.bids} bids...", file=sys.stderr)
+    dataset = data.seed(args.users, args.products, args.bids, expired=args.expired, seed=args.seed)
+    results = {
+        'environment': environment(),
+        'parameters': vars(args),
+        'dataset': dataset._asdict(),
+    }
+    try:
+        # Closing last, it consumes the expired auctions
+        if 'pages' in args.only:
+            print(f"Rendering pages ({args.runs} runs each)...", file=sys.stderr)
+            results['pages'] = pages.run(args.runs)
+        if 'bids' in args.only:
+            print(f"Placing bids from {args.threads} threads...", file=sys.stderr)
+            results['place_bid'] = bids.run(args.threads, args.bids_per_thread, seed=args.seed)
+        if 'closing' in args.only:
+            print(f"Closing {dataset.expired_auctions} expired auctions...", file=sys.stderr)
+            results['close_expired_auctions'] = closing.run()
+    finally:
+        if not args.keep:
+            print("Cleaning up benchmark data...", file=sys.stderr)
+            data.cleanup()
+    write(results, args.out)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        prog='python -m benchmarks',
+        description="Seed a synthetic marketplace and benchmark the auction hot paths; results are JSON.",
+    )
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--products', type=int, default=10_000)
+    parser.add_argument('--bids', type=int, default=100_000, help="Bids seeded before the benchmarks")
+    parser.add_argument('--expired', type=float, default=0.1, help="Share of auctions already past their end time")
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--runs', type=int, default=50, help="Requests per page")
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--bids-per-thread', type=int, default=200)
+    parser.add_argument('--only', nargs='+', choices=SUITES, default=list(SUITES))
+    parser.add_argument('--out', help="Write the results to this file instead of stdout")
+    parser.add_argument('--keep', action='store_true', help="Leave the seeded data in the database")
+    sys.exit(main(parser.parse_args()))
@@ -0,0 +1,133 @@
+import sys
+import time
+import argparse
+import statistics
+from decimal import Decimal
+from benchmarks import setup
+
+setup()
+
+
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from rest_framework import serializers
+from rest_framework.test import APIRequestFactory
+from users.models import User, Address
+from users.serializers import AddressSerializer
+from market.models import Product, ProductImage, Bid, Category
+from market.serializers import CategorySerializer, ProductImageSerializer, BidSerializer
+from market.views import ProductViewSet
+
+
+# The /api/products/ representation before the slim serializers: full seller
+# with addresses and wallet, every image and every bid, no prefetching.
+class LegacySellerSerializer(serializers.ModelSerializer):
+    addresses = AddressSerializer(many=True, read_only=True)
+    wallet_balance = serializers.DecimalField(source='wallet.balance', max_digits=10, decimal_places=2, read_only=True)
+
+    class Meta:
+        model = User
+        fields = ['id', 'username', 'email', 'first_name', 'last_name', 'role', 'wallet_balance', 'bio', 'is_verified', 'addresses']
+
+
+class LegacyProductSerializer(serializers.ModelSerializer):
+    seller = LegacySellerSerializer(read_only=True)
+    category = CategorySerializer(read_only=True)
+    images = ProductImageSerializer(many=True, read_only=True)
+    bids = BidSerializer(many=True, read_only=True)
+
+    class Meta:
+        model = Product
+        fields = [
+            'id', 'seller', 'category', 'title', 'description',
+            'condition', 'location', 'sales_type', 'initial_price', 'buy_now_price',
+            'current_highest_bid', 'reserve_price', 'auction_end_time', 'is_active',
+            'bid_count', 'last_bid_at', 'created_at', 'images', 'bids'
+        ]
+
+
+class LegacyProductViewSet(ProductViewSet):
+    queryset = Product.objects.filter(is_active=True).order_by('-created_at')
+
+    def get_queryset(self):
+        return self.queryset.all()
+
+    def get_serializer_class(self):
+        return LegacyProductSerializer
+
+
+def seed(products, bids_per_product, images_per_product):
+    sellers = []
+    for i in range(10):
+        seller, _ = User.objects.get_or_create(username=f"bench_api_seller_{i}", defaults={'email': f"seller{i}@bench.com"})
+        Address.objects.get_or_create(user=seller, street="1 Bench St", city="Lima", state="Lima", zip_code="15001", country="PE")
+        sellers.append(seller)
+    bidders = [User.objects.get_or_create(username=f"bench_api_bidder_{i}", defaults={'email': f"bidder{i}@bench.com"})[0]
+               for i in range(20)]
+    category, _ = Category.objects.get_or_create(name="Bench API", defaults={'slug': "bench-api"})
+
+    created = Product.objects.bulk_create([
+        Product(
+            seller=sellers[i % len(sellers)],
+            category=category,
+            title=f"Benchmark Listing {i}",
+            description="Benchmark listing. " * 40,
+            condition='USED',
+            location='Benchmark',
+            sales_type='AUCTION',
+            initial_price=Decimal('10.00'),
+            current_highest_bid=Decimal('10.00') + bids_per_product,
+            bid_count=bids_per_product,
+        )
+        for i in range(products)
+    ])
+    ProductImage.objects.bulk_create([
+        ProductImage(product=product, image=f"products/bench-{product.id}-{n}.jpg", order=n)
+        for product in created for n in range(images_per_product)
+    ])
+    Bid.objects.bulk_create([
+        Bid(product=product, bidder=bidders[n % len(bidders)], amount=Decimal('11.00') + n)
+        for product in created for n in range(bids_per_product)
+    ])
+    return sellers + bidders, category
+
+
+def measure(viewset, runs):
+    view = viewset.as_view({'get': 'list'})
+    factory = APIRequestFactory()
+    samples = []
+    for _ in range(runs):
+        request = factory.get('/api/products/', {'page_size': 20}, HTTP_HOST='localhost')
+        with CaptureQueriesContext(connection) as queries:
+            start = time.perf_counter()
+            response = view(request)
+            response.render()
+            samples.append((time.perf_counter() - start) * 1000)
+    return len(queries), len(response.content), statistics.median(samples)
+
+
+def benchmark(products, bids_per_product, images_per_product, runs):
+    print(f"Seeding {products} listings with {bids_per_product} bids and {images_per_product} images each...")
+    users, category = seed(products, bids_per_product, images_per_product)
+
+    try:
+        print(f"\nGET /api/products/ (page of 20, {runs} runs)")
+        print(f"{'representation':<16}{'queries':>10}{'bytes':>12}{'median ms':>12}")
+        for name, viewset in (("before", LegacyProductViewSet), ("after", ProductViewSet)):
+            queries, size, median = measure(viewset, runs)
+            print(f"{name:<16}{queries:>10}{size:>12}{median:>12.2f}")
+    finally:
+        print("\nCleaning up benchmark data...")
+        Product.objects.filter(category=category).delete()
+        category.delete()
+        User.objects.filter(id__in=[user.id for user in users]).delete()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark query count and payload size of the products API.")
+    parser.add_argument('--products', type=int, default=200)
+    parser.add_argument('--bids', type=int, default=50)
+    parser.add_argument('--images', type=int, default=4)
+    parser.add_argument('--runs', type=int, default=5)
+    args = parser.parse_args()
+    sys.exit(benchmark(args.products, args.bids, args.images, args.runs))
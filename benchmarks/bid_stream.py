@@ -0,0 +1,142 @@
+import sys
+import json
+import time
+import asyncio
+import argparse
+import statistics
+from datetime import timedelta
+from decimal import Decimal
+from urllib.parse import urlsplit
+from benchmarks import setup
+
+setup(BID_STREAM_ENABLED='True')
+
+
+from django.utils import timezone
+from users.models import User
+from market.models import Product, Category
+from market.services import BidService
+
+# Opens many idle SSE subscribers against a running ASGI server
+# (e.g. `uvicorn nexus_core.asgi:application --port 8001`), places bids through
+# BidService against the same database and Redis, and reports the latency from
+# the bid's commit (``sent_at``) to receipt by each subscriber.
+
+
+class Subscriber:
+    def __init__(self, host, port, path):
+        self.host, self.port, self.path = host, port, path
+        self.latencies = []
+        self.connected = asyncio.Event()
+        self.writer = None
+
+    async def run(self):
+        reader, self.writer = await asyncio.open_connection(self.host, self.port, limit=2 ** 20)
+        self.writer.write(
+            f"GET {self.path} HTTP/1.1\r\nHost: {self.host}\r\nAccept: text/event-stream\r\n\r\n".encode()
+        )
+        await self.writer.drain()
+        # Headers; the stream starts with a retry: line once subscribed
+        while (await reader.readline()) not in (b'\r\n', b''):
+            pass
+        self.connected.set()
+
+        event = None
+        while True:
+            line = await reader.readline()
+            if not line:
+                return
+            line = line.strip()
+            if line.startswith(b'event:'):
+                event = line[6:].strip().decode()
+            elif line.startswith(b'data:') and event == 'bid':
+                received = time.time()
+                self.latencies.append(received - json.loads(line[5:])['sent_at'])
+
+    def close(self):
+        if self.writer:
+            self.writer.close()
+
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+def seed():
+    seller, _ = User.objects.get_or_create(username="loadtest_stream_seller", defaults={'email': "seller@loadtest.com"})
+    bidders = [User.objects.get_or_create(username=f"loadtest_stream_bidder_{i}", defaults={'email': f"b{i}@loadtest.com"})[0]
+               for i in range(2)]
+    category, _ = Category.objects.get_or_create(name="Load Test", defaults={'slug': "load-test"})
+    product = Product.objects.create(
+        seller=seller,
+        category=category,
+        title="Load Test Auction",
+        description="Load test listing",
+        condition='NEW',
+        location='Benchmark',
+        sales_type='AUCTION',
+        initial_price=Decimal('1.00'),
+        auction_end_time=timezone.now() + timedelta(hours=1),
+    )
+    return seller, bidders, category, product
+
+
+async def load_test(base_url, subscribers, bids, rate):
+    seller, bidders, category, product = await asyncio.to_thread(seed)
+    url = urlsplit(base_url)
+    path = f"{url.path.rstrip('/')}/stream/products/{product.id}/"
+    clients = [Subscriber(url.hostname, url.port or 80, path) for _ in range(subscribers)]
+    tasks = []
+
+    try:
+        print(f"Connecting {subscribers} subscribers to {base_url}{path} ...")
+        start = time.perf_counter()
+        tasks = [asyncio.create_task(client.run()) for client in clients]
+        await asyncio.wait_for(asyncio.gather(*(client.connected.wait() for client in clients)), timeout=120)
+        print(f"Connected in {time.perf_counter() - start:.2f}s")
+        # Let the hub finish subscribing before the first publish
+        await asyncio.sleep(1)
+
+        print(f"Placing {bids} bids at {rate}/s ...")
+        amount = Decimal('1.00')
+        for i in range(bids):
+            product = await asyncio.to_thread(BidService.place_bid, product, bidders[i % 2], amount)
+            amount += 1
+            await asyncio.sleep(1 / rate)
+
+        expected = subscribers * bids
+        deadline = time.monotonic() + 30
+        while sum(len(client.latencies) for client in clients) < expected and time.monotonic() < deadline:
+            await asyncio.sleep(0.5)
+
+        latencies = [latency * 1000 for client in clients for latency in client.latencies]
+        print(f"\nDelivered {len(latencies)}/{expected} events ({100 * len(latencies) / expected:.1f}%)")
+        if latencies:
+            print(f"{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'max ms':>10}{'mean ms':>10}")
+            print(f"{percentile(latencies, 50):>10.2f}{percentile(latencies, 95):>10.2f}"
+                  f"{percentile(latencies, 99):>10.2f}{max(latencies):>10.2f}{statistics.mean(latencies):>10.2f}")
+    finally:
+        for client in clients:
+            client.close()
+        for task in tasks:
+            task.cancel()
+        print("\nCleaning up load test data...")
+        await asyncio.to_thread(cleanup, seller, bidders, category)
+
+
+def cleanup(seller, bidders, category):
+    Product.objects.filter(seller=seller).delete()
+    category.delete()
+    for user in [seller] + bidders:
+        user.delete()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measure bid broadcast latency over the SSE stream.")
+    parser.add_argument('--url', default='http://127.0.0.1:8001', help="Base URL of the ASGI server")
+    parser.add_argument('--subscribers', type=int, default=1000)
+    parser.add_argument('--bids', type=int, default=50)
+    parser.add_argument('--rate', type=float, default=10, help="Bids per second")
+    args = parser.parse_args()
+    sys.exit(asyncio.run(load_test(args.url, args.subscribers, args.bids, args.rate)))
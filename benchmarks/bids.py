@@ -0,0 +1,103 @@
+"""
+Concurrent bidding benchmark.
+
+``threads`` bidders hammer the open auctions of the synthetic marketplace
+through ``BidService.place_bid``, each bid at the minimum the bidder last
+saw. Auctions are picked with the same Zipf skew as the seeded bids, so the
+hot ones see real contention: a bid that lost the race to a concurrent one
+is rejected by the service and counted as ``outbid``; anything else that
+fails (e.g. SQLite's "database is locked") is counted under ``errors``.
+"""
+import random
+import threading
+import time
+from collections import Counter
+
+from django.core.exceptions import ValidationError
+from django.db import connection, connections
+from django.db.models import F
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from market.models import Product
+from market.services import BidService
+from users.models import User
+from .data import CATEGORY_PREFIX, USER_PREFIX, Zipf
+from .report import summarize
+
+# Open auctions in play, hottest first
+AUCTIONS = 100
+
+
+def _bidder(auctions, bidders, count, seed, results, lock, start):
+    rng = random.Random(seed)
+    latencies, queries, outcomes = [], 0, Counter()
+    start.wait()
+    try:
+        for _ in range(count):
+            product_id, seller_id = auctions.pick(rng)
+            bidder = bidders.pick(rng)
+            if bidder.id == seller_id:
+                continue
+            # What the bidder sees on the page before bidding, not timed
+            product = Product.objects.get(pk=product_id)
+            amount = BidService.minimum_bid(product)
+            with CaptureQueriesContext(connection) as captured:
+                started = time.perf_counter()
+                try:
+                    BidService.place_bid(product, bidder, amount)
+                except ValidationError:
+                    outcomes['outbid'] += 1
+                except Exception as e:
+                    outcomes[type(e).__name__] += 1
+                else:
+                    outcomes['accepted'] += 1
+                    latencies.append((time.perf_counter() - started) * 1000)
+            queries += len(captured)
+    finally:
+        connections.close_all()
+        with lock:
+            results['latencies'] += latencies
+            results['queries'] += queries
+            results['outcomes'].update(outcomes)
+
+
+def run(threads=8, bids=200, seed=42):
+    """
+    Places ``bids`` per thread from ``threads`` threads. Returns the
+    latency summary of accepted bids, their throughput and the outcomes.
+    """
+    auctions = list(
+        Product.objects.filter(category__slug__startswith=CATEGORY_PREFIX, is_active=True,
+                               sales_type__in=('AUCTION', 'HYBRID'), auction_end_time__gt=timezone.now())
+        .order_by(F('bid_count').desc(), 'id').values_list('id', 'seller_id')[:AUCTIONS]
+    )
+    if not auctions:
+        return {'count': 0}
+    bidders = Zipf(User.objects.filter(username__startswith=USER_PREFIX, products__isnull=True).order_by('id'))
+
+    results = {'latencies': [], 'queries': 0, 'outcomes': Counter()}
+    lock = threading.Lock()
+    start = threading.Barrier(threads + 1)
+    workers = [
+        threading.Thread(target=_bidder, args=(Zipf(auctions, s=1.0), bidders, bids, seed + n, results, lock, start))
+        for n in range(threads)
+    ]
+    for worker in workers:
+        worker.start()
+    start.wait()
+    started = time.perf_counter()
+    for worker in workers:
+        worker.join()
+    seconds = time.perf_counter() - started
+
+    outcomes = results['outcomes']
+    attempts = sum(outcomes.values())
+    summary = summarize(results['latencies'], seconds)
+    summary.update({
+        'threads': threads,
+        'attempts': attempts,
+        'queries_per_bid': round(results['queries'] / attempts, 2) if attempts else 0,
+        'outcomes': dict(outcomes),
+    })
+    return summary
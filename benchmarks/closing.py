@@ -0,0 +1,66 @@
+"""
+Expired-auction closing benchmark.
+
+Runs ``close_expired_auctions`` over the expired auctions of the synthetic
+marketplace in this process (one shard, no Celery group), and reports how
+long each claimed batch took and the auctions closed per second. Only the
+seeded ``bench-`` categories are swept, any other expired auction is left
+alone. Closing is destructive, so this runs last and only once per seed.
+"""
+import time
+
+from django.conf import settings
+from django.db import connection
+from django.test.utils import CaptureQueriesContext, override_settings
+
+from market import tasks
+from .data import CATEGORY_PREFIX
+from .report import summarize
+
+
+def run():
+    """
+    Closes the seeded backlog. Returns the batch latency summary, the
+    throughput in auctions per second and the queries per auction.
+    """
+    expired_auctions = tasks._expired_auctions
+
+    def seeded_auctions():
+        return expired_auctions().filter(category__slug__startswith=CATEGORY_PREFIX)
+
+    expired = seeded_auctions().count()
+
+    batches = []
+    claim = tasks._claim_and_close
+
+    def timed_claim(*args, **kwargs):
+        started = time.perf_counter()
+        closed = claim(*args, **kwargs)
+        if closed:
+            batches.append((time.perf_counter() - started) * 1000)
+        return closed
+
+    tasks._claim_and_close = timed_claim
+    tasks._expired_auctions = seeded_auctions
+    try:
+        with override_settings(AUCTION_CLOSE_SHARDS=1), CaptureQueriesContext(connection) as captured:
+            started = time.perf_counter()
+            result = tasks.close_expired_auctions()
+            seconds = time.perf_counter() - started
+    finally:
+        tasks._claim_and_close = claim
+        tasks._expired_auctions = expired_auctions
+
+    closed = expired - seeded_auctions().count()
+    summary = summarize(batches)
+    summary.update({
+        'result': result,
+        'expired': expired,
+        'closed': closed,
+        'seconds': round(seconds, 3),
+        'per_second': round(closed / seconds, 1) if closed and seconds else 0.0,
+        'batch_size': settings.AUCTION_CLOSE_BATCH_SIZE,
+        'queries': len(captured),
+        'queries_per_auction': round(len(captured) / closed, 3) if closed else 0,
+    })
+    return summary
@@ -0,0 +1,76 @@
+import sys
+import json
+import argparse
+
+# Metrics compared between two runs of ``python -m benchmarks``, and
+# whether a higher value is better
+METRICS = {
+    'p50_ms': False,
+    'p95_ms': False,
+    'p99_ms': False,
+    'queries': False,
+    'queries_per_bid': False,
+    'queries_per_auction': False,
+    'per_second': True,
+}
+
+
+def flatten(results, prefix=''):
+    """
+    ``{'pages.home.p95_ms': value}`` for every compared metric.
+    """
+    metrics = {}
+    for key, value in results.items():
+        if key in ('environment', 'parameters', 'dataset'):
+            continue
+        if isinstance(value, dict):
+            metrics.update(flatten(value, f'{prefix}{key}.'))
+        elif key in METRICS and isinstance(value, (int, float)):
+            metrics[f'{prefix}{key}'] = value
+    return metrics
+
+
+def compare(base, head, threshold):
+    """
+    Rows of ``(metric, base, head, change)`` and the metrics that got worse
+    by more than ``threshold`` (a fraction).
+    """
+    base, head = flatten(base), flatten(head)
+    rows, regressions = [], []
+    for metric in sorted(base.keys() & head.keys()):
+        before, after = base[metric], head[metric]
+        change = (after - before) / before if before else (0.0 if after == before else float('inf'))
+        rows.append((metric, before, after, change))
+        higher_is_better = METRICS[metric.rsplit('.', 1)[-1]]
+        worse = -change if higher_is_better else change
+        # Query counts are exact, any increase is a regression
+        limit = 0 if metric.rsplit('.', 1)[-1].startswith('queries') else threshold
+        if worse > limit:
+            regressions.append(metric)
+    return rows, regressions
+
+
+def main(args):
+    with open(args.base) as f:
+        base = json.load(f)
+    with open(args.head) as f:
+        head = json.load(f)
+    print(f"{base['environment'].get('commit')} -> {head['environment'].get('commit')}\n")
+    rows, regressions = compare(base, head, args.threshold)
+    print(f"{'metric':<44}{'base':>12}{'head':>12}{'change':>10}")
+    for metric, before, after, change in rows:
+        flag = '  <-- regression' if metric in regressions else ''
+        print(f"{metric:<44}{before:>12}{after:>12}{change:>+10.1%}{flag}")
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        prog='python -m benchmarks.compare',
+        description="Compare two benchmark result files; exits 1 when a metric regressed.",
+    )
+    parser.add_argument('base')
+    parser.add_argument('head')
+    parser.add_argument('--threshold', type=float, default=0.1,
+                        help="Tolerated slowdown as a fraction (default 0.1); query counts tolerate none")
+    sys.exit(main(parser.parse_args()))
@@ -0,0 +1,223 @@
+"""
+Synthetic marketplace for the benchmarks.
+
+``seed`` creates N users, M listings and K bids with ``bulk_create``, with
+the skew of a real marketplace: a few power sellers own most listings, a
+few hot auctions draw most bids and a few bidders place most of them (all
+Zipf-distributed). Bid amounts climb per listing and the denormalized bid
+statistics on Product match the Bid rows, as BidService would leave them.
+``expired`` is the share of auctions whose end time has already passed,
+the backlog close_expired_auctions works through.
+
+The same ``seed`` number yields the same data. Everything is created under
+the ``bench_`` user and ``bench-`` category prefixes, and ``cleanup``
+removes it.
+"""
+import random
+import time
+from bisect import bisect
+from collections import namedtuple
+from datetime import timedelta
+from decimal import Decimal
+from itertools import accumulate
+
+from django.db import transaction
+from django.utils import timezone
+
+from market.cache import invalidate_home_cache
+from market.models import Bid, Category, Product, ProductImage
+from market.rules import invalidate_auction_rules
+from users.models import User, Wallet
+
+USER_PREFIX = 'bench_'
+CATEGORY_PREFIX = 'bench-'
+
+BATCH_SIZE = 2000
+
+CATEGORIES = {
+    'Watches': ['Luxury', 'Vintage', 'Smart'],
+    'Electronics': ['Phones', 'Laptops', 'Cameras', 'Audio'],
+    'Art': ['Paintings', 'Prints'],
+    'Fashion': ['Sneakers', 'Bags', 'Jackets'],
+    'Collectibles': ['Coins', 'Cards', 'Vinyl'],
+}
+WORDS = (
+    "vintage omega rolex watch swiss gold silver steel leather strap camera lens canon nikon guitar "
+    "fender vinyl record console nintendo painting canvas bronze jacket denim sneakers jordan bicycle "
+    "carbon drone laptop keyboard mechanical speaker amplifier ring diamond rare signed boxed mint"
+).split()
+CONDITIONS = ('NEW', 'USED', 'REFURBISHED')
+# (sales type, share of listings)
+SALES_TYPES = (('AUCTION', 0.6), ('HYBRID', 0.15), ('DIRECT', 0.25))
+CITIES = ('Lima', 'Cusco', 'Arequipa', 'Bogota', 'Santiago', 'Madrid', 'Mexico City')
+
+Dataset = namedtuple('Dataset', 'users sellers bidders categories products open_auctions expired_auctions bids seconds')
+
+
+class Zipf:
+    """
+    Picks items with probability proportional to 1 / rank ** ``s``.
+    """
+
+    def __init__(self, items, s=1.1):
+        self.items = list(items)
+        self.cumulative = list(accumulate(1 / rank ** s for rank in range(1, len(self.items) + 1)))
+
+    def pick(self, rng):
+        index = bisect(self.cumulative, rng.random() * self.cumulative[-1])
+        return self.items[min(index, len(self.items) - 1)]
+
+
+def _batches(objects, model, **kwargs):
+    created = []
+    for start in range(0, len(objects), BATCH_SIZE):
+        created += model.objects.bulk_create(objects[start:start + BATCH_SIZE], **kwargs)
+    return created
+
+
+def _users(rng, count):
+    users = _batches([
+        User(
+            username=f'{USER_PREFIX}{i}',
+            email=f'{USER_PREFIX}{i}@bench.example.com',
+            password='!',
+            is_verified=rng.random() < 0.2,
+        )
+        for i in range(count)
+    ], User)
+    # bulk_create sends no post_save, so no wallet either
+    _batches([Wallet(user=user, balance=Decimal(rng.randint(0, 500_000)).scaleb(-2)) for user in users], Wallet)
+    return users
+
+
+def _categories():
+    parents = _batches([
+        Category(name=f'Bench {name}', slug=f'{CATEGORY_PREFIX}{name.lower()}') for name in CATEGORIES
+    ], Category)
+    children = _batches([
+        Category(name=f'Bench {child}', slug=f'{CATEGORY_PREFIX}{parent.slug[len(CATEGORY_PREFIX):]}-{child.lower()}', parent=parent)
+        for parent, names in zip(parents, CATEGORIES.values()) for child in names
+    ], Category)
+    return parents + children
+
+
+def _sales_type(rng):
+    roll = rng.random()
+    for sales_type, share in SALES_TYPES:
+        roll -= share
+        if roll < 0:
+            return sales_type
+    return SALES_TYPES[0][0]
+
+
+def _products(rng, count, sellers, categories, expired, now):
+    sellers = Zipf(sellers)
+    categories = Zipf(categories, s=0.8)
+    products = []
+    for _ in range(count):
+        sales_type = _sales_type(rng)
+        price = Decimal(rng.randint(100, 200_000)).scaleb(-2)
+        end_time = None
+        if sales_type != 'DIRECT':
+            if rng.random() < expired:
+                end_time = now - timedelta(seconds=rng.randint(1, 86_400))
+            else:
+                end_time = now + timedelta(seconds=rng.randint(3_600, 7 * 86_400))
+        products.append(Product(
+            seller=sellers.pick(rng),
+            category=categories.pick(rng),
+            title=' '.join(rng.choices(WORDS, k=rng.randint(3, 7))).title()[:255],
+            description=' '.join(rng.choices(WORDS, k=rng.randint(20, 120))),
+            condition=rng.choice(CONDITIONS),
+            location=rng.choice(CITIES),
+            sales_type=sales_type,
+            initial_price=price,
+            buy_now_price=price * 3 if sales_type != 'AUCTION' else None,
+            auction_end_time=end_time,
+        ))
+    products = _batches(products, Product)
+    _batches([
+        ProductImage(product=product, image=f'products/bench-{product.id}-{n}.jpg', order=n)
+        for product in products for n in range(rng.randint(1, 4))
+    ], ProductImage)
+    return products
+
+
+def _bids(rng, count, products, bidders, now):
+    auctions = [product for product in products if product.sales_type != 'DIRECT']
+    if not auctions or not count:
+        return 0
+    # Popularity is independent of the listing order
+    rng.shuffle(auctions)
+    hot = Zipf(auctions, s=1.0)
+    active = Zipf(bidders)
+
+    bids = []
+    for _ in range(count):
+        product = hot.pick(rng)
+        bidder = active.pick(rng)
+        if bidder.id == product.seller_id:
+            continue
+        # Steps of 2% of the starting price, a hot auction ends at a few times it
+        step = max(Decimal('1.00'), (product.initial_price * Decimal('0.02')).quantize(Decimal('0.01')))
+        product.current_highest_bid = (product.current_highest_bid or product.initial_price) + step
+        product.bid_count += 1
+        product.leading_bidder = bidder
+        bids.append(Bid(product=product, bidder=bidder, amount=product.current_highest_bid))
+        if len(bids) >= BATCH_SIZE:
+            Bid.objects.bulk_create(bids)
+            bids = []
+    Bid.objects.bulk_create(bids)
+
+    bid_on = [product for product in auctions if product.bid_count]
+    for product in bid_on:
+        product.last_bid_at = now
+    Product.objects.bulk_update(bid_on, ['current_highest_bid', 'bid_count', 'leading_bidder', 'last_bid_at'],
+                                batch_size=BATCH_SIZE)
+    return sum(product.bid_count for product in bid_on)
+
+
+def seed(users=1000, products=10_000, bids=100_000, expired=0.1, sellers=0.1, seed=42):
+    """
+    Creates the synthetic marketplace; ``sellers`` is the share of users
+    who list. Returns a Dataset of what was created.
+    """
+    rng = random.Random(seed)
+    started = time.perf_counter()
+    now = timezone.now()
+    with transaction.atomic():
+        created_users = _users(rng, max(users, 2))
+        seller_count = max(1, int(len(created_users) * sellers))
+        categories = _categories()
+        created_products = _products(rng, products, created_users[:seller_count], categories, expired, now)
+        placed = _bids(rng, bids, created_products, created_users[seller_count:] or created_users, now)
+        # bulk_create sends no post_save
+        invalidate_home_cache()
+        invalidate_auction_rules()
+
+    auctions = [product for product in created_products if product.sales_type != 'DIRECT']
+    return Dataset(
+        users=len(created_users),
+        sellers=seller_count,
+        bidders=len(created_users) - seller_count,
+        categories=len(categories),
+        products=len(created_products),
+        open_auctions=sum(product.auction_end_time > now for product in auctions),
+        expired_auctions=sum(product.auction_end_time <= now for product in auctions),
+        bids=placed,
+        seconds=round(time.perf_counter() - started, 3),
+    )
+
+
+def cleanup():
+    """
+    Deletes everything ``seed`` created, including what the benchmarks
+    added on top (bids, transactions, notifications).
+    """
+    with transaction.atomic():
+        Product.objects.filter(category__slug__startswith=CATEGORY_PREFIX).delete()
+        Category.objects.filter(slug__startswith=CATEGORY_PREFIX, parent__isnull=False).delete()
+        Category.objects.filter(slug__startswith=CATEGORY_PREFIX).delete()
+        User.objects.filter(username__startswith=USER_PREFIX).delete()
+        invalidate_home_cache()
+        invalidate_auction_rules()
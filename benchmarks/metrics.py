@@ -0,0 +1,66 @@
+import os
+import sys
+import timeit
+import argparse
+import tempfile
+import subprocess
+
+# Micro-benchmark of recording one sample with nexus_core/metrics.py, the
+# cost added to every bid, close, checkout and email. "single" keeps the
+# samples in process memory; "multiprocess" is how gunicorn runs with
+# start.sh (PROMETHEUS_MULTIPROC_DIR set, samples written to mmap files),
+# measured in a child process because the mode is fixed at import time.
+
+
+def cases():
+    from nexus_core.metrics import BID_DURATION, BID_LOCK_WAIT, BIDS
+
+    accepted = BIDS.labels('bid', 'accepted')
+    return {
+        'counter inc': accepted.inc,
+        'labels + inc': lambda: BIDS.labels('bid', 'accepted').inc(),
+        'histogram observe': lambda: BID_LOCK_WAIT.observe(0.003),
+        'labels + observe': lambda: BID_DURATION.labels('locked').observe(0.003),
+    }
+
+
+def measure(calls, repeat):
+    return {
+        name: min(timeit.repeat(case, number=calls, repeat=repeat)) / calls * 1e6
+        for name, case in cases().items()
+    }
+
+
+def run(calls, repeat):
+    results = {'single': measure(calls, repeat)}
+    with tempfile.TemporaryDirectory() as directory:
+        child = subprocess.run(
+            [sys.executable, '-m', 'benchmarks.metrics', '--calls', str(calls), '--repeat', str(repeat), '--child'],
+            env={**os.environ, 'PROMETHEUS_MULTIPROC_DIR': directory},
+            capture_output=True, text=True, check=True,
+        )
+    results['multiprocess'] = dict(
+        (name, float(value)) for name, value in (line.rsplit('\t', 1) for line in child.stdout.splitlines())
+    )
+
+    print(f"{calls} calls, best of {repeat} runs\n")
+    print(f"{'operation':<20}{'single µs':>12}{'multiproc µs':>14}")
+    for name, single in results['single'].items():
+        print(f"{name:<20}{single:>12.2f}{results['multiprocess'][name]:>14.2f}")
+    return 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the per-call cost of recording Prometheus metrics.")
+    parser.add_argument('--calls', type=int, default=100_000)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--child', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    from benchmarks import setup
+    setup(database=False)
+    if args.child:
+        for name, micros in measure(args.calls, args.repeat).items():
+            print(f"{name}\t{micros}")
+        sys.exit(0)
+    sys.exit(run(args.calls, args.repeat))
@@ -0,0 +1,75 @@
+import sys
+import random
+import timeit
+import argparse
+from decimal import Decimal, InvalidOperation
+
+from nexus_core.money import Money
+
+# Micro-benchmark of the per-bid money arithmetic in BidService: parsing the
+# submitted amount, computing the minimum next bid and comparing the two.
+# "float" is the previous path (float() in the views, Decimal(str()) and
+# quantize in the service, a bare 1.00 added to the Decimal price);
+# "money" parses straight to integer cents with nexus_core.money.Money.
+
+CENT = Decimal('0.01')
+
+
+def float_path(raw, highest, increment):
+    try:
+        amount = Decimal(str(float(raw))).quantize(CENT)
+    except (ValueError, InvalidOperation):
+        return None
+    min_bid = highest + Decimal(str(increment))
+    return amount >= min_bid
+
+
+def money_path(raw, highest, increment):
+    try:
+        amount = Money.parse(raw)
+    except Exception:
+        return None
+    return amount >= highest + increment
+
+
+def inputs(count):
+    rng = random.Random(42)
+    rows = []
+    for _ in range(count):
+        cents = rng.randint(100, 10_000_000)
+        raw = f'{cents // 100}.{cents % 100:02d}' if rng.random() < 0.8 else str(cents // 100)
+        highest = Decimal(rng.randint(100, 10_000_000)).scaleb(-2)
+        rows.append((raw, highest))
+    return rows
+
+
+def run(count, repeat):
+    rows = inputs(count)
+    increment = Decimal('1.00')
+    as_money = [(raw, Money.of(highest)) for raw, highest in rows]
+    money_increment = Money.of(increment)
+
+    # Same accept/reject decision for every input before timing anything
+    mismatches = sum(
+        float_path(raw, highest, increment) != money_path(raw, money_highest, money_increment)
+        for (raw, highest), (_, money_highest) in zip(rows, as_money)
+    )
+
+    cases = {
+        'float': lambda: [float_path(raw, highest, 1.00) for raw, highest in rows],
+        'money': lambda: [money_path(raw, highest, money_increment) for raw, highest in as_money],
+    }
+    print(f"{count} bids, best of {repeat} runs, {mismatches} decision mismatches\n")
+    print(f"{'path':<8}{'total ms':>12}{'ns/bid':>12}")
+    for name, case in cases.items():
+        best = min(timeit.repeat(case, number=1, repeat=repeat))
+        print(f"{name:<8}{best * 1000:>12.2f}{best / count * 1e9:>12.0f}")
+    return 1 if mismatches else 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark bid amount parsing and minimum-bid arithmetic.")
+    parser.add_argument('--bids', type=int, default=100_000)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+    sys.exit(run(args.bids, args.repeat))
@@ -0,0 +1,55 @@
+"""
+Render benchmarks of the busiest pages: home, catalog, the product page of
+the hottest auction and the first page of /api/products/, each through the
+full middleware stack as a signed-in bidder (product pages need a login,
+and the header's notification count and balance come along).
+"""
+from django.db.models import F
+from django.test import Client
+from django.utils import timezone
+
+from market.cache import invalidate_home_cache
+from market.models import Product
+from users.models import User
+from .data import CATEGORY_PREFIX, USER_PREFIX
+from .report import timed
+
+HOST = 'localhost'
+
+
+def _get(client, path):
+    def get():
+        response = client.get(path)
+        if response.status_code != 200:
+            raise RuntimeError(f"GET {path} answered {response.status_code}")
+        # Streaming responses render lazily
+        if getattr(response, 'streaming', False):
+            b''.join(response.streaming_content)
+    return get
+
+
+def run(runs=50):
+    """
+    ``{name: summary}`` for each page; see report.timed.
+    """
+    client = Client(HTTP_HOST=HOST)
+    client.force_login(User.objects.filter(username__startswith=USER_PREFIX, products__isnull=True).earliest('id'))
+    hottest = (
+        Product.objects.filter(category__slug__startswith=CATEGORY_PREFIX, is_active=True,
+                               auction_end_time__gt=timezone.now())
+        .order_by(F('bid_count').desc(), 'id').values_list('id', flat=True).first()
+    )
+    pages = {
+        'home': '/',
+        'catalog': '/catalog/',
+        'api_products': '/api/products/',
+    }
+    if hottest:
+        pages['product_detail'] = f'/product/{hottest}/'
+
+    results = {}
+    for name, path in pages.items():
+        # The cold call recomputes the cached home sections
+        invalidate_home_cache()
+        results[name] = {'path': path, **timed(_get(client, path), runs)}
+    return results
@@ -0,0 +1,100 @@
+"""
+Timing and the JSON result format shared by the benchmarks.
+"""
+import json
+import math
+import platform
+import subprocess
+import time
+from pathlib import Path
+
+import django
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+PERCENTILES = (50, 90, 95, 99)
+
+
+def percentile(samples, pct):
+    """
+    Nearest-rank percentile of ``samples``.
+    """
+    ordered = sorted(samples)
+    return ordered[max(0, math.ceil(len(ordered) * pct / 100) - 1)]
+
+
+def summarize(samples_ms, seconds=None):
+    """
+    Latency percentiles in milliseconds, and the throughput when the
+    wall-clock ``seconds`` the samples took is given.
+    """
+    if not samples_ms:
+        return {'count': 0}
+    summary = {'count': len(samples_ms)}
+    for pct in PERCENTILES:
+        summary[f'p{pct}_ms'] = round(percentile(samples_ms, pct), 3)
+    summary['max_ms'] = round(max(samples_ms), 3)
+    summary['mean_ms'] = round(sum(samples_ms) / len(samples_ms), 3)
+    if seconds:
+        summary['per_second'] = round(len(samples_ms) / seconds, 1)
+    return summary
+
+
+def timed(function, runs, warmup=1):
+    """
+    Calls ``function`` ``warmup`` times, then ``runs`` times. Returns the
+    summary of the runs with the first (cold) call and the queries per
+    call; the query count of the runs should not vary, when it does the
+    path has an N+1 somewhere.
+    """
+    cold = None
+    for _ in range(warmup):
+        start = time.perf_counter()
+        function()
+        cold = cold if cold is not None else (time.perf_counter() - start) * 1000
+    samples, queries = [], set()
+    started = time.perf_counter()
+    for _ in range(runs):
+        with CaptureQueriesContext(connection) as captured:
+            start = time.perf_counter()
+            function()
+            samples.append((time.perf_counter() - start) * 1000)
+        queries.add(len(captured))
+    summary = summarize(samples, time.perf_counter() - started)
+    if cold is not None:
+        summary['cold_ms'] = round(cold, 3)
+    summary['queries'] = max(queries)
+    if len(queries) > 1:
+        summary['queries_min'] = min(queries)
+    return summary
+
+
+def _commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              check=True, cwd=Path(__file__).resolve().parent).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def environment():
+    return {
+        'commit': _commit(),
+        'date': timezone.now().isoformat(),
+        'python': platform.python_version(),
+        'django': django.get_version(),
+        'database': connection.vendor,
+        'machine': platform.machine(),
+    }
+
+
+def write(results, path=None):
+    """
+    Writes ``results`` as JSON to ``path``, or to stdout.
+    """
+    text = json.dumps(results, indent=2, default=str)
+    if path:
+        Path(path).write_text(text + '\n')
+    else:
+        print(text)
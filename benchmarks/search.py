@@ -0,0 +1,99 @@
+import sys
+import time
+import random
+import argparse
+import statistics
+from benchmarks import setup
+
+setup()
+
+
+from django.db.models import Q
+from users.models import User
+from market.models import Product, Category
+from market.search import ProductSearch
+
+WORDS = (
+    "vintage omega rolex watch swiss gold silver steel leather strap camera lens "
+    "canon nikon guitar fender gibson vinyl record console nintendo sony painting "
+    "oil canvas sculpture marble bronze jacket denim sneakers jordan bicycle carbon "
+    "helmet drone laptop keyboard mechanical monitor speaker amplifier ring diamond"
+).split()
+
+# Long tail of rarer words so term frequencies look like real listings
+SYLLABLES = "ka lo mi ra ne tu vo si pe da gu zo fi ba re".split()
+VOCABULARY = WORDS + [a + b + c for a in SYLLABLES for b in SYLLABLES for c in SYLLABLES]
+WEIGHTS = [1 / rank for rank in range(1, len(VOCABULARY) + 1)]
+
+QUERIES = ["omega watch", "vintage", "carbon bicycle", "diamond ring", "mechanical keyboard", "zeppelin"]
+
+
+def seed(count, seller, categories, batch_size=5000):
+    rng = random.Random(42)
+    created = 0
+    while created < count:
+        size = min(batch_size, count - created)
+        Product.objects.bulk_create([
+            Product(
+                seller=seller,
+                category=rng.choice(categories),
+                title=" ".join(rng.choices(VOCABULARY, WEIGHTS, k=4)).title(),
+                description=" ".join(rng.choices(VOCABULARY, WEIGHTS, k=40)),
+                condition='USED',
+                location='Benchmark',
+                sales_type='DIRECT',
+                initial_price=rng.randint(1, 5000),
+            )
+            for _ in range(size)
+        ])
+        created += size
+
+
+def timed(queryset, runs):
+    samples = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        list(queryset[:24])
+        samples.append((time.perf_counter() - start) * 1000)
+    return statistics.median(samples), max(samples)
+
+
+def legacy(queryset, query):
+    return queryset.filter(
+        Q(title__icontains=query) |
+        Q(description__icontains=query) |
+        Q(category__name__icontains=query)
+    ).order_by('-created_at')
+
+
+def benchmark(sizes, runs):
+    seller, _ = User.objects.get_or_create(username="bench_search_seller", email="bench@search.com")
+    categories = [Category.objects.get_or_create(name=name, defaults={'slug': f"bench-{name.lower()}"})[0]
+                  for name in ("Watches", "Electronics", "Art", "Fashion", "Motors")]
+
+    seeded = 0
+    for size in sorted(sizes):
+        print(f"Seeding up to {size} listings...")
+        seed(size - seeded, seller, categories)
+        seeded = size
+
+        base = Product.objects.filter(status='ACTIVE')
+        print(f"\n{size} listings ({runs} runs per query, first page of 24)")
+        print(f"{'query':<22}{'search median ms':>18}{'search max ms':>16}{'icontains median ms':>22}")
+        for query in QUERIES:
+            search_median, search_max = timed(ProductSearch.filter(base, query), runs)
+            legacy_median, _ = timed(legacy(base, query), runs)
+            print(f"{query:<22}{search_median:>18.2f}{search_max:>16.2f}{legacy_median:>22.2f}")
+        print()
+
+    print("Cleaning up benchmark listings...")
+    Product.objects.filter(seller=seller).delete()
+    seller.delete()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark product search latency.")
+    parser.add_argument('--sizes', type=int, nargs='+', default=[100_000, 1_000_000])
+    parser.add_argument('--runs', type=int, default=5)
+    args = parser.parse_args()
+    sys.exit(benchmark(args.sizes, args.runs))
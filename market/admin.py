@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import Category, Product, ProductImage, Bid
+from .models import Category, Product, ProductImage, Bid, IncrementBand, SniperPolicy
 
 class ProductImageInline(admin.TabularInline):
     model = ProductImage
@@ -22,3 +22,12 @@ class BidAdmin(admin.ModelAdmin):
     list_display = ['product', 'bidder', 'amount', 'timestamp']
     list_filter = ['timestamp']
     search_fields = ['product__title', 'bidder__username']
+
+@admin.register(IncrementBand)
+class IncrementBandAdmin(admin.ModelAdmin):
+    list_display = ['category', 'min_amount', 'increment']
+    list_filter = ['category']
+
+@admin.register(SniperPolicy)
+class SniperPolicyAdmin(admin.ModelAdmin):
+    list_display = ['category', 'window_seconds', 'extension_seconds', 'max_extensions']
@@ -0,0 +1,340 @@
+"""
+Redis-backed bid book for hot auctions.
+
+The book keeps the highest bid, leader and end time of each auction in a
+Redis hash so that bids can be accepted or rejected atomically by a Lua
+script instead of queueing behind the Product row lock. Accepted bids are
+pushed to a pending list, stamped with the time they were accepted, and
+written behind to the database in batches by ``market.tasks.flush_bid_book``
+under a flush lock that carries its owner's token. ``BidBook.rebuild`` reloads an auction from
+the Bid table, which is the source of truth after a Redis restart.
+"""
+import json
+import time
+import uuid
+from datetime import datetime, timedelta, timezone as dt_timezone
+from decimal import Decimal
+
+import redis
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .models import Product, Bid
+from .rules import get_auction_rules
+
+CENT = Decimal('0.01')
+
+# Loads an auction into the book unless it is already there, so a concurrent
+# loader can never overwrite bids accepted in the meantime.
+LOAD_SCRIPT = """
+if redis.call('EXISTS', KEYS[1]) == 1 then
+    return 0
+end
+redis.call('HSET', KEYS[1],
+    'active', ARGV[1], 'direct', ARGV[2], 'seller', ARGV[3], 'start', ARGV[4],
+    'highest', ARGV[5], 'leader', ARGV[6], 'end', ARGV[7], 'extensions', ARGV[9])
+if tonumber(ARGV[8]) > 0 then
+    redis.call('PEXPIREAT', KEYS[1], ARGV[8])
+end
+return 1
+"""
+
+# KEYS: book hash, pending list
+# ARGV: bidder id, amount (cents), now (ms), increment table,
+#       sniper window (ms), sniper extension (ms), retention (ms), payload,
+#       max extensions (0 = no limit)
+# The increment table is "min:increment" pairs in cents, ascending by min.
+PLACE_SCRIPT = """
+local book = redis.call('HMGET', KEYS[1], 'active', 'direct', 'seller', 'start', 'highest', 'leader', 'end', 'extensions')
+if not book[1] then
+    return {'MISSING'}
+end
+if book[1] ~= '1' then
+    return {'ERR', 'This auction is not active.'}
+end
+if book[2] == '1' then
+    return {'ERR', 'This product is for direct sale only.'}
+end
+local now = tonumber(ARGV[3])
+local end_ms = tonumber(book[7])
+if end_ms > 0 and now > end_ms then
+    return {'ERR', 'This auction has ended.'}
+end
+local highest = tonumber(book[5])
+local increment = nil
+for band_min, band_increment in string.gmatch(ARGV[4], '(%d+):(%d+)') do
+    if increment and tonumber(band_min) > highest then
+        break
+    end
+    increment = tonumber(band_increment)
+end
+local min_bid = highest + increment
+if highest == 0 then
+    min_bid = tonumber(book[4])
+    if min_bid == 0 then
+        min_bid = 100
+    end
+end
+local amount = tonumber(ARGV[2])
+if amount < min_bid then
+    return {'MIN', tostring(min_bid)}
+end
+if book[3] == ARGV[1] then
+    return {'ERR', 'You cannot bid on your own product.'}
+end
+redis.call('HSET', KEYS[1], 'highest', ARGV[2], 'leader', ARGV[1])
+local extensions = tonumber(book[8] or '0') or 0
+local max_extensions = tonumber(ARGV[9])
+if end_ms > 0 and end_ms - now < tonumber(ARGV[5]) and (max_extensions == 0 or extensions < max_extensions) then
+    end_ms = end_ms + tonumber(ARGV[6])
+    redis.call('HSET', KEYS[1], 'end', end_ms, 'extensions', extensions + 1)
+    redis.call('PEXPIREAT', KEYS[1], end_ms + tonumber(ARGV[7]))
+end
+redis.call('RPUSH', KEYS[2], ARGV[8])
+return {'OK', book[6], tostring(end_ms)}
+"""
+
+# KEYS: flush lock, pending list
+# ARGV: owner token, entries written, lock TTL (ms)
+# Drops the written entries and renews the lock, only while it is still ours
+CONFIRM_SCRIPT = """
+if redis.call('GET', KEYS[1]) ~= ARGV[1] then
+    return 0
+end
+redis.call('LTRIM', KEYS[2], ARGV[2], -1)
+redis.call('PEXPIRE', KEYS[1], ARGV[3])
+return 1
+"""
+
+# Releases the flush lock unless it expired and another flusher took it
+RELEASE_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+
+def to_cents(amount):
+    return int(Decimal(str(amount)).quantize(CENT) * 100)
+
+
+def from_cents(cents):
+    return (Decimal(int(cents)) / 100).quantize(CENT)
+
+
+EPOCH = datetime(1970, 1, 1, tzinfo=dt_timezone.utc)
+
+
+def to_millis(dt):
+    # Integer arithmetic, a float round trip can lose the last millisecond
+    return (dt - EPOCH) // timedelta(milliseconds=1) if dt else 0
+
+
+def from_millis(ms):
+    ms = int(ms)
+    return datetime.fromtimestamp(ms / 1000, tz=dt_timezone.utc) if ms else None
+
+
+class BidBookBusy(Exception):
+    """
+    Another process held the flush lock for longer than the caller would wait.
+    """
+
+
+class BidBook:
+    """
+    Accepts bids against the in-memory book and persists them in batches.
+    """
+    PENDING_KEY = 'bidbook:pending'
+    FLUSH_LOCK_KEY = 'bidbook:flush-lock'
+    FLUSH_LOCK_POLL = 0.05
+    # Renewed after every batch, so only a single stuck batch can lose it
+    FLUSH_LOCK_TTL = timedelta(seconds=60)
+
+    # Keep closed books around long enough for late bids to be rejected
+    # from Redis and for the pending list to be flushed.
+    RETENTION = timedelta(hours=1)
+
+    def __init__(self, client):
+        self.redis = client
+        self._load = client.register_script(LOAD_SCRIPT)
+        self._place = client.register_script(PLACE_SCRIPT)
+        self._confirm = client.register_script(CONFIRM_SCRIPT)
+        self._release = client.register_script(RELEASE_SCRIPT)
+
+    @staticmethod
+    def book_key(product_id):
+        return f'bidbook:product:{product_id}'
+
+    def load(self, product):
+        """
+        Loads a product into the book from the database if it is not there yet.
+        Returns True when the book was populated by this call.
+        """
+        top_bid = Bid.objects.filter(product=product).order_by('-amount', 'timestamp', 'id').first()
+        expire_at = to_millis(product.auction_end_time + self.RETENTION) if product.auction_end_time else 0
+        return bool(self._load(
+            keys=[self.book_key(product.id)],
+            args=[
+                int(product.is_active),
+                int(product.sales_type == 'DIRECT'),
+                product.seller_id,
+                to_cents(product.initial_price or 0),
+                to_cents(top_bid.amount) if top_bid else 0,
+                top_bid.bidder_id if top_bid else '',
+                to_millis(product.auction_end_time),
+                expire_at,
+                product.extension_count,
+            ],
+        ))
+
+    def rebuild(self, product):
+        """
+        Reconciles the book for a product with the Bid table.
+        Pending bids are flushed first so none of them are lost; raises
+        BidBookBusy (and keeps the book) when that flush cannot run.
+        """
+        self.flush(wait=settings.BIDBOOK_FLUSH_WAIT)
+        self.redis.delete(self.book_key(product.id))
+        product = Product.objects.get(pk=product.pk)
+        return self.load(product)
+
+    def discard(self, product_id):
+        """
+        Drops a product from the book, e.g. once its auction has closed.
+        """
+        self.redis.delete(self.book_key(product_id))
+
+    def place(self, product, user, amount):
+        """
+        Accepts or rejects a bid atomically.
+        Returns a ``(previous_leader_id, auction_end_time)`` tuple on success
+        and raises ValidationError when the bid is rejected.
+        """
+        amount = Decimal(str(amount)).quantize(CENT)
+        now = timezone.now()
+        # Evaluated in the script against the book's own highest bid
+        rules = get_auction_rules()
+        increments = ' '.join(
+            f'{to_cents(band_min)}:{to_cents(increment)}'
+            for band_min, increment in rules.increment_table(product.category_id)
+        )
+        policy = rules.policy(product.category_id)
+        payload = json.dumps({
+            'product': product.id,
+            'bidder': user.id,
+            'amount': str(amount),
+            'at': to_millis(now),
+        })
+        args = [
+            user.id,
+            to_cents(amount),
+            to_millis(now),
+            increments,
+            int(policy.window.total_seconds() * 1000),
+            int(policy.extension.total_seconds() * 1000),
+            int(self.RETENTION.total_seconds() * 1000),
+            payload,
+            policy.max_extensions,
+        ]
+        keys = [self.book_key(product.id), self.PENDING_KEY]
+
+        result = self._place(keys=keys, args=args)
+        if result[0] == b'MISSING':
+            self.load(product)
+            result = self._place(keys=keys, args=args)
+
+        status = result[0].decode()
+        if status == 'ERR':
+            raise ValidationError(result[1].decode())
+        if status == 'MIN':
+            raise ValidationError(f"Bid must be at least {from_cents(result[1])}")
+        if status != 'OK':
+            raise ValidationError("This auction is not active.")
+
+        previous_leader = result[1].decode()
+        return (int(previous_leader) if previous_leader else None), from_millis(result[2])
+
+    def flush(self, batch_size=None, wait=None):
+        """
+        Writes pending bids to the database in batches.
+        Returns the number of Bid rows created.
+        By default a flush already running elsewhere makes this a no-op.
+        Callers that read the Bid table next (closing, rebuilding) pass
+        ``wait`` seconds instead: the other flusher's batch is not committed
+        yet, so this waits for the lock and raises BidBookBusy past ``wait``.
+        """
+        batch_size = batch_size or settings.BIDBOOK_FLUSH_BATCH_SIZE
+        # Only one flusher at a time, otherwise a batch could be written twice
+        token = uuid.uuid4().hex
+        ttl = int(self.FLUSH_LOCK_TTL.total_seconds() * 1000)
+        deadline = time.monotonic() + (wait or 0)
+        while not self.redis.set(self.FLUSH_LOCK_KEY, token, nx=True, px=ttl):
+            if wait is None:
+                return 0
+            if time.monotonic() >= deadline:
+                raise BidBookBusy(f"Bid book flush lock still held after {wait}s")
+            time.sleep(self.FLUSH_LOCK_POLL)
+
+        flushed = 0
+        try:
+            while True:
+                entries = self.redis.lrange(self.PENDING_KEY, 0, batch_size - 1)
+                if not entries:
+                    break
+                self._persist([json.loads(entry) for entry in entries])
+                # Entries are only dropped once they are safely in the database
+                if not self._confirm(keys=[self.FLUSH_LOCK_KEY, self.PENDING_KEY], args=[token, len(entries), ttl]):
+                    raise BidBookBusy("Bid book flush lock expired during a batch")
+                flushed += len(entries)
+        finally:
+            self._release(keys=[self.FLUSH_LOCK_KEY], args=[token])
+        return flushed
+
+    def _persist(self, entries):
+        batches = {}
+        for entry in entries:
+            batches.setdefault(entry['product'], []).append(entry)
+
+        # Stamped with the time the book accepted each bid, not the flush
+        # (entries queued before 'at' existed fall back to now)
+        now = timezone.now()
+        for entry in entries:
+            entry['at'] = from_millis(entry.get('at', 0)) or now
+
+        with transaction.atomic():
+            Bid.objects.bulk_create([
+                Bid(product_id=entry['product'], bidder_id=entry['bidder'], amount=Decimal(entry['amount']),
+                    timestamp=entry['at'])
+                for entry in entries
+            ])
+            # Mirror the book back onto the product rows for the HTML pages
+            for product_id, batch in batches.items():
+                # Accepted bids only ever go up, so the last one leads
+                leader = batch[-1]
+                fields = {
+                    'current_highest_bid': Decimal(leader['amount']),
+                    'leading_bidder_id': leader['bidder'],
+                    'bid_count': F('bid_count') + len(batch),
+                    'last_bid_at': leader['at'],
+                }
+                end, extensions = self.redis.hmget(self.book_key(product_id), 'end', 'extensions')
+                if end is not None:
+                    fields['auction_end_time'] = from_millis(end)
+                if extensions is not None:
+                    fields['extension_count'] = int(extensions)
+                Product.objects.filter(pk=product_id).update(**fields)
+
+
+_bid_book = None
+
+
+def get_bid_book():
+    global _bid_book
+    if _bid_book is None:
+        _bid_book = BidBook(redis.Redis.from_url(settings.BIDBOOK_REDIS_URL))
+    return _bid_book
@@ -0,0 +1,84 @@
+"""
+Caching for the home page sections.
+
+Section values live under a shared generation number; any write that
+changes which listings the home page shows or how they are labelled (new
+and edited listings, images, auction closes, category edits) bumps the
+generation, which orphans every cached section at once. Bids do not: prices
+and bid counts are refreshed by the sections' soft expiry. After it passes,
+one request recomputes the section while the others keep serving the stale
+copy, so a popular key never triggers a stampede of identical queries.
+"""
+import time
+
+from django.core.cache import cache
+from django.db import transaction
+
+GENERATION_KEY = 'home:generation'
+
+# How long a recomputing request may hold the single-flight lock
+LOCK_TIMEOUT = 10
+
+# How long a request waits for another one to fill a cold key
+COLD_WAIT = 2.0
+COLD_POLL = 0.05
+
+
+def _generation():
+    generation = cache.get(GENERATION_KEY)
+    if generation is None:
+        generation = 1
+        cache.add(GENERATION_KEY, generation, None)
+    return generation
+
+
+def invalidate_home_cache():
+    """
+    Orphans every cached home section once the current transaction commits.
+    """
+    def bump():
+        try:
+            cache.incr(GENERATION_KEY)
+        except ValueError:
+            cache.set(GENERATION_KEY, int(time.time()), None)
+
+    transaction.on_commit(bump)
+
+
+def cached_section(name, builder, ttl):
+    """
+    Returns the cached value of a home section, calling ``builder`` to
+    compute it at most once per expiry across concurrent requests.
+    """
+    key = f'home:{_generation()}:{name}'
+    lock_key = f'{key}:lock'
+
+    entry = cache.get(key)
+    if entry is not None:
+        value, soft_expiry = entry
+        if soft_expiry > time.time() or not cache.add(lock_key, 1, LOCK_TIMEOUT):
+            # Fresh, or someone else is already refreshing it
+            return value
+        return _refresh(key, lock_key, builder, ttl)
+
+    if cache.add(lock_key, 1, LOCK_TIMEOUT):
+        return _refresh(key, lock_key, builder, ttl)
+
+    # Cold key being computed by another request, wait for it briefly
+    deadline = time.monotonic() + COLD_WAIT
+    while time.monotonic() < deadline:
+        time.sleep(COLD_POLL)
+        entry = cache.get(key)
+        if entry is not None:
+            return entry[0]
+    return builder()
+
+
+def _refresh(key, lock_key, builder, ttl):
+    try:
+        value = builder()
+        # Keep the stale copy around for a while to serve during refreshes
+        cache.set(key, (value, time.time() + ttl), ttl * 10)
+        return value
+    finally:
+        cache.delete(lock_key)
@@ -1,27 +1,48 @@
 from django.shortcuts import render, get_object_or_404, redirect
 from django.contrib.auth.decorators import login_required
-from django.db import models, transaction
+from django.conf import settings
+from django.db import transaction
 from django.db.models import Q, Sum
-from .models import Product, Category, Bid, ProductImage
-from users.models import User, Wallet
+from .models import Product, Category, Bid, ProductImage, prefetch_first_image
+from users.models import User
+from users.ledger import InsufficientFunds, WalletLedger
 from .services import BidService
+from .search import ProductSearch
+from .pagination import KeysetPaginator
+from .cache import cached_section
+from .ingest import get_bid_ingest
+from .rules import get_auction_rules
+from nexus_core.metrics import CHECKOUTS, EMAIL_SEND, EMAILS
+from nexus_core.money import Money
 from django.core.exceptions import ValidationError
 from django.contrib import messages
-from decimal import Decimal, InvalidOperation
-from transactions.models import Transaction, Review
+from decimal import Decimal
+from transactions.models import PAID_STATUSES, Transaction, Review, SalesRollup
+from transactions.stats import DashboardStats
+import logging
+import time
 
-def home(request):
+logger = logging.getLogger(__name__)
+
+CATALOG_PAGE_SIZE = 24
+
+# Home page section cache lifetimes (seconds), see market/cache.py
+HOME_LISTINGS_TTL = 15
+HOME_CATEGORIES_TTL = 300
+HOME_USER_STATS_TTL = 30
+
+# Dashboard revenue chart lengths and review list size
+DASHBOARD_CHART_DAYS = 30
+DASHBOARD_CHART_MONTHS = 12
+DASHBOARD_REVIEWS = 20
+
+def _home_listings(query=None):
     # Base Query
-    all_products = Product.objects.filter(status='ACTIVE')
+    all_products = Product.objects.filter(status='ACTIVE').select_related('category').prefetch_related(prefetch_first_image())
     
     # 1. Search Query
-    query = request.GET.get('q')
     if query:
-        all_products = all_products.filter(
-            Q(title__icontains=query) | 
-            Q(description__icontains=query) |
-            Q(category__name__icontains=query)
-        )
+        all_products = ProductSearch.filter(all_products, query)
     else:
         all_products = all_products.order_by('-created_at')
 
@@ -38,22 +59,40 @@ def home(request):
     new_arrivals = all_products.filter(sales_type__in=['DIRECT', 'HYBRID'], is_variable_price=False).order_by('-created_at')[:4]
     
     # 5. Gift Cards (Featured)
-    gift_cards = Product.objects.filter(status='ACTIVE', is_variable_price=True)[:2]
+    gift_cards = Product.objects.filter(status='ACTIVE', is_variable_price=True).prefetch_related(prefetch_first_image())[:2]
+
+    return {
+        'hero_product': hero_product,
+        'hot_auctions': list(hot_auctions),
+        'new_arrivals': list(new_arrivals),
+        'featured_gift_cards': list(gift_cards),
+    }
 
-    # User Stats (Simplified)
+def _home_user_stats(user):
+    return {
+        'winning': Product.objects.filter(is_active=True, leading_bidder=user).count(),
+        'outbid': Product.objects.filter(is_active=True, bids__bidder=user).exclude(leading_bidder=user).distinct().count(),
+    }
+
+def home(request):
+    query = request.GET.get('q')
+    if query:
+        # Search results vary per query, only the default sections are cached
+        listings = _home_listings(query)
+    else:
+        listings = cached_section('listings', _home_listings, HOME_LISTINGS_TTL)
+
+    # User Stats (Simplified), cached per user apart from the shared sections
     user_stats = {}
     if request.user.is_authenticated:
-        user_stats['winning'] = Product.objects.filter(bids__bidder=request.user).distinct().count()
-        user_stats['outbid'] = 0 # Placeholder
+        user = request.user
+        user_stats = cached_section(f'user-stats:{user.id}', lambda: _home_user_stats(user), HOME_USER_STATS_TTL)
 
     # Get Categories for Sidebar
-    categories = Category.objects.all()
+    categories = cached_section('categories', lambda: list(Category.objects.all()), HOME_CATEGORIES_TTL)
 
     context = {
-        'hero_product': hero_product,
-        'hot_auctions': hot_auctions,
-        'new_arrivals': new_arrivals,
-        'featured_gift_cards': gift_cards,
+        **listings,
         'user_stats': user_stats,
         'query': query,
         'categories': categories
@@ -77,11 +116,8 @@ def catalog(request):
     # Search
     query = request.GET.get('q')
     if query:
-        products = products.filter(
-            Q(title__icontains=query) | 
-            Q(description__icontains=query) |
-            Q(category__name__icontains=query)
-        )
+        # Results are re-sorted below, relevance ranking is not needed
+        products = ProductSearch.filter(products, query, rank=False)
     
     # Filters
     min_price = request.GET.get('min_price')
@@ -96,23 +132,38 @@ def catalog(request):
     if sales_type: products = products.filter(sales_type=sales_type)
     if category_id: products = products.filter(category_id=category_id)
     
-    # Sort
+    # Sort (keyset pagination, see market/pagination.py)
     sort_by = request.GET.get('sort', 'newest')
-    if sort_by == 'price_asc': products = products.order_by('initial_price')
-    elif sort_by == 'price_desc': products = products.order_by('-initial_price')
-    elif sort_by == 'urgent': products = products.filter(sales_type__in=['AUCTION', 'HYBRID']).order_by('auction_end_time')
-    else: products = products.order_by('-created_at')
+    if sort_by == 'urgent': products = products.filter(sales_type__in=['AUCTION', 'HYBRID'])
+    # The seller carries the card's rating
+    products = products.select_related('category', 'seller').prefetch_related(prefetch_first_image())
+
+    paginator = KeysetPaginator(products, sort_by, per_page=CATALOG_PAGE_SIZE)
+    page = paginator.page(after=request.GET.get('after'), before=request.GET.get('before'))
+
+    filters = request.GET.copy()
+    filters.pop('after', None)
+    filters.pop('before', None)
+    total_count = paginator.cached_count(sorted(filters.lists()))
+
+    def page_url(param, cursor):
+        params = filters.copy()
+        params[param] = cursor
+        return f"?{params.urlencode()}"
     
     # Get all categories for filter
     categories = Category.objects.all()
 
     context = {
-        'products': products,
+        'products': page,
+        'total_count': total_count,
+        'next_url': page_url('after', page.next_cursor) if page.has_next else None,
+        'previous_url': page_url('before', page.previous_cursor) if page.has_previous else None,
         'categories': categories,
         'selected_category': int(category_id) if category_id else None,
         'selected_conditions': conditions, # Pass list for template check
         'selected_sales_type': sales_type,
-        'selected_sort': sort_by,
+        'selected_sort': paginator.sort,
         'min_price': min_price,
         'max_price': max_price,
     }
@@ -153,7 +204,25 @@ def create_product(request):
 @login_required
 def checkout(request, pk):
     product = get_object_or_404(Product, pk=pk)
-    
+
+    # A won auction is paid by settling the winner's PENDING transaction,
+    # the one settle_pending_transactions would otherwise charge
+    pending = Transaction.objects.filter(product=product, status='PENDING').first()
+    if pending is None:
+        paid = Transaction.objects.filter(product=product, status__in=PAID_STATUSES).first()
+        if paid and paid.buyer_id == request.user.id:
+            messages.info(request, "This purchase has already been paid.")
+            return redirect('order_success', pk=paid.id)
+        if paid or not product.is_active or product.status == 'SOLD':
+            messages.error(request, "This item is no longer available.")
+            return redirect('product_detail', pk=pk)
+    elif pending.buyer_id != request.user.id:
+        messages.error(request, "This item is reserved for the auction winner.")
+        return redirect('product_detail', pk=pk)
+
+    if request.method == 'POST' and pending:
+        return _pay_pending_transaction(request, pending.id)
+
     if request.method == 'POST':
         # 1. Determine Price
         # Check if we have a dynamic amount override (for Gift Cards)
@@ -161,9 +230,9 @@ def checkout(request, pk):
         
         if product.is_variable_price and dynamic_amount:
             try:
-                total_cost = Decimal(dynamic_amount)
-                if total_cost <= 0: raise ValueError
-            except:
+                total_cost = Money.parse(dynamic_amount).decimal
+            except ValidationError:
+                CHECKOUTS.labels('invalid_amount').inc()
                 messages.error(request, "Invalid amount entered.")
                 return redirect('product_detail', pk=pk)
         else:
@@ -172,21 +241,13 @@ def checkout(request, pk):
             total_cost = Decimal(str(price_val))
         
         # 2. Usamos un bloque atómico: o se hace todo, o no se hace nada
-        with transaction.atomic():
-            # Asegurar billeteras (get_or_create es más limpio)
-            buyer_wallet, _ = Wallet.objects.get_or_create(user=request.user)
-            seller_wallet, _ = Wallet.objects.get_or_create(user=product.seller)
-            
-            # Refrescamos el balance desde la BD para evitar errores de caché
-            if buyer_wallet.balance >= total_cost:
-                # Deduct from Buyer
-                buyer_wallet.balance -= total_cost
-                buyer_wallet.save()
-                
-                # Credit to Seller
-                seller_wallet.balance += total_cost
-                seller_wallet.save()
-                
+        try:
+            with transaction.atomic():
+                product = _lock_for_sale(pk)
+                if product is None:
+                    messages.error(request, "This item is no longer available.")
+                    return redirect('product_detail', pk=pk)
+
                 # Create Transaction record
                 txn = Transaction.objects.create(
                     buyer=request.user,
@@ -195,7 +256,11 @@ def checkout(request, pk):
                     amount=total_cost,
                     status='PAID'
                 )
-                
+
+                # One conditional UPDATE per wallet, rolled back with the
+                # transaction if the buyer cannot cover it
+                WalletLedger.transfer(request.user, product.seller, total_cost, reference=f"transaction:{txn.id}")
+
                 # Create Notifications
                 # 1. To Seller
                 Notification.objects.create(
@@ -209,44 +274,115 @@ def checkout(request, pk):
                     type='AUCTION_WON', # Reusing this type for direct purchase for now
                     message=f"You successfully purchased '{product.title}'!"
                 )
-                
+
                 # Update Product Status
                 product.status = 'SOLD'
                 product.is_active = False
                 product.save()
-                
-                return redirect('order_success', pk=txn.id)
-            else:
-                messages.error(request, "Insufficient funds in your wallet.")
-    
-    return render(request, 'market/checkout.html', {'product': product})
+
+            CHECKOUTS.labels('paid').inc()
+            return redirect('order_success', pk=txn.id)
+        except InsufficientFunds:
+            CHECKOUTS.labels('insufficient_funds').inc()
+            messages.error(request, "Insufficient funds in your wallet.")
+
+    price = pending.amount if pending else (product.buy_now_price or product.initial_price)
+    return render(request, 'market/checkout.html', {'product': product, 'price': price})
+
+
+def _lock_for_sale(product_id):
+    """
+    Locks a product for a direct purchase and returns it, or None once it
+    has closed, sold or an auction winner holds a transaction for it.
+    Closing claims the same row lock, so neither can slip in between.
+    """
+    product = (
+        Product.objects.select_for_update(of=('self',)).select_related('seller')
+        .filter(pk=product_id, is_active=True).exclude(status='SOLD').first()
+    )
+    if product is None or Transaction.objects.filter(product=product, status__in=('PENDING', *PAID_STATUSES)).exists():
+        return None
+    return product
+
+
+def _pay_pending_transaction(request, transaction_id):
+    try:
+        with transaction.atomic():
+            # Settlement skips a row locked here, and a settlement batch
+            # holding it makes this wait and then find it PAID
+            txn = (
+                Transaction.objects.select_for_update(of=('self',)).select_related('seller', 'product')
+                .filter(pk=transaction_id, status='PENDING').first()
+            )
+            if txn is None:
+                messages.info(request, "This purchase has already been paid.")
+                return redirect('order_success', pk=transaction_id)
+
+            WalletLedger.transfer(request.user, txn.seller, txn.amount, reference=f"transaction:{txn.id}")
+            txn.status = 'PAID'
+            txn.save()
+            Notification.objects.create(
+                user=txn.seller,
+                type='PAYMENT_SETTLED',
+                message=f"You received ${txn.amount} for '{txn.product.title}'."[:255],
+            )
+    except InsufficientFunds:
+        CHECKOUTS.labels('insufficient_funds').inc()
+        messages.error(request, "Insufficient funds in your wallet.")
+        return redirect('checkout', pk=txn.product_id)
+
+    CHECKOUTS.labels('paid').inc()
+    return redirect('order_success', pk=txn.id)
 
 
 def user_profile(request, pk):
-    from django.db.models import Avg
     user = get_object_or_404(User, pk=pk)
-    
-    avg_rating = user.received_reviews.aggregate(Avg('rating'))['rating__avg']
-    avg_rating = round(avg_rating, 1) if avg_rating else "N/A"
-    
-    return render(request, 'market/profile.html', {'profile_user': user, 'avg_rating': avg_rating})
+    avg_rating = user.rating_average if user.rating_count else "N/A"
+    # The cards and review rows read these relations, load them up front
+    listings = user.products.filter(is_active=True).prefetch_related(prefetch_first_image())
+    reviews = user.received_reviews.select_related('author', 'transaction__product')
+
+    return render(request, 'market/profile.html', {
+        'profile_user': user,
+        'avg_rating': avg_rating,
+        'listings': listings,
+        'reviews': reviews,
+    })
 
 @login_required
 def product_detail(request, pk):
-    from django.db.models import Avg
-    product = get_object_or_404(Product, pk=pk)
+    product = get_object_or_404(Product.objects.select_related('seller'), pk=pk)
     
-    # Seller Rating
-    seller_avg = product.seller.received_reviews.aggregate(Avg('rating'))['rating__avg']
-    seller_rating = round(seller_avg, 1) if seller_avg else "New"
+    # Seller Rating, stored on the user (users/ratings.py)
+    seller_rating = product.seller.rating_average if product.seller.rating_count else "New"
 
     if request.method == 'POST':
         action = request.POST.get('action')
+        # "Bid automatically up to this amount" stores a proxy maximum instead
+        auto_bid = request.POST.get('auto_bid') == 'on'
         
-        if action == 'bid':
-            amount = float(request.POST.get('amount'))
+        if action == 'bid' and settings.BID_INGEST_ENABLED:
+            # Queued for consume_bids, the result arrives on the live stream
+            try:
+                amount = Money.parse(request.POST.get('amount'))
+                request.session['bid_ticket'] = get_bid_ingest().submit(product, request.user, amount, max_bid=auto_bid)
+                messages.info(request, "Your bid has been received and is being processed.")
+            except ValidationError:
+                messages.error(request, "Invalid amount entered.")
+
+        elif action == 'bid' and auto_bid:
+            try:
+                product = BidService.set_max_bid(product, request.user, Money.parse(request.POST.get('amount')))
+                if product.leading_bidder_id == request.user.id:
+                    messages.success(request, f"You are the highest bidder at ${product.current_highest_bid}. We will bid for you up to your maximum.")
+                else:
+                    messages.warning(request, f"Another bidder's maximum is higher. The current bid is ${product.current_highest_bid}.")
+            except ValidationError as e:
+                messages.error(request, str(e))
+
+        elif action == 'bid':
             try:
-                BidService.place_bid(product, request.user, amount)
+                BidService.place_bid(product, request.user, Money.parse(request.POST.get('amount')))
                 messages.success(request, "Bid placed successfully!")
             except ValidationError as e:
                 messages.error(request, str(e))
@@ -257,76 +393,95 @@ def product_detail(request, pk):
             if not product.buy_now_price:
                 messages.error(request, "This item does not have a Buy Now price.")
             else:
-                # Create Transaction immediately
-                # Create Transaction immediately
-                # Ensure wallets
-                if not hasattr(request.user, 'wallet'): from users.models import Wallet; Wallet.objects.create(user=request.user)
-                if not hasattr(product.seller, 'wallet'): from users.models import Wallet; Wallet.objects.create(user=product.seller)
-
-                if request.user.wallet.balance >= product.buy_now_price:
-                    # Transfer
-                    request.user.wallet.balance -= product.buy_now_price
-                    request.user.wallet.save()
-                    product.seller.wallet.balance += product.buy_now_price
-                    product.seller.wallet.save()
-
-                    Transaction.objects.create(
-                        buyer=request.user,
-                        seller=product.seller,
-                        product=product,
-                        amount=product.buy_now_price,
-                        status='PAID'
-                    )
-                    product.status = 'SOLD'
-                    product.is_active = False
-                    product.save()
-                    messages.success(request, f"You successfully purchased {product.title}!")
-                    return redirect('home')
-                else:
+                try:
+                    with transaction.atomic():
+                        # A HYBRID auction may have closed, or been bought, since the page loaded
+                        product = _lock_for_sale(pk)
+                        if product is None:
+                            messages.error(request, "This item is no longer available.")
+                            return redirect('product_detail', pk=pk)
+                        txn = Transaction.objects.create(
+                            buyer=request.user,
+                            seller=product.seller,
+                            product=product,
+                            amount=product.buy_now_price,
+                            status='PAID'
+                        )
+                        WalletLedger.transfer(request.user, product.seller, product.buy_now_price,
+                                              reference=f"transaction:{txn.id}")
+                        product.status = 'SOLD'
+                        product.is_active = False
+                        product.save()
+                except InsufficientFunds:
+                    CHECKOUTS.labels('insufficient_funds').inc()
                     messages.error(request, "Insufficient funds.")
                     return redirect('product_detail', pk=pk)
+                CHECKOUTS.labels('paid').inc()
                 messages.success(request, f"You successfully purchased {product.title}!")
                 return redirect('home')
         
         return redirect('product_detail', pk=pk)
 
-    return render(request, 'product_detail.html', {'product': product, 'seller_rating': seller_rating})
+    # Top bids, served by the (product, -amount) index
+    top_bids = product.bids.select_related('bidder').order_by('-amount', 'timestamp', 'id')[:5]
+
+    # Live updates over SSE instead of reloading the page (market/streams.py)
+    bid_stream_url = None
+    if settings.BID_STREAM_ENABLED and product.is_active and product.sales_type != 'DIRECT':
+        bid_stream_url = f"{settings.BID_STREAM_BASE_URL}/stream/products/{product.id}/"
+    # Ticket of a bid queued by the previous POST, its result is pushed on the stream
+    bid_ticket = request.session.pop('bid_ticket', None)
+
+    return render(request, 'product_detail.html', {
+        'product': product,
+        'seller_rating': seller_rating,
+        'top_bids': top_bids,
+        'min_bid': BidService.minimum_bid(product),
+        # The step of the category's band the current bid falls in
+        'min_increment': get_auction_rules().increment(product.category_id, product.current_highest_bid),
+        'bid_stream_url': bid_stream_url,
+        'bid_ticket': bid_ticket,
+    })
 
 @login_required
 def dashboard(request):
     user = request.user
+    # Totals and revenue charts are materialized (transactions/stats.py)
+    stats = DashboardStats.for_user(user)
+
     # Stats
     active_products = Product.objects.filter(seller=user, is_active=True)
-    sold_products = Product.objects.filter(seller=user, is_active=False) # Simplified for now, should check Transaction
-    
-    # Calculate Total Sales from Transactions
-    total_sales = Transaction.objects.filter(seller=user, status='PAID').aggregate(total=models.Sum('amount'))['total'] or 0
-    total_orders = Transaction.objects.filter(seller=user, status='PAID').count()
     
     # Recent Sales (Seller)
-    recent_transactions = Transaction.objects.filter(seller=user).order_by('-transaction_date')[:5]
+    recent_transactions = Transaction.objects.filter(seller=user).select_related('product', 'buyer').order_by('-transaction_date')[:5]
 
     # --- BUYER STATS ---
-    purchases = Transaction.objects.filter(buyer=user).order_by('-transaction_date')
-    total_spent = purchases.aggregate(total=models.Sum('amount'))['total'] or 0
-    purchases_count = purchases.count()
+    purchases = (Transaction.objects.filter(buyer=user).select_related('product', 'seller')
+                 .prefetch_related(prefetch_first_image('product')).order_by('-transaction_date'))
 
     # --- REVIEWS ---
-    written_reviews = Review.objects.filter(author=user).order_by('-created_at')
+    written_reviews = (Review.objects.filter(author=user).select_related('transaction__product')
+                       .prefetch_related(prefetch_first_image('transaction__product')).order_by('-created_at'))
 
     context = {
         # Seller Context
         'active_count': active_products.count(),
-        'sold_count': sold_products.count(),
-        'total_sales': total_sales,
+        'sold_count': stats.sales_count,
+        'total_sales': stats.sales_total,
         'recent_transactions': recent_transactions,
-        'active_products': active_products,
+        'active_products': active_products.prefetch_related(prefetch_first_image()).order_by('-created_at')[:5],
+        'revenue_charts': [
+            (f"Revenue, last {DASHBOARD_CHART_DAYS} days",
+             DashboardStats.series(user, SalesRollup.Period.DAY, DASHBOARD_CHART_DAYS), "M d"),
+            (f"Revenue, last {DASHBOARD_CHART_MONTHS} months",
+             DashboardStats.series(user, SalesRollup.Period.MONTH, DASHBOARD_CHART_MONTHS), "M Y"),
+        ],
         
         # Buyer Context
-        'total_spent': total_spent,
-        'purchases_count': purchases_count,
+        'total_spent': stats.purchases_total,
+        'purchases_count': stats.purchases_count,
         'recent_purchases': purchases[:10], # Show last 10
-        'written_reviews': written_reviews,
+        'written_reviews': written_reviews[:DASHBOARD_REVIEWS],
     }
     return render(request, 'market/dashboard.html', context)
 
@@ -338,26 +493,16 @@ def order_success(request, pk):
 @login_required
 def deposit_funds(request):
     if request.method == 'POST':
-        amount_raw = request.POST.get('amount')
         try:
-            # Convertimos directamente a Decimal (usando el string del POST)
-            amount = Decimal(amount_raw)
-            
-            if amount > 0:
-                # Asegurar que el usuario tenga una billetera
-                # (Mejor usar get_or_create para evitar errores)
-                wallet, created = Wallet.objects.get_or_create(user=request.user)
-                
-                # Realizar la operación (Decimal + Decimal)
-                wallet.balance += amount
-                wallet.save()
-                
-                messages.success(request, f"Successfully deposited ${amount}!")
-                return redirect('dashboard')
-            else:
-                messages.error(request, "Amount must be positive.")
-        except (ValueError, InvalidOperation):
-            messages.error(request, "Invalid amount format.")
+            # Exact cents straight from the POSTed string, no float round trip
+            amount = Money.parse(request.POST.get('amount'))
+        except ValidationError as e:
+            messages.error(request, e.messages[0])
+        else:
+            WalletLedger.deposit(request.user, amount)
+
+            messages.success(request, f"Successfully deposited ${amount}!")
+            return redirect('dashboard')
             
     return render(request, 'market/deposit.html')
 
@@ -381,18 +526,22 @@ def contact(request):
         
         user_msg = f"Message from {name} <{email}>:\n\n{message}"
         
+        started = time.perf_counter()
         try:
-            send_mail(  
+            send_mail(
                 subject=f"Nexus Contact: {name}",
                 message=user_msg,
                 from_email=None, # Uses DEFAULT_FROM_EMAIL
                 recipient_list=['admin@nexus.com'], # Configure admin email
                 fail_silently=False,
             )
+            EMAIL_SEND.labels('contact', 'sent').observe(time.perf_counter() - started)
+            EMAILS.labels('contact').inc()
             messages.success(request, f"Thanks {name}! Your message has been sent. We'll get back to you shortly.")
         except Exception as e:
+            EMAIL_SEND.labels('contact', 'failed').observe(time.perf_counter() - started)
             messages.error(request, "Failed to send message. Please try again later.")
-            print(f"Email Error: {e}")
+            logger.error(f"Failed to send contact message: {e}")
             
         return redirect('contact')
     return render(request, 'pages/contact.html')
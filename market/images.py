@@ -0,0 +1,191 @@
+"""
+Product image variants.
+
+Uploads are stored as they arrive; listing cards and the product page then
+used to download the full-size original. ``ImagePipeline`` resizes every
+upload into a card-sized and a detail-sized variant, each as WebP and as a
+JPEG fallback, and records the pixel dimensions on ProductImage so
+templates can emit ``srcset`` and reserve the layout box (see the
+``product_image`` template tag).
+
+Decoding and encoding run in a process pool (IMAGE_PIPELINE_WORKERS), so a
+backfill uses every core and the GIL-bound Pillow work stays out of the
+parent; only bytes cross the process boundary and all storage and database
+access stays in the parent. New uploads are processed by the
+``process_product_images`` task once their row commits.
+"""
+import logging
+import multiprocessing
+import time
+from concurrent.futures import ProcessPoolExecutor
+from io import BytesIO
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.db import transaction
+
+logger = logging.getLogger(__name__)
+
+# Longest edge in pixels of each variant, and the CSS width the browser
+# should assume when picking from the srcset
+VARIANTS = {
+    'card': (480, '(min-width: 1024px) 20vw, (min-width: 640px) 33vw, 50vw'),
+    'detail': (1600, '(min-width: 1024px) 50vw, 100vw'),
+}
+WEBP_QUALITY = 80
+JPEG_QUALITY = 82
+
+VARIANT_DIR = 'products/variants'
+
+_pool = None
+
+
+def _encode(image, fmt, quality):
+    buffer = BytesIO()
+    if fmt == 'JPEG':
+        if image.mode in ('RGBA', 'LA', 'P'):
+            # JPEG has no alpha, flatten onto white like the card background
+            from PIL import Image
+            rgba = image.convert('RGBA')
+            image = Image.new('RGB', rgba.size, (255, 255, 255))
+            image.paste(rgba, mask=rgba.getchannel('A'))
+        elif image.mode != 'RGB':
+            image = image.convert('RGB')
+        image.save(buffer, 'JPEG', quality=quality, optimize=True, progressive=True)
+    else:
+        if image.mode not in ('RGB', 'RGBA'):
+            image = image.convert('RGBA' if 'A' in image.getbands() or image.mode == 'P' else 'RGB')
+        image.save(buffer, 'WEBP', quality=quality, method=4)
+    return buffer.getvalue()
+
+
+def render_variants(data):
+    """
+    Resizes the encoded image ``data``. Returns ``(width, height,
+    {name: (width, height, webp bytes, jpeg bytes)})``, or an error string.
+    Runs in the worker processes.
+    """
+    from PIL import Image, ImageOps
+
+    try:
+        with Image.open(BytesIO(data)) as original:
+            original = ImageOps.exif_transpose(original)
+            width, height = original.size
+            variants = {}
+            for name, (edge, _) in VARIANTS.items():
+                image = original.copy()
+                # Shrinks only, small uploads keep their size
+                image.thumbnail((edge, edge), Image.Resampling.LANCZOS)
+                variants[name] = (
+                    image.width, image.height,
+                    _encode(image, 'WEBP', WEBP_QUALITY),
+                    _encode(image, 'JPEG', JPEG_QUALITY),
+                )
+            return width, height, variants
+    except Exception as e:
+        return f"{type(e).__name__}: {e}"
+
+
+def _map(function, items):
+    global _pool
+    workers = settings.IMAGE_PIPELINE_WORKERS
+    # Celery prefork children are daemonic and may not start processes
+    if workers <= 1 or len(items) <= 1 or multiprocessing.current_process().daemon:
+        return list(map(function, items))
+    if _pool is None:
+        _pool = ProcessPoolExecutor(max_workers=workers)
+    return list(_pool.map(function, items))
+
+
+def is_current(image):
+    """
+    Whether the image's variants were rendered from its current file.
+    """
+    return bool(image.image) and image.variants.get('source') == image.image.name
+
+
+class ImagePipeline:
+    @staticmethod
+    def process(image_ids, force=False):
+        """
+        Renders and stores the variants of these ProductImages, skipping
+        ones that are current unless ``force``. Returns how many were
+        processed.
+        """
+        from .cache import invalidate_home_cache
+        from .models import ProductImage
+
+        images = [image for image in ProductImage.objects.filter(id__in=image_ids) if force or not is_current(image)]
+        originals = []
+        for image in images:
+            try:
+                with image.image.open('rb') as f:
+                    originals.append(f.read())
+            except (OSError, ValueError) as e:
+                logger.error(f"Cannot read product image {image.id}: {e}")
+                originals.append(None)
+
+        done = []
+        for image, data, result in zip(images, originals, _map(render_variants, [data or b'' for data in originals])):
+            if data is None:
+                continue
+            if isinstance(result, str):
+                logger.error(f"Cannot process product image {image.id}: {result}")
+                continue
+            image.width, image.height, variants = result
+            storage = image.image.storage
+            image.variants = {'source': image.image.name}
+            for name, (width, height, webp, jpeg) in variants.items():
+                stem = f'{VARIANT_DIR}/{image.id}-{name}-{width}x{height}'
+                image.variants[name] = {
+                    'width': width,
+                    'height': height,
+                    'webp': storage.save(f'{stem}.webp', ContentFile(webp)),
+                    'jpeg': storage.save(f'{stem}.jpg', ContentFile(jpeg)),
+                }
+            done.append(image)
+
+        ProductImage.objects.bulk_update(done, ['width', 'height', 'variants'])
+        if done:
+            # Cached listings hold the images without their variants
+            invalidate_home_cache()
+        return len(done)
+
+    @staticmethod
+    def process_pending(batch_size=100, force=False):
+        """
+        Processes every image without current variants (all of them with
+        ``force``). Returns ``(processed, seconds)``.
+        """
+        from .models import ProductImage
+
+        started = time.perf_counter()
+        ids = [
+            image.id for image in ProductImage.objects.only('id', 'image', 'variants').order_by('id')
+            if force or not is_current(image)
+        ]
+        processed = 0
+        for start in range(0, len(ids), batch_size):
+            processed += ImagePipeline.process(ids[start:start + batch_size], force=force)
+        return processed, time.perf_counter() - started
+
+    @staticmethod
+    def schedule(image_ids):
+        """
+        Queues the images for processing once the surrounding transaction
+        commits.
+        """
+        if not settings.IMAGE_PIPELINE_ENABLED or not image_ids:
+            return
+
+        from .tasks import process_product_images
+        image_ids = list(image_ids)
+
+        def enqueue():
+            try:
+                process_product_images.delay(image_ids)
+            except Exception as e:
+                # Picked up by manage.py process_images
+                logger.error(f"Failed to queue product images {image_ids}: {e}")
+
+        transaction.on_commit(enqueue)
@@ -0,0 +1,252 @@
+"""
+Bulk listing import.
+
+``ListingImporter`` creates a seller's listings from a CSV file (header
+row) or JSON Lines (one object per line) with the columns:
+
+    category, title, description, condition, location, sales_type,
+    initial_price, buy_now_price, reserve_price, auction_end_time
+
+``category`` is a category slug, ``buy_now_price``, ``reserve_price`` and
+``auction_end_time`` (ISO 8601) may be left empty, and AUCTION and HYBRID
+listings need an end time in the future.
+
+The input is read one line at a time from any binary stream (a file, stdin
+or the request body), validated in memory against a slug map of the
+categories loaded once, and inserted with ``bulk_create`` one batch per
+database transaction, so memory stays flat however long the file is and a
+failure only loses the batch it happened in. Rejected rows are handed to
+``on_reject`` with their line number and errors; manage.py import_listings
+writes them to a reject file.
+
+``bulk_create`` sends no post_save, so each batch bumps the home cache and
+schedules its auction closes itself.
+"""
+import csv
+import json
+import logging
+import time
+from decimal import Decimal
+
+from django.core.exceptions import ValidationError
+from django.db import DatabaseError, transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from nexus_core.money import Money
+from .cache import invalidate_home_cache
+from .models import Category, Product
+from .services import AuctionScheduler
+
+logger = logging.getLogger(__name__)
+
+FORMATS = ('csv', 'jsonl')
+
+# Listings per bulk_create and per database transaction
+BATCH_SIZE = 1000
+
+COLUMNS = (
+    'category', 'title', 'description', 'condition', 'location', 'sales_type',
+    'initial_price', 'buy_now_price', 'reserve_price', 'auction_end_time',
+)
+
+TEXT_LIMITS = {
+    'title': Product._meta.get_field('title').max_length,
+    'location': Product._meta.get_field('location').max_length,
+}
+CONDITIONS = frozenset(value for value, _ in Product.CONDITION_CHOICES)
+SALES_TYPES = frozenset(value for value, _ in Product.SALES_TYPE_CHOICES)
+AUCTION_TYPES = ('AUCTION', 'HYBRID')
+
+
+def guess_format(name):
+    """
+    ``'csv'`` or ``'jsonl'`` from a file name or a content type, else None.
+    """
+    name = (name or '').lower().split(';')[0].strip()
+    if name.endswith(('.csv', '/csv')):
+        return 'csv'
+    if name.endswith(('.jsonl', '.ndjson', '/jsonl', '/x-ndjson', '/jsonlines')):
+        return 'jsonl'
+    return None
+
+
+def _lines(stream):
+    for line in iter(stream.readline, b''):
+        yield line.decode('utf-8-sig')
+
+
+def read_rows(stream, fmt):
+    """
+    Yields ``(line number, row dict)`` from a binary stream, one line at a
+    time. A JSON line that does not parse is yielded as ``(line, None)``.
+    """
+    if fmt == 'csv':
+        # csv reassembles quoted values that span lines
+        reader = csv.DictReader(_lines(stream))
+        for row in reader:
+            yield reader.line_num, row
+        return
+
+    for number, line in enumerate(_lines(stream), start=1):
+        if not line.strip():
+            continue
+        try:
+            # Decimal keeps prices exactly as written
+            row = json.loads(line, parse_float=Decimal)
+        except ValueError:
+            row = None
+        yield number, row if isinstance(row, dict) else None
+
+
+def _text(row, field):
+    value = row.get(field)
+    if value is None:
+        return ''
+    return (value if isinstance(value, str) else str(value)).strip()
+
+
+def _amount(row, field, errors, required=False):
+    value = row.get(field)
+    if isinstance(value, str):
+        value = value.strip()
+    if value in (None, ''):
+        if required:
+            errors[field] = "This field is required."
+        return None
+    try:
+        return Money.parse(value).decimal
+    except ValidationError as e:
+        errors[field] = e.messages[0]
+        return None
+
+
+class ListingImporter:
+    def __init__(self, seller, batch_size=None, on_reject=None):
+        self.seller = seller
+        self.batch_size = batch_size or BATCH_SIZE
+        self.on_reject = on_reject
+        self.categories = dict(Category.objects.values_list('slug', 'id'))
+        self.now = timezone.now()
+
+    def build(self, row):
+        """
+        An unsaved Product for the row, or a ``{field: error}`` dict.
+        """
+        if row is None:
+            return {'row': "Not a JSON object."}
+        errors = {}
+        values = {field: _text(row, field) for field in ('category', 'title', 'description', 'condition', 'location')}
+        values['sales_type'] = _text(row, 'sales_type').upper() or 'DIRECT'
+        values['condition'] = values['condition'].upper()
+
+        for field, value in values.items():
+            if not value:
+                errors[field] = "This field is required."
+        for field, limit in TEXT_LIMITS.items():
+            if len(values[field]) > limit:
+                errors[field] = f"At most {limit} characters."
+        category_id = self.categories.get(values.pop('category'))
+        if category_id is None and 'category' not in errors:
+            errors['category'] = "Unknown category."
+        if values['condition'] and values['condition'] not in CONDITIONS:
+            errors['condition'] = "Not a valid choice."
+        if values['sales_type'] not in SALES_TYPES:
+            errors['sales_type'] = "Not a valid choice."
+
+        initial_price = _amount(row, 'initial_price', errors, required=True)
+        buy_now_price = _amount(row, 'buy_now_price', errors)
+        reserve_price = _amount(row, 'reserve_price', errors)
+
+        end_time = None
+        raw_end = _text(row, 'auction_end_time')
+        if raw_end:
+            try:
+                end_time = parse_datetime(raw_end)
+            except ValueError:
+                pass
+            if end_time is None:
+                errors['auction_end_time'] = "Not a valid ISO 8601 date and time."
+            elif timezone.is_naive(end_time):
+                end_time = timezone.make_aware(end_time)
+        if values['sales_type'] in AUCTION_TYPES and 'auction_end_time' not in errors:
+            if end_time is None:
+                errors['auction_end_time'] = "Required for auctions."
+            elif end_time <= self.now:
+                errors['auction_end_time'] = "Must be in the future."
+
+        if errors:
+            return errors
+        return Product(
+            seller=self.seller,
+            category_id=category_id,
+            initial_price=initial_price,
+            buy_now_price=buy_now_price,
+            reserve_price=reserve_price or Decimal('0.00'),
+            auction_end_time=end_time,
+            **values,
+        )
+
+    def _reject(self, line, errors, row):
+        if self.on_reject:
+            self.on_reject(line, errors, row)
+
+    def _insert(self, batch):
+        """
+        Creates one batch of ``(line, product, row)``. Returns how many were
+        created; a batch the database refuses is rejected whole.
+        """
+        products = [product for _, product, _ in batch]
+        try:
+            with transaction.atomic():
+                Product.objects.bulk_create(products)
+                # bulk_create sends no post_save
+                invalidate_home_cache()
+                AuctionScheduler.schedule_many(products)
+        except DatabaseError as e:
+            logger.error(f"Listing import batch at line {batch[0][0]} failed: {e}")
+            for line, _, row in batch:
+                self._reject(line, {'row': f"Database error: {e}"}, row)
+            return 0
+        return len(products)
+
+    def run(self, rows, max_rows=None):
+        """
+        Imports ``(line, row)`` pairs (see read_rows), stopping after
+        ``max_rows`` of them if given. Returns a throughput report;
+        ``truncated`` says whether rows were left unread.
+        """
+        started = time.perf_counter()
+        total = created = rejected = 0
+        truncated = False
+        batch = []
+        for line, row in rows:
+            if max_rows is not None and total >= max_rows:
+                truncated = True
+                break
+            total += 1
+            product = self.build(row)
+            if isinstance(product, dict):
+                rejected += 1
+                self._reject(line, product, row)
+                continue
+            batch.append((line, product, row))
+            if len(batch) >= self.batch_size:
+                inserted = self._insert(batch)
+                created += inserted
+                rejected += len(batch) - inserted
+                batch = []
+        if batch:
+            inserted = self._insert(batch)
+            created += inserted
+            rejected += len(batch) - inserted
+
+        seconds = time.perf_counter() - started
+        return {
+            'rows': total,
+            'created': created,
+            'rejected': rejected,
+            'truncated': truncated,
+            'seconds': round(seconds, 3),
+            'per_second': round(total / seconds, 1) if total and seconds else 0.0,
+        }
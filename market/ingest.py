@@ -0,0 +1,243 @@
+"""
+Asynchronous bid ingestion.
+
+With BID_INGEST_ENABLED, the bid endpoints hand bids to ``BidIngest.submit``
+instead of placing them inline. ``submit`` appends the bid to a Redis
+stream and returns a ticket straight away, so web workers never wait on a
+hot auction's row lock.
+
+Auctions are spread over BID_INGEST_SHARDS streams by product id. Each
+shard is applied by exactly one consumer (``manage.py consume_bids``),
+which calls ``BidService.place_bid`` for its entries in arrival order. Bids
+on the same auction are therefore serialized without contending for the
+lock. Results are written to the ticket, which clients poll at
+``/api/bid-tickets/<ticket>/``, and are also pushed as a ``ticket`` event on
+the product's live stream (market/streams.py).
+"""
+import logging
+import time
+import uuid
+import redis
+from django.conf import settings
+from django.core.exceptions import ValidationError
+
+from .models import Product, Bid, ProxyBid
+from .streams import BidStream
+from nexus_core.money import Money
+
+logger = logging.getLogger(__name__)
+
+PENDING = 'PENDING'
+ACCEPTED = 'ACCEPTED'
+REJECTED = 'REJECTED'
+
+
+class BidIngest:
+    GROUP = 'appliers'
+
+    # Approximate cap on entries kept per shard stream after being applied
+    STREAM_MAXLEN = 100_000
+
+    # How long a consumer owns its shard without renewing
+    OWNER_TTL = 30
+
+    def __init__(self, client, shards):
+        self.redis = client
+        self.shards = shards
+
+    @staticmethod
+    def stream_key(shard):
+        return f'bidingest:shard:{shard}'
+
+    @staticmethod
+    def owner_key(shard):
+        return f'bidingest:shard:{shard}:owner'
+
+    @staticmethod
+    def ticket_key(ticket):
+        return f'bidingest:ticket:{ticket}'
+
+    def shard_for(self, product_id):
+        return product_id % self.shards
+
+    def submit(self, product, user, amount, max_bid=False):
+        """
+        Queues a bid, or with ``max_bid`` a proxy maximum, and returns its
+        ticket id.
+        """
+        ticket = uuid.uuid4().hex
+        pipe = self.redis.pipeline()
+        pipe.hset(self.ticket_key(ticket), mapping={
+            'status': PENDING,
+            'product': product.id,
+            'bidder': user.id,
+            'amount': str(amount),
+            'message': '',
+        })
+        pipe.expire(self.ticket_key(ticket), settings.BID_INGEST_TICKET_TTL)
+        pipe.xadd(
+            self.stream_key(self.shard_for(product.id)),
+            {'ticket': ticket, 'product': product.id, 'bidder': user.id, 'amount': str(amount), 'max_bid': int(max_bid)},
+            maxlen=self.STREAM_MAXLEN,
+            approximate=True,
+        )
+        pipe.execute()
+        return ticket
+
+    def ticket(self, ticket):
+        """
+        Returns the state of a ticket as a dict, or None once it has expired.
+        """
+        data = self.redis.hgetall(self.ticket_key(ticket))
+        if not data:
+            return None
+        return {key.decode(): value.decode() for key, value in data.items()}
+
+    def claim(self, shard, consumer):
+        """
+        Takes or renews ownership of a shard. Only the owner applies its bids.
+        """
+        key = self.owner_key(shard)
+        if self.redis.set(key, consumer, nx=True, ex=self.OWNER_TTL):
+            return True
+        if self.redis.get(key) == consumer.encode():
+            self.redis.expire(key, self.OWNER_TTL)
+            return True
+        return False
+
+    def release(self, shard, consumer):
+        key = self.owner_key(shard)
+        if self.redis.get(key) == consumer.encode():
+            self.redis.delete(key)
+
+    def consume(self, shard, consumer, batch_size=100, block_ms=1000):
+        """
+        Applies one batch of bids from a shard. Entries left unacknowledged
+        by a previous owner (e.g. after a crash) are replayed first.
+        Returns the number of entries processed.
+        """
+        stream = self.stream_key(shard)
+        try:
+            self.redis.xgroup_create(stream, self.GROUP, id='0', mkstream=True)
+        except redis.ResponseError:
+            # Group already exists
+            pass
+
+        # Anything delivered before but never acknowledged, then new entries
+        pending = self.redis.xreadgroup(self.GROUP, consumer, {stream: '0'}, count=batch_size)
+        entries = pending[0][1] if pending else []
+        # Pending entries owned by another (dead) consumer name
+        if not entries:
+            claimed = self.redis.xautoclaim(stream, self.GROUP, consumer, min_idle_time=0, count=batch_size)
+            entries = claimed[1]
+        redelivered = bool(entries)
+        if not entries:
+            fresh = self.redis.xreadgroup(self.GROUP, consumer, {stream: '>'}, count=batch_size, block=block_ms)
+            entries = fresh[0][1] if fresh else []
+        if not entries:
+            return 0
+
+        self._apply(stream, entries, redelivered)
+        return len(entries)
+
+    def _apply(self, stream, entries, redelivered):
+        from users.models import User
+
+        bids = [
+            (entry_id, {key.decode(): value.decode() for key, value in fields.items()})
+            for entry_id, fields in entries
+        ]
+        products = Product.objects.in_bulk({int(fields['product']) for _, fields in bids})
+        users = User.objects.in_bulk({int(fields['bidder']) for _, fields in bids})
+
+        started = time.monotonic()
+        for entry_id, fields in bids:
+            ticket = fields['ticket']
+            # Replays are deduplicated on the ticket: a resolved one is only
+            # acknowledged, one a previous consumer started may have landed
+            interrupted = False
+            if redelivered:
+                state = self.ticket(ticket)
+                if state and state['status'] != PENDING:
+                    # Resolved before the previous consumer could acknowledge it
+                    self.redis.xack(stream, self.GROUP, entry_id)
+                    continue
+                interrupted = state is None or bool(state.get('applying'))
+            self._mark(ticket, applying=1)
+            status, message = self._place(products, users, fields, interrupted)
+            self._resolve(ticket, int(fields['product']), status, message)
+            self.redis.xack(stream, self.GROUP, entry_id)
+
+        elapsed = time.monotonic() - started
+        logger.info(f"Applied {len(bids)} queued bids from {stream} in {elapsed:.3f}s")
+
+    def _place(self, products, users, fields, interrupted):
+        from .services import BidService
+
+        product = products.get(int(fields['product']))
+        user = users.get(int(fields['bidder']))
+        if not product or not user:
+            return REJECTED, "This auction is not active."
+
+        try:
+            amount = Money.parse(fields['amount']).decimal
+        except ValidationError as e:
+            return REJECTED, ' '.join(e.messages)
+
+        if fields.get('max_bid') == '1':
+            place, applied = BidService.set_max_bid, ProxyBid.objects.filter(product=product, bidder=user, max_amount=amount)
+        else:
+            place, applied = BidService.place_bid, Bid.objects.filter(product=product, bidder=user, amount=amount)
+
+        # The previous consumer died while placing this entry, it may have landed
+        if interrupted:
+            if settings.BIDBOOK_ENABLED:
+                # Bids accepted by the book are written behind, bring them in first
+                from .bidbook import get_bid_book
+                get_bid_book().flush(wait=settings.BIDBOOK_FLUSH_WAIT)
+            if applied.exists():
+                return ACCEPTED, "Bid placed successfully!"
+
+        try:
+            # Both return the updated product, keep it for the next bid in the batch
+            products[product.id] = place(product, user, amount)
+            return ACCEPTED, "Bid placed successfully!"
+        except ValidationError as e:
+            return REJECTED, ' '.join(e.messages)
+        except Exception:
+            logger.exception(f"Failed to apply bid ticket {fields['ticket']}")
+            return REJECTED, "An error occurred."
+
+    def _mark(self, ticket, **fields):
+        key = self.ticket_key(ticket)
+        pipe = self.redis.pipeline()
+        pipe.hset(key, mapping=fields)
+        pipe.expire(key, settings.BID_INGEST_TICKET_TTL)
+        pipe.execute()
+
+    def _resolve(self, ticket, product_id, status, message):
+        self._mark(ticket, status=status, message=message)
+        BidStream.publish_many([(product_id, 'ticket', {'ticket': ticket, 'status': status, 'message': message})])
+
+
+def ticket_payload(ticket, state):
+    """
+    Public representation of a ticket for the API.
+    """
+    return {
+        'ticket': ticket,
+        'status': state['status'],
+        'message': state['message'],
+        'product': int(state['product']),
+        'amount': state['amount'],
+    }
+
+
+_bid_ingest = None
+
+
+def get_bid_ingest():
+    global _bid_ingest
+    if _bid_ingest is None:
+        _bid_ingest = BidIngest(redis.Redis.from_url(settings.BID_INGEST_REDIS_URL), settings.BID_INGEST_SHARDS)
+    return _bid_ingest
@@ -0,0 +1,60 @@
+import os
+import socket
+import threading
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+from market.ingest import get_bid_ingest
+
+
+class Command(BaseCommand):
+    help = ('Applies queued bids (BID_INGEST_ENABLED). Owns every shard it can claim and '
+            'applies each one in order on its own thread; extra instances wait as standbys.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--shard', type=int, action='append', help='Only consume these shards (repeatable).')
+        parser.add_argument('--batch-size', type=int, default=100)
+
+    def handle(self, *args, **options):
+        ingest = get_bid_ingest()
+        shards = options['shard'] or list(range(ingest.shards))
+        consumer = f'{socket.gethostname()}-{os.getpid()}'
+        stop = threading.Event()
+
+        threads = [
+            threading.Thread(target=self.run_shard, args=(ingest, shard, consumer, options['batch_size'], stop), daemon=True)
+            for shard in shards
+        ]
+        for thread in threads:
+            thread.start()
+        self.stdout.write(f"Consumer {consumer} watching shards {shards}")
+
+        try:
+            while any(thread.is_alive() for thread in threads):
+                time.sleep(1)
+        except KeyboardInterrupt:
+            stop.set()
+            for thread in threads:
+                thread.join()
+        for shard in shards:
+            ingest.release(shard, consumer)
+
+    def run_shard(self, ingest, shard, consumer, batch_size, stop):
+        owned = False
+        while not stop.is_set():
+            if not ingest.claim(shard, consumer):
+                if owned:
+                    self.stderr.write(f"Lost ownership of shard {shard}")
+                owned = False
+                time.sleep(ingest.OWNER_TTL / 3)
+                continue
+            if not owned:
+                self.stdout.write(f"Applying bids for shard {shard}")
+                owned = True
+            close_old_connections()
+            try:
+                ingest.consume(shard, consumer, batch_size=batch_size)
+            except Exception as e:
+                self.stderr.write(f"Shard {shard}: {e}")
+                time.sleep(1)
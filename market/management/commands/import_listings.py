@@ -0,0 +1,50 @@
+import json
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+from market.importer import BATCH_SIZE, FORMATS, ListingImporter, guess_format, read_rows
+from users.models import User
+
+
+class Command(BaseCommand):
+    help = ('Creates listings for a seller from a CSV or JSON Lines file ("-" reads stdin), streamed in '
+            'batches; rows that fail validation are written to a reject file as JSON Lines.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('path')
+        parser.add_argument('--seller', required=True, help='Username or id of the seller.')
+        parser.add_argument('--format', choices=FORMATS, help='Defaults to the file extension.')
+        parser.add_argument('--batch-size', type=int, default=BATCH_SIZE)
+        parser.add_argument('--rejects', help='Reject file, defaults to <path>.rejects.jsonl.')
+
+    def handle(self, *args, **options):
+        path = options['path']
+        fmt = options['format'] or guess_format(path)
+        if fmt is None:
+            raise CommandError('Cannot tell the format from the file name, pass --format.')
+
+        seller = options['seller']
+        lookup = {'pk': int(seller)} if seller.isdigit() else {'username': seller}
+        try:
+            seller = User.objects.get(**lookup)
+        except User.DoesNotExist:
+            raise CommandError(f"Unknown seller '{options['seller']}'.")
+
+        rejects_path = options['rejects'] or ('rejects.jsonl' if path == '-' else f'{path}.rejects.jsonl')
+        try:
+            source = sys.stdin.buffer if path == '-' else open(path, 'rb')
+        except OSError as e:
+            raise CommandError(str(e))
+
+        with source, open(rejects_path, 'w', encoding='utf-8') as rejects:
+            def on_reject(line, errors, row):
+                rejects.write(json.dumps({'line': line, 'errors': errors, 'row': row}, default=str) + '\n')
+
+            importer = ListingImporter(seller, batch_size=options['batch_size'], on_reject=on_reject)
+            report = importer.run(read_rows(source, fmt))
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Imported {report['created']} of {report['rows']} rows in {report['seconds']:.2f}s "
+            f"({report['per_second']:.1f} rows/s)."))
+        if report['rejected']:
+            self.stdout.write(self.style.WARNING(f"{report['rejected']} rejected rows written to {rejects_path}."))
@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+from market.images import ImagePipeline
+
+
+class Command(BaseCommand):
+    help = ('Renders the card and detail variants of product images that have none or whose file changed '
+            '(backfill), in a pool of IMAGE_PIPELINE_WORKERS processes.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=100)
+        parser.add_argument('--all', action='store_true', help='Re-render every image, e.g. after changing the variant sizes.')
+
+    def handle(self, *args, **options):
+        processed, seconds = ImagePipeline.process_pending(options['batch_size'], force=options['all'])
+        rate = processed / seconds if processed and seconds else 0.0
+        self.stdout.write(self.style.SUCCESS(
+            f"Processed {processed} images in {seconds:.2f}s ({rate:.1f} images/s)."))
@@ -0,0 +1,10 @@
+from django.core.management.base import BaseCommand
+from market.tasks import rebuild_bid_books
+
+
+class Command(BaseCommand):
+    help = 'Rebuilds the Redis bid book of every active auction from the Bid table.'
+
+    def handle(self, *args, **kwargs):
+        result = rebuild_bid_books()
+        self.stdout.write(self.style.SUCCESS(result))
@@ -0,0 +1,19 @@
+# Generated by Django 5.2.18 on 2026-10-17 20:42
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('market', '0004_product_is_variable_price'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['is_active', 'auction_end_time'], name='market_prod_is_acti_c402c6_idx'),
+        ),
+    ]
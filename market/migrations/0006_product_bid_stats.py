@@ -0,0 +1,55 @@
+# Generated by Django 5.2.18 on 2026-10-17 20:45
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, Max, OuterRef, Subquery
+
+
+def backfill_bid_stats(apps, schema_editor):
+    Product = apps.get_model('market', 'Product')
+    Bid = apps.get_model('market', 'Bid')
+
+    top_bidder = Bid.objects.filter(product=OuterRef('pk')).order_by('-amount', 'timestamp').values('bidder_id')[:1]
+    products = Product.objects.filter(bids__isnull=False).distinct().annotate(
+        num_bids=Count('bids'),
+        latest_bid=Max('bids__timestamp'),
+        top_bidder=Subquery(top_bidder),
+    )
+    for product in products.iterator():
+        Product.objects.filter(pk=product.pk).update(
+            bid_count=product.num_bids,
+            last_bid_at=product.latest_bid,
+            leading_bidder_id=product.top_bidder,
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('market', '0005_product_active_end_time_index'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='bid_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='last_bid_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='leading_bidder',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='leading_products', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddIndex(
+            model_name='bid',
+            index=models.Index(fields=['product', '-amount'], name='market_bid_product_bd5fb9_idx'),
+        ),
+        migrations.RunPython(backfill_bid_stats, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,120 @@
+# Generated by Django 5.2.18 on 2026-10-17 20:46
+
+import django.contrib.postgres.search
+from django.db import migrations
+
+
+POSTGRES_FORWARD = [
+    """
+    CREATE OR REPLACE FUNCTION market_product_search_vector_update() RETURNS trigger AS $$
+    BEGIN
+        NEW.search_vector :=
+            setweight(to_tsvector('english', coalesce(NEW.title, '')), 'A') ||
+            setweight(to_tsvector('english', coalesce(
+                (SELECT name FROM market_category WHERE id = NEW.category_id), '')), 'B') ||
+            setweight(to_tsvector('english', coalesce(NEW.description, '')), 'C');
+        RETURN NEW;
+    END
+    $$ LANGUAGE plpgsql;
+    """,
+    """
+    CREATE TRIGGER market_product_search_vector_trigger
+    BEFORE INSERT OR UPDATE OF title, description, category_id ON market_product
+    FOR EACH ROW EXECUTE FUNCTION market_product_search_vector_update();
+    """,
+    # Renaming a category re-indexes its products
+    """
+    CREATE OR REPLACE FUNCTION market_category_search_vector_update() RETURNS trigger AS $$
+    BEGIN
+        UPDATE market_product SET title = title WHERE category_id = NEW.id;
+        RETURN NEW;
+    END
+    $$ LANGUAGE plpgsql;
+    """,
+    """
+    CREATE TRIGGER market_category_search_vector_trigger
+    AFTER UPDATE OF name ON market_category
+    FOR EACH ROW WHEN (OLD.name IS DISTINCT FROM NEW.name)
+    EXECUTE FUNCTION market_category_search_vector_update();
+    """,
+    "CREATE INDEX market_product_search_vector_gin ON market_product USING GIN (search_vector);",
+    "UPDATE market_product SET title = title;",
+]
+
+POSTGRES_REVERSE = [
+    "DROP INDEX IF EXISTS market_product_search_vector_gin;",
+    "DROP TRIGGER IF EXISTS market_category_search_vector_trigger ON market_category;",
+    "DROP FUNCTION IF EXISTS market_category_search_vector_update();",
+    "DROP TRIGGER IF EXISTS market_product_search_vector_trigger ON market_product;",
+    "DROP FUNCTION IF EXISTS market_product_search_vector_update();",
+]
+
+SQLITE_FORWARD = [
+    "CREATE VIRTUAL TABLE market_product_fts USING fts5(title, description, category, tokenize = 'porter unicode61');",
+    """
+    CREATE TRIGGER market_product_fts_insert AFTER INSERT ON market_product BEGIN
+        INSERT INTO market_product_fts (rowid, title, description, category)
+        VALUES (NEW.id, NEW.title, NEW.description,
+                (SELECT name FROM market_category WHERE id = NEW.category_id));
+    END;
+    """,
+    """
+    CREATE TRIGGER market_product_fts_update AFTER UPDATE OF title, description, category_id ON market_product BEGIN
+        DELETE FROM market_product_fts WHERE rowid = OLD.id;
+        INSERT INTO market_product_fts (rowid, title, description, category)
+        VALUES (NEW.id, NEW.title, NEW.description,
+                (SELECT name FROM market_category WHERE id = NEW.category_id));
+    END;
+    """,
+    """
+    CREATE TRIGGER market_product_fts_delete AFTER DELETE ON market_product BEGIN
+        DELETE FROM market_product_fts WHERE rowid = OLD.id;
+    END;
+    """,
+    """
+    CREATE TRIGGER market_category_fts_update AFTER UPDATE OF name ON market_category BEGIN
+        UPDATE market_product_fts SET category = NEW.name
+        WHERE rowid IN (SELECT id FROM market_product WHERE category_id = NEW.id);
+    END;
+    """,
+    """
+    INSERT INTO market_product_fts (rowid, title, description, category)
+    SELECT p.id, p.title, p.description, c.name
+    FROM market_product p LEFT JOIN market_category c ON c.id = p.category_id;
+    """,
+]
+
+SQLITE_REVERSE = [
+    "DROP TRIGGER IF EXISTS market_category_fts_update;",
+    "DROP TRIGGER IF EXISTS market_product_fts_delete;",
+    "DROP TRIGGER IF EXISTS market_product_fts_update;",
+    "DROP TRIGGER IF EXISTS market_product_fts_insert;",
+    "DROP TABLE IF EXISTS market_product_fts;",
+]
+
+
+def run_statements(forward):
+    def run(apps, schema_editor):
+        statements = {
+            'postgresql': POSTGRES_FORWARD if forward else POSTGRES_REVERSE,
+            'sqlite': SQLITE_FORWARD if forward else SQLITE_REVERSE,
+        }.get(schema_editor.connection.vendor, [])
+        for statement in statements:
+            schema_editor.execute(statement)
+    return run
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('market', '0006_product_bid_stats'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True),
+        ),
+        migrations.RunPython(run_statements(forward=True), run_statements(forward=False)),
+    ]
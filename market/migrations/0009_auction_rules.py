@@ -0,0 +1,64 @@
+# Generated by Django 5.2.18 on 2026-10-17 21:14
+
+from importlib import import_module
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+# SQLite rebuilds market_product to add a column, which its FTS triggers
+# (0007_product_search) do not survive; they are dropped and recreated around it
+search = import_module('market.migrations.0007_product_search')
+SQLITE_TRIGGERS = [statement for statement in search.SQLITE_FORWARD if 'CREATE TRIGGER' in statement]
+SQLITE_DROP_TRIGGERS = [statement for statement in search.SQLITE_REVERSE if 'DROP TRIGGER' in statement]
+
+
+def sqlite_triggers(create):
+    def run(apps, schema_editor):
+        if schema_editor.connection.vendor != 'sqlite':
+            return
+        for statement in SQLITE_TRIGGERS if create else SQLITE_DROP_TRIGGERS:
+            schema_editor.execute(statement)
+    return run
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('market', '0008_proxybid'),
+    ]
+
+    operations = [
+        migrations.RunPython(sqlite_triggers(create=False), sqlite_triggers(create=True)),
+        migrations.AddField(
+            model_name='product',
+            name='extension_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(sqlite_triggers(create=True), sqlite_triggers(create=False)),
+        migrations.CreateModel(
+            name='SniperPolicy',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('window_seconds', models.PositiveIntegerField(default=30)),
+                ('extension_seconds', models.PositiveIntegerField(default=60)),
+                ('max_extensions', models.PositiveIntegerField(default=0)),
+                ('category', models.OneToOneField(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='sniper_policy', to='market.category')),
+            ],
+            options={
+                'verbose_name_plural': 'Sniper policies',
+            },
+        ),
+        migrations.CreateModel(
+            name='IncrementBand',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('min_amount', models.DecimalField(decimal_places=2, default=0, max_digits=10)),
+                ('increment', models.DecimalField(decimal_places=2, max_digits=10)),
+                ('category', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='increment_bands', to='market.category')),
+            ],
+            options={
+                'ordering': ['category', 'min_amount'],
+                'constraints': [models.UniqueConstraint(fields=('category', 'min_amount'), name='unique_increment_band')],
+            },
+        ),
+    ]
@@ -0,0 +1,102 @@
+from django.db import migrations
+
+
+# Django's save() writes every column, so the triggers of 0007 ("UPDATE OF
+# title, description, category_id") also fired on every bid. Only a changed
+# title, description or category re-indexes the product now.
+
+POSTGRES_FORWARD = [
+    "DROP TRIGGER IF EXISTS market_product_search_vector_trigger ON market_product;",
+    """
+    CREATE TRIGGER market_product_search_vector_insert
+    BEFORE INSERT ON market_product
+    FOR EACH ROW EXECUTE FUNCTION market_product_search_vector_update();
+    """,
+    """
+    CREATE TRIGGER market_product_search_vector_trigger
+    BEFORE UPDATE OF title, description, category_id ON market_product
+    FOR EACH ROW WHEN (
+        OLD.title IS DISTINCT FROM NEW.title
+        OR OLD.description IS DISTINCT FROM NEW.description
+        OR OLD.category_id IS DISTINCT FROM NEW.category_id
+    )
+    EXECUTE FUNCTION market_product_search_vector_update();
+    """,
+    # A renamed category re-indexes its products directly, "SET title = title"
+    # no longer fires the product trigger
+    """
+    CREATE OR REPLACE FUNCTION market_category_search_vector_update() RETURNS trigger AS $$
+    BEGIN
+        UPDATE market_product SET search_vector =
+            setweight(to_tsvector('english', coalesce(title, '')), 'A') ||
+            setweight(to_tsvector('english', coalesce(NEW.name, '')), 'B') ||
+            setweight(to_tsvector('english', coalesce(description, '')), 'C')
+        WHERE category_id = NEW.id;
+        RETURN NEW;
+    END
+    $$ LANGUAGE plpgsql;
+    """,
+]
+
+POSTGRES_REVERSE = [
+    """
+    CREATE OR REPLACE FUNCTION market_category_search_vector_update() RETURNS trigger AS $$
+    BEGIN
+        UPDATE market_product SET title = title WHERE category_id = NEW.id;
+        RETURN NEW;
+    END
+    $$ LANGUAGE plpgsql;
+    """,
+    "DROP TRIGGER IF EXISTS market_product_search_vector_trigger ON market_product;",
+    "DROP TRIGGER IF EXISTS market_product_search_vector_insert ON market_product;",
+    """
+    CREATE TRIGGER market_product_search_vector_trigger
+    BEFORE INSERT OR UPDATE OF title, description, category_id ON market_product
+    FOR EACH ROW EXECUTE FUNCTION market_product_search_vector_update();
+    """,
+]
+
+SQLITE_UPDATE_TRIGGER = """
+    CREATE TRIGGER market_product_fts_update AFTER UPDATE OF title, description, category_id ON market_product
+    {guard}BEGIN
+        DELETE FROM market_product_fts WHERE rowid = OLD.id;
+        INSERT INTO market_product_fts (rowid, title, description, category)
+        VALUES (NEW.id, NEW.title, NEW.description,
+                (SELECT name FROM market_category WHERE id = NEW.category_id));
+    END;
+"""
+
+SQLITE_FORWARD = [
+    "DROP TRIGGER IF EXISTS market_product_fts_update;",
+    SQLITE_UPDATE_TRIGGER.format(guard=(
+        "WHEN OLD.title IS NOT NEW.title OR OLD.description IS NOT NEW.description"
+        " OR OLD.category_id IS NOT NEW.category_id\n    "
+    )),
+]
+
+SQLITE_REVERSE = [
+    "DROP TRIGGER IF EXISTS market_product_fts_update;",
+    SQLITE_UPDATE_TRIGGER.format(guard=''),
+]
+
+
+def run_statements(forward):
+    def run(apps, schema_editor):
+        statements = {
+            'postgresql': POSTGRES_FORWARD if forward else POSTGRES_REVERSE,
+            'sqlite': SQLITE_FORWARD if forward else SQLITE_REVERSE,
+        }.get(schema_editor.connection.vendor, [])
+        for statement in statements:
+            schema_editor.execute(statement)
+    return run
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('market', '0010_image_variants'),
+    ]
+
+    operations = [
+        migrations.RunPython(run_statements(forward=True), run_statements(forward=False)),
+    ]
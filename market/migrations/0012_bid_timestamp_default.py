@@ -0,0 +1,19 @@
+# Generated by Django 5.2.18 on 2026-10-17 22:14
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('market', '0011_product_search_trigger_guard'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='bid',
+            name='timestamp',
+            field=models.DateTimeField(default=django.utils.timezone.now, editable=False),
+        ),
+    ]
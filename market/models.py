@@ -1,6 +1,17 @@
 from django.db import models
 from django.conf import settings
+from django.contrib.postgres.search import SearchVectorField
+from django.db.models import F, Prefetch, Window
+from django.db.models.functions import RowNumber
 from django.utils.text import slugify
+from django.utils import timezone
+
+# Marks a field that was deferred when the row was loaded
+UNKNOWN = object()
+
+# Fields deciding which listings the cached home sections show and how they are
+# labelled; prices and bid counts are left to the sections' soft TTL
+HOME_FIELDS = ('title', 'status', 'is_active', 'category_id', 'sales_type', 'is_variable_price')
 
 class Category(models.Model):
     name = models.CharField(max_length=100)
@@ -55,26 +66,201 @@ class Product(models.Model):
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='ACTIVE')
     is_active = models.BooleanField(default=True) # Keeping for backward compatibility temporarily
     is_variable_price = models.BooleanField(default=False, help_text="If true, price defaults to 0 and user selects amount.")
+
+    # Denormalized bid statistics, maintained by BidService.place_bid
+    bid_count = models.PositiveIntegerField(default=0)
+    leading_bidder = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.SET_NULL, null=True, blank=True, related_name='leading_products')
+    last_bid_at = models.DateTimeField(null=True, blank=True)
+    # Sniper protection extensions granted so far (see SniperPolicy.max_extensions)
+    extension_count = models.PositiveIntegerField(default=0)
+
+    # Maintained by a database trigger on PostgreSQL, see market/search.py
+    search_vector = SearchVectorField(null=True, editable=False)
     
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    class Meta:
+        indexes = [
+            # Safety-net scan in close_expired_auctions
+            models.Index(fields=['is_active', 'auction_end_time']),
+        ]
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # The end time the queued close task was scheduled for
+        instance._auction_end_time_loaded = instance.__dict__.get('auction_end_time', UNKNOWN)
+        # What the cached home sections show of this row
+        instance._home_key_loaded = instance.home_key()
+        return instance
+
+    def home_key(self):
+        """
+        The HOME_FIELDS values, or UNKNOWN when one of them is deferred.
+        """
+        fields = self.__dict__
+        if any(name not in fields for name in HOME_FIELDS):
+            return UNKNOWN
+        return tuple(fields[name] for name in HOME_FIELDS)
+
     def __str__(self):
         return self.title
 
+    @property
+    def first_image(self):
+        """
+        First image in display order. Served from the ``first_images``
+        prefetch (see prefetch_first_image) when the queryset used it.
+        """
+        if hasattr(self, 'first_images'):
+            return self.first_images[0] if self.first_images else None
+        return self.images.first()
+
 class ProductImage(models.Model):
     product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='images')
     image = models.ImageField(upload_to='products/')
     order = models.PositiveIntegerField(default=0)
+    # Filled in by the image pipeline (market/images.py)
+    width = models.PositiveIntegerField(null=True, blank=True)
+    height = models.PositiveIntegerField(null=True, blank=True)
+    # {'source': image name, 'card': {'width', 'height', 'webp', 'jpeg'}, 'detail': {...}}
+    variants = models.JSONField(default=dict, blank=True)
 
     class Meta:
         ordering = ['order']
 
+def prefetch_first_image(through=None):
+    """
+    Prefetches only the first image of each product into ``first_images``
+    instead of every image, for listing cards. ``through`` is the relation
+    leading to the product when prefetching from another model, e.g.
+    ``'product'`` for transactions.
+    """
+    first_images = ProductImage.objects.annotate(
+        position=Window(RowNumber(), partition_by=F('product_id'), order_by=[F('order').asc(), F('id').asc()])
+    ).filter(position=1)
+    lookup = f'{through}__images' if through else 'images'
+    return Prefetch(lookup, queryset=first_images, to_attr='first_images')
+
 class Bid(models.Model):
     bidder = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='bids')
     product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='bids')
     amount = models.DecimalField(max_digits=10, decimal_places=2)
-    timestamp = models.DateTimeField(auto_now_add=True)
+    # Not auto_now_add, the bid book writes bids behind with the time it accepted them
+    timestamp = models.DateTimeField(default=timezone.now, editable=False)
+
+    class Meta:
+        indexes = [
+            # Top N bids per product
+            models.Index(fields=['product', '-amount']),
+        ]
 
     def __str__(self):
         return f"{self.amount} on {self.product.title} by {self.bidder.username}"
+
+class ProxyBid(models.Model):
+    """
+    A bidder's maximum for an auction. BidService bids on their behalf, one
+    increment above the competition, up to this amount (see market/proxy.py).
+    """
+    bidder = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='proxy_bids')
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='proxy_bids')
+    max_amount = models.DecimalField(max_digits=10, decimal_places=2)
+    # Equal maximums are won by whoever set theirs first
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['product', 'bidder'], name='unique_proxy_bid_per_bidder'),
+        ]
+
+    def __str__(self):
+        return f"Up to {self.max_amount} on {self.product.title} by {self.bidder.username}"
+
+class IncrementBand(models.Model):
+    """
+    One row of a bid increment table: from ``min_amount`` upwards the next
+    bid must be at least ``increment`` higher. Bands without a category are
+    the site-wide table; subcategories fall back to their parent's table.
+    """
+    category = models.ForeignKey(Category, on_delete=models.CASCADE, null=True, blank=True, related_name='increment_bands')
+    min_amount = models.DecimalField(max_digits=10, decimal_places=2, default=0)
+    increment = models.DecimalField(max_digits=10, decimal_places=2)
+
+    class Meta:
+        ordering = ['category', 'min_amount']
+        constraints = [
+            models.UniqueConstraint(fields=['category', 'min_amount'], name='unique_increment_band'),
+        ]
+
+    def __str__(self):
+        return f"+{self.increment} from {self.min_amount} ({self.category or 'default'})"
+
+class SniperPolicy(models.Model):
+    """
+    Sniper protection for a category (or site-wide without one): a bid in
+    the last ``window_seconds`` extends the auction by
+    ``extension_seconds``, at most ``max_extensions`` times (0 = no limit).
+    """
+    category = models.OneToOneField(Category, on_delete=models.CASCADE, null=True, blank=True, related_name='sniper_policy')
+    window_seconds = models.PositiveIntegerField(default=30)
+    extension_seconds = models.PositiveIntegerField(default=60)
+    max_extensions = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        verbose_name_plural = "Sniper policies"
+
+    def __str__(self):
+        return f"{self.category or 'Default'}: +{self.extension_seconds}s within {self.window_seconds}s"
+
+# Signal to schedule auction closing
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+@receiver(post_save, sender=Product)
+def schedule_auction_close(sender, instance, created, update_fields=None, **kwargs):
+    if update_fields is not None and 'auction_end_time' not in update_fields:
+        return
+    # On listing, and whenever the end time is edited or extended; the
+    # task queued for the old end time notices and exits
+    end_time = instance.__dict__.get('auction_end_time', UNKNOWN)
+    if created or end_time != getattr(instance, '_auction_end_time_loaded', UNKNOWN):
+        from .services import AuctionScheduler
+        AuctionScheduler.schedule(instance)
+    instance._auction_end_time_loaded = end_time
+
+# Signals to refresh the cached home page sections
+@receiver(post_save, sender=Product)
+def invalidate_home_sections_on_change(sender, instance, created, **kwargs):
+    # Bids save the product too, those only move prices and counts
+    new = instance.home_key()
+    if created or new is UNKNOWN or new != getattr(instance, '_home_key_loaded', UNKNOWN):
+        from .cache import invalidate_home_cache
+        invalidate_home_cache()
+    instance._home_key_loaded = new
+
+@receiver(post_delete, sender=Product)
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+def invalidate_home_sections(sender, instance, **kwargs):
+    from .cache import invalidate_home_cache
+    invalidate_home_cache()
+
+# Signal to reload the in-process increment tables and sniper policies
+@receiver(post_save, sender=IncrementBand)
+@receiver(post_delete, sender=IncrementBand)
+@receiver(post_save, sender=SniperPolicy)
+@receiver(post_delete, sender=SniperPolicy)
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+def invalidate_rules(sender, instance, **kwargs):
+    from .rules import invalidate_auction_rules
+    invalidate_auction_rules()
+
+# Resize new and replaced uploads in the background
+@receiver(post_save, sender=ProductImage)
+def process_product_image(sender, instance, **kwargs):
+    from .images import ImagePipeline, is_current
+    if not is_current(instance):
+        ImagePipeline.schedule([instance.pk])
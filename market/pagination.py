@@ -0,0 +1,145 @@
+"""
+Keyset (cursor) pagination for listing pages.
+
+Instead of OFFSET, each page is fetched with a ``WHERE (sort_key, id) > last
+seen`` condition, so page N costs the same as page 1. Cursors are opaque,
+URL-safe tokens holding the sort value and id of the row at the page edge.
+
+The DRF pagination classes for the products API live here too.
+"""
+import base64
+import hashlib
+import json
+
+from django.core.cache import cache
+from django.db.models import Q
+from rest_framework.pagination import CursorPagination, PageNumberPagination
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+class KeysetPaginator:
+    # Sort name -> (field, descending). Ties are broken by id in the same direction.
+    ORDERINGS = {
+        'newest': ('created_at', True),
+        'price_asc': ('initial_price', False),
+        'price_desc': ('initial_price', True),
+        'urgent': ('auction_end_time', False),
+    }
+
+    COUNT_CACHE_TIMEOUT = 60
+
+    def __init__(self, queryset, sort, per_page=24):
+        if sort not in self.ORDERINGS:
+            sort = 'newest'
+        self.sort = sort
+        self.field, self.descending = self.ORDERINGS[sort]
+        # NULL sort values cannot be compared, keep them off keyset pages
+        self.queryset = queryset.filter(**{f'{self.field}__isnull': False})
+        self.per_page = per_page
+
+    def _order(self, reverse=False):
+        descending = self.descending != reverse
+        prefix = '-' if descending else ''
+        return [f'{prefix}{self.field}', f'{prefix}id']
+
+    def _seek(self, value, pk, forward=True):
+        """
+        Rows strictly after (value, pk) in the page order, or before it when
+        ``forward`` is False.
+        """
+        op = 'lt' if self.descending == forward else 'gt'
+        return Q(**{f'{self.field}__{op}': value}) | Q(**{self.field: value, f'id__{op}': pk})
+
+    def encode_cursor(self, obj):
+        value = getattr(obj, self.field)
+        payload = json.dumps([self.sort, str(value), obj.pk])
+        return base64.urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+
+    def decode_cursor(self, cursor):
+        try:
+            padded = cursor + '=' * (-len(cursor) % 4)
+            sort, value, pk = json.loads(base64.urlsafe_b64decode(padded.encode()))
+            if sort != self.sort:
+                raise InvalidCursor("Cursor belongs to a different sort order.")
+            field = self.queryset.model._meta.get_field(self.field)
+            return field.to_python(value), int(pk)
+        except InvalidCursor:
+            raise
+        except Exception:
+            raise InvalidCursor("Malformed cursor.")
+
+    def page(self, after=None, before=None):
+        """
+        Returns a KeysetPage following ``after`` or preceding ``before``.
+        Invalid cursors fall back to the first page.
+        """
+        try:
+            if before:
+                value, pk = self.decode_cursor(before)
+                rows = list(
+                    self.queryset.filter(self._seek(value, pk, forward=False))
+                    .order_by(*self._order(reverse=True))[:self.per_page + 1]
+                )
+                has_previous = len(rows) > self.per_page
+                rows = rows[:self.per_page][::-1]
+                return KeysetPage(self, rows, has_previous=has_previous, has_next=True)
+            if after:
+                value, pk = self.decode_cursor(after)
+                queryset = self.queryset.filter(self._seek(value, pk))
+                rows = list(queryset.order_by(*self._order())[:self.per_page + 1])
+                return KeysetPage(self, rows[:self.per_page], has_previous=True, has_next=len(rows) > self.per_page)
+        except InvalidCursor:
+            pass
+
+        rows = list(self.queryset.order_by(*self._order())[:self.per_page + 1])
+        return KeysetPage(self, rows[:self.per_page], has_previous=False, has_next=len(rows) > self.per_page)
+
+    def cached_count(self, key_parts):
+        """
+        Total number of matching rows, cached briefly per filter combination
+        so paging through results does not re-run the COUNT.
+        """
+        digest = hashlib.md5(json.dumps(key_parts, sort_keys=True, default=str).encode()).hexdigest()
+        key = f'keyset-count:{self.queryset.model._meta.label_lower}:{digest}'
+        count = cache.get(key)
+        if count is None:
+            count = self.queryset.count()
+            cache.set(key, count, self.COUNT_CACHE_TIMEOUT)
+        return count
+
+
+class KeysetPage:
+    def __init__(self, paginator, object_list, has_previous, has_next):
+        self.paginator = paginator
+        self.object_list = object_list
+        self.has_previous = has_previous and bool(object_list)
+        self.has_next = has_next and bool(object_list)
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    @property
+    def next_cursor(self):
+        return self.paginator.encode_cursor(self.object_list[-1]) if self.has_next else None
+
+    @property
+    def previous_cursor(self):
+        return self.paginator.encode_cursor(self.object_list[0]) if self.has_previous else None
+
+
+class ProductPagination(PageNumberPagination):
+    page_size = 20
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+
+
+class BidHistoryPagination(CursorPagination):
+    # Same order as the (product, -amount) index
+    page_size = 50
+    ordering = ('-amount', 'id')
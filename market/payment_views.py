@@ -3,10 +3,17 @@ from django.shortcuts import redirect
 from django.http import JsonResponse, HttpResponse
 from django.views.decorators.csrf import csrf_exempt
 from django.contrib.auth.decorators import login_required
-from users.models import Wallet, User
+from django.core.exceptions import ValidationError
+from users.models import User
+from users.ledger import WalletLedger
+from nexus_core.metrics import PAYMENTS
+from nexus_core.money import Money
 import requests
 import json
 import base64
+import logging
+
+logger = logging.getLogger(__name__)
 
 def get_paypal_access_token():
     client_id = settings.PAYPAL_CLIENT_ID
@@ -40,8 +47,11 @@ def create_checkout_session(request):
             amount_str = request.POST.get('amount')
             if not amount_str:
                 return JsonResponse({'error': 'Amount is required'}, status=400)
-                
-            amount_usd = float(amount_str)
+
+            try:
+                amount_usd = Money.parse(amount_str)
+            except ValidationError as e:
+                return JsonResponse({'error': e.messages[0]}, status=400)
             
             # PayPal API Request
             access_token = get_paypal_access_token()
@@ -66,7 +76,7 @@ def create_checkout_session(request):
                         "custom_id": str(request.user.id),
                         "amount": {
                             "currency_code": "USD",
-                            "value": f"{amount_usd:.2f}"
+                            "value": str(amount_usd)
                         }
                     }
                 ],
@@ -86,11 +96,13 @@ def create_checkout_session(request):
                     if link.get('rel') == 'approve':
                         # Store order ID in session to verify later
                         request.session['paypal_order_id'] = order.get('id')
+                        PAYMENTS.labels('paypal', 'order', 'created').inc()
                         return redirect(link.get('href'), code=303)
                         
                 return JsonResponse({'error': 'Approval URL not found in PayPal response'}, status=500)
             else:
-                print(f"PayPal Order Error: {response.text}")
+                PAYMENTS.labels('paypal', 'order', 'gateway_error').inc()
+                logger.error(f"PayPal Order Error: {response.text}")
                 return JsonResponse({'error': 'Payment Gateway Error'}, status=502)
                 
         except Exception as e:
@@ -145,23 +157,21 @@ def paypal_capture(request):
                         try:
                             # Use the logged-in user from the verified session
                             user = request.user
-                            deposit_amount = float(amount_value)
+                            deposit_amount = Money.parse(amount_value)
                             
                             # Optional extra security check if PayPal returned custom_id
                             if user_id_str and str(user.id) != str(user_id_str):
-                                print(f"PAYPAL SECURITY: User mismatch. Captured {user_id_str} but logged in as {request.user.id}")
+                                PAYMENTS.labels('paypal', 'capture', 'user_mismatch').inc()
+                                logger.warning(f"PAYPAL SECURITY: User mismatch. Captured {user_id_str} but logged in as {request.user.id}")
                                 from django.contrib import messages
                                 messages.error(request, "Payment security verification failed.")
                                 return redirect('deposit_funds')
                                 
                             # Update Wallet
-                            from django.db import transaction
-                            with transaction.atomic():
-                                wallet, _ = Wallet.objects.get_or_create(user=user)
-                                wallet.balance += __import__('decimal').Decimal(str(deposit_amount))
-                                wallet.save()
+                            WalletLedger.deposit(user, deposit_amount, reference=f"paypal:{order_id}")
                                 
-                            print(f"PAYPAL CAPTURE: Credited ${deposit_amount} to {user.username}")
+                            PAYMENTS.labels('paypal', 'capture', 'credited').inc()
+                            logger.info(f"PAYPAL CAPTURE: Credited ${deposit_amount} to {user.username}")
                             
                             # Clear session
                             if 'paypal_order_id' in request.session:
@@ -170,19 +180,22 @@ def paypal_capture(request):
                             return redirect('payment_success')
                             
                         except Exception as e:
-                            print(f"PAYPAL ERROR during wallet credit: {e}")
+                            PAYMENTS.labels('paypal', 'capture', 'credit_error').inc()
+                            logger.error(f"PAYPAL ERROR during wallet credit: {e}")
                             from django.contrib import messages
                             messages.error(request, "Error crediting your wallet. Please contact support.")
                             return redirect('deposit_funds')
                             
         # If we reach here, capture failed or wasn't COMPLETED
-        print(f"PAYPAL CAPTURE FAILED: {response.text}")
+        PAYMENTS.labels('paypal', 'capture', 'gateway_error').inc()
+        logger.error(f"PAYPAL CAPTURE FAILED: {response.text}")
         from django.contrib import messages
         messages.error(request, "Payment could not be captured or was already processed.")
         return redirect('deposit_funds')
         
     except Exception as e:
-        print(f"Capture processing error: {e}")
+        PAYMENTS.labels('paypal', 'capture', 'error').inc()
+        logger.error(f"Capture processing error: {e}")
         from django.contrib import messages
         messages.error(request, f"An error occurred: {str(e)}")
         return redirect('deposit_funds')
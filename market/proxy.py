@@ -0,0 +1,80 @@
+"""
+Proxy (automatic) bidding resolution.
+
+Bidders may store a maximum instead of bidding step by step. Whenever a bid
+or a new maximum arrives, ``resolve`` settles every competing maximum at
+once: the highest maximum leads (the earliest one on a tie) at one increment
+above the runner-up's maximum, capped at its own. A bidding war that would
+take dozens of requests therefore becomes one resolution, recorded as at
+most two Bid rows: the runner-up's last bid and the leader's new price.
+
+This module is pure so it can be exercised without a database; BidService
+loads the contenders under the product lock and applies the result.
+"""
+from collections import namedtuple
+
+# ``exact`` contenders are plain bids: if they lead, they pay their own
+# amount rather than the proxy price.
+Contender = namedtuple('Contender', 'bidder_id max_amount since exact')
+
+# ``bids`` are the (bidder_id, amount) rows to record, in order
+Resolution = namedtuple('Resolution', 'leader_id price bids')
+
+
+def _ranked(contenders):
+    """
+    Merges contenders per bidder (keeping the higher maximum) and orders
+    them best first: highest maximum, then earliest. Also returns each
+    bidder's highest plain bid, the least they pay if they lead.
+    """
+    best = {}
+    floors = {}
+    for contender in contenders:
+        current = best.get(contender.bidder_id)
+        if current is None or contender.max_amount > current.max_amount:
+            best[contender.bidder_id] = contender
+        if contender.exact:
+            floors[contender.bidder_id] = max(floors.get(contender.bidder_id, 0), contender.max_amount)
+    return sorted(best.values(), key=lambda c: (-c.max_amount, c.since)), floors
+
+
+def resolve(contenders, price, leader_id, start_price, increment):
+    """
+    Settles competing maximums for one auction.
+
+    ``price`` and ``leader_id`` describe the auction before this pass (a
+    price of 0 means no bids yet), ``start_price`` is the first acceptable
+    bid and ``increment(amount)`` the step above ``amount``. Contenders
+    must already satisfy the minimum bid.
+    """
+    ranked, floors = _ranked(contenders)
+    if not ranked:
+        return Resolution(leader_id, price, [])
+
+    winner = ranked[0]
+    runner_up = ranked[1] if len(ranked) > 1 else None
+
+    if winner.exact:
+        new_price = winner.max_amount
+    elif runner_up is None:
+        new_price = price if winner.bidder_id == leader_id else max(price, start_price)
+    elif runner_up.max_amount == winner.max_amount:
+        # Tie, the earlier maximum wins at that amount
+        new_price = winner.max_amount
+    else:
+        new_price = min(winner.max_amount, runner_up.max_amount + increment(runner_up.max_amount))
+    # A plain bid below the leader's own maximum is still paid in full
+    new_price = max(new_price, price, floors.get(winner.bidder_id, 0))
+
+    bids = []
+    # The runner-up's maximum is revealed as its last bid, unless it is
+    # already the standing price
+    runner_up_bid = runner_up and runner_up.max_amount > price and (runner_up.bidder_id, runner_up.max_amount)
+    winner_bid = (winner.bidder_id != leader_id or new_price != price) and (winner.bidder_id, new_price)
+    if runner_up_bid and winner_bid and runner_up.max_amount == new_price:
+        # Equal amounts: the winning bid must be recorded first
+        bids = [winner_bid, runner_up_bid]
+    else:
+        bids = [bid for bid in (runner_up_bid, winner_bid) if bid]
+
+    return Resolution(winner.bidder_id, new_price, bids)
@@ -0,0 +1,115 @@
+"""
+Bid increment tables and sniper protection policies.
+
+Both are configured in the admin (IncrementBand, SniperPolicy), per category
+with a site-wide fallback, and read on every bid. ``get_auction_rules``
+keeps them in process memory so BidService evaluates them without a query:
+the tables are reloaded after AUCTION_RULES_TTL seconds, or straight away
+in the process that saved a change.
+"""
+import bisect
+import time
+from collections import namedtuple
+from datetime import timedelta
+from decimal import Decimal
+
+from django.conf import settings
+
+# Used when neither the category nor the site has an increment table
+DEFAULT_INCREMENT = Decimal('1.00')
+
+Policy = namedtuple('Policy', 'window extension max_extensions')
+
+
+class AuctionRules:
+    """
+    An immutable snapshot of every increment table and sniper policy.
+    """
+    def __init__(self, bands, policies, parents):
+        # {category_id or None: ([min_amount, ...], [increment, ...])}
+        self.bands = bands
+        # {category_id or None: Policy}
+        self.policies = policies
+        # {category_id: parent_id}
+        self.parents = parents
+
+    @classmethod
+    def load(cls):
+        from .models import Category, IncrementBand, SniperPolicy
+
+        tables = {}
+        for band in IncrementBand.objects.order_by('min_amount'):
+            minimums, increments = tables.setdefault(band.category_id, ([], []))
+            minimums.append(band.min_amount)
+            increments.append(band.increment)
+
+        policies = {
+            policy.category_id: Policy(
+                timedelta(seconds=policy.window_seconds),
+                timedelta(seconds=policy.extension_seconds),
+                policy.max_extensions,
+            )
+            for policy in SniperPolicy.objects.all()
+        }
+        policies.setdefault(None, Policy(
+            timedelta(seconds=settings.AUCTION_SNIPER_WINDOW),
+            timedelta(seconds=settings.AUCTION_SNIPER_EXTENSION),
+            settings.AUCTION_MAX_EXTENSIONS,
+        ))
+
+        parents = dict(Category.objects.filter(parent__isnull=False).values_list('id', 'parent_id'))
+        return cls(tables, policies, parents)
+
+    def _lookup(self, table, category_id):
+        # The category, then its ancestors, then the site-wide entry
+        seen = set()
+        while category_id is not None and category_id not in seen:
+            if category_id in table:
+                return table[category_id]
+            seen.add(category_id)
+            category_id = self.parents.get(category_id)
+        return table.get(None)
+
+    def increment(self, category_id, amount):
+        """
+        The minimum step above ``amount`` in the category's price band.
+        """
+        table = self._lookup(self.bands, category_id)
+        if not table:
+            return DEFAULT_INCREMENT
+        minimums, increments = table
+        index = bisect.bisect_right(minimums, amount) - 1
+        return increments[max(index, 0)]
+
+    def increment_table(self, category_id):
+        """
+        The category's bands as ``[(min_amount, increment), ...]``.
+        """
+        table = self._lookup(self.bands, category_id)
+        if not table:
+            return [(Decimal('0.00'), DEFAULT_INCREMENT)]
+        return list(zip(*table))
+
+    def policy(self, category_id):
+        return self._lookup(self.policies, category_id)
+
+
+_rules = None
+_expires_at = 0
+
+
+def get_auction_rules():
+    global _rules, _expires_at
+    if _rules is None or time.monotonic() >= _expires_at:
+        _rules = AuctionRules.load()
+        _expires_at = time.monotonic() + settings.AUCTION_RULES_TTL
+    return _rules
+
+
+def invalidate_auction_rules():
+    """
+    Drops this process's snapshot; other processes pick the change up
+    within AUCTION_RULES_TTL.
+    """
+    global _rules
+    _rules = None
@@ -0,0 +1,98 @@
+"""
+Full-text search over product listings.
+
+``ProductSearch`` is the one entry point used by the home page, the catalog
+and the API. On PostgreSQL it matches against ``Product.search_vector``
+(kept current by a trigger, GIN indexed) and ranks with ``ts_rank``; on
+SQLite it queries the ``market_product_fts`` FTS5 table and ranks with
+``bm25``. Both are created by migration 0007. Other backends fall back to
+``icontains`` matching.
+"""
+import re
+
+from django.db import connection
+from django.db.models import F, Q
+from django.db.models.expressions import RawSQL
+from rest_framework.filters import BaseFilterBackend
+
+SEARCH_CONFIG = 'english'
+
+TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+
+
+def fts5_query(query):
+    """
+    Turns free text into a safe FTS5 MATCH expression: every word must
+    match, as a prefix, so 'vint wat' finds 'Vintage Watch'.
+    """
+    return ' '.join(f'"{token}"*' for token in TOKEN_RE.findall(query))
+
+
+class ProductSearch:
+    @staticmethod
+    def filter(queryset, query, rank=True):
+        """
+        Restricts ``queryset`` to products matching ``query``.
+        With ``rank`` the results are ordered by relevance; callers that
+        apply their own sort order can pass ``rank=False``.
+        """
+        query = (query or '').strip()
+        if not query:
+            return queryset
+
+        vendor = connection.vendor
+        if vendor == 'postgresql':
+            return ProductSearch._filter_postgres(queryset, query, rank)
+        if vendor == 'sqlite':
+            return ProductSearch._filter_sqlite(queryset, query, rank)
+        return queryset.filter(
+            Q(title__icontains=query) |
+            Q(description__icontains=query) |
+            Q(category__name__icontains=query)
+        )
+
+    @staticmethod
+    def _filter_postgres(queryset, query, rank):
+        from django.contrib.postgres.search import SearchQuery, SearchRank
+
+        search_query = SearchQuery(query, config=SEARCH_CONFIG, search_type='websearch')
+        queryset = queryset.filter(search_vector=search_query)
+        if rank:
+            queryset = queryset.annotate(
+                search_rank=SearchRank(F('search_vector'), search_query)
+            ).order_by('-search_rank', '-created_at')
+        return queryset
+
+    @staticmethod
+    def _filter_sqlite(queryset, query, rank):
+        match = fts5_query(query)
+        if not match:
+            return queryset.none()
+
+        if rank:
+            # Join the FTS table so bm25() is computed once per match.
+            # bm25() is lower for better matches; title > category > description
+            # like the A/B/C weights on PostgreSQL
+            return queryset.extra(
+                tables=['market_product_fts'],
+                where=['market_product_fts.rowid = market_product.id', 'market_product_fts MATCH %s'],
+                params=[match],
+                select={'search_rank': 'bm25(market_product_fts, 10.0, 1.0, 5.0)'},
+                order_by=['search_rank', '-created_at'],
+            )
+        return queryset.filter(id__in=RawSQL(
+            "SELECT rowid FROM market_product_fts WHERE market_product_fts MATCH %s", (match,)
+        ))
+
+
+class ProductSearchFilter(BaseFilterBackend):
+    """
+    DRF filter backend for ``?search=`` on the products API.
+    """
+    search_param = 'search'
+
+    def filter_queryset(self, request, queryset, view):
+        query = request.query_params.get(self.search_param, '')
+        # An explicit ?ordering= wins over relevance
+        rank = not request.query_params.get('ordering')
+        return ProductSearch.filter(queryset, query, rank=rank)
@@ -1,6 +1,6 @@
 from rest_framework import serializers
 from .models import Category, Product, ProductImage, Bid
-from users.serializers import UserSerializer
+from users.serializers import UserSummarySerializer
 
 class CategorySerializer(serializers.ModelSerializer):
     class Meta:
@@ -20,12 +20,39 @@ class BidSerializer(serializers.ModelSerializer):
         fields = ['id', 'bidder', 'bidder_name', 'amount', 'timestamp']
         read_only_fields = ['bidder', 'timestamp']
 
+class ProductListSerializer(serializers.ModelSerializer):
+    """
+    Listing card representation: no description, bid history or image
+    gallery. Expects the queryset from ProductViewSet (seller and category
+    joined, first image prefetched).
+    """
+    seller = UserSummarySerializer(read_only=True)
+    category = CategorySerializer(read_only=True)
+    image = serializers.SerializerMethodField()
+
+    class Meta:
+        model = Product
+        fields = [
+            'id', 'seller', 'category', 'title', 'condition', 'location', 'sales_type',
+            'initial_price', 'buy_now_price', 'current_highest_bid', 'auction_end_time',
+            'is_active', 'bid_count', 'last_bid_at', 'created_at', 'image'
+        ]
+
+    def get_image(self, obj):
+        image = obj.first_image
+        if image is None:
+            return None
+        return ProductImageSerializer(image, context=self.context).data['image']
+
 class ProductSerializer(serializers.ModelSerializer):
-    seller = UserSerializer(read_only=True)
+    """
+    Detail and write representation. Bid history is served separately by
+    ``/api/products/<id>/bids/``.
+    """
+    seller = UserSummarySerializer(read_only=True)
     category = CategorySerializer(read_only=True)
     category_id = serializers.PrimaryKeyRelatedField(queryset=Category.objects.all(), source='category', write_only=True)
     images = ProductImageSerializer(many=True, read_only=True)
-    bids = BidSerializer(many=True, read_only=True)
     
     class Meta:
         model = Product
@@ -33,9 +60,9 @@ class ProductSerializer(serializers.ModelSerializer):
             'id', 'seller', 'category', 'category_id', 'title', 'description', 
             'condition', 'location', 'sales_type', 'initial_price', 'buy_now_price',
             'current_highest_bid', 'reserve_price', 'auction_end_time', 'is_active',
-            'created_at', 'images', 'bids'
+            'bid_count', 'last_bid_at', 'created_at', 'images'
         ]
-        read_only_fields = ['seller', 'current_highest_bid', 'is_active', 'created_at']
+        read_only_fields = ['seller', 'current_highest_bid', 'is_active', 'bid_count', 'last_bid_at', 'created_at']
 
     def create(self, validated_data):
         user = self.context['request'].user
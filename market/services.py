@@ -1,19 +1,222 @@
 from django.utils import timezone
 from django.db import transaction
 from django.core.exceptions import ValidationError
-from datetime import timedelta
-from .models import Product, Bid
+from django.conf import settings
+from datetime import datetime, timedelta, timezone as dt_timezone
+from decimal import Decimal
+from .models import Product, Bid, ProxyBid
+from .rules import get_auction_rules
+from nexus_core.metrics import BID_DURATION, BID_LOCK_WAIT, BIDS
+from nexus_core.money import Money
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+# Priority of the standing bid in proxy resolution, ahead of any other
+EARLIEST = datetime.min.replace(tzinfo=dt_timezone.utc)
+
+class AuctionScheduler:
+    @staticmethod
+    def due(end_time):
+        """
+        Whether a close at ``end_time`` is enqueued now. The Redis broker
+        delivers an ETA task again once it has been held longer than the
+        visibility timeout, so closes beyond AUCTION_SCHEDULE_HORIZON are
+        left to schedule_auction_closes, which enqueues them as they come
+        within it.
+        """
+        return end_time - timezone.now() <= timedelta(seconds=settings.AUCTION_SCHEDULE_HORIZON)
+
+    @staticmethod
+    def schedule(product: Product):
+        """
+        Enqueues the close task for an auction at its exact end time.
+        Called when an auction is listed and whenever sniper protection
+        extends it; superseded tasks notice the new end time and exit.
+        """
+        if not settings.AUCTION_SCHEDULER_ENABLED:
+            return
+        if product.sales_type not in ('AUCTION', 'HYBRID') or not product.auction_end_time:
+            return
+        if not AuctionScheduler.due(product.auction_end_time):
+            return
+
+        from .tasks import close_auction
+        product_id = product.id
+        end_time = product.auction_end_time
+
+        def enqueue():
+            try:
+                close_auction.apply_async(args=[product_id, end_time.timestamp()], eta=end_time)
+            except Exception as e:
+                # close_expired_auctions picks the auction up on its next run
+                logger.error(f"Failed to schedule close of auction {product_id}: {e}")
+
+        transaction.on_commit(enqueue)
+
+    @staticmethod
+    def schedule_many(products):
+        """
+        ``schedule`` for listings created together (bulk_create sends no
+        post_save), with a single commit hook.
+        """
+        if not settings.AUCTION_SCHEDULER_ENABLED:
+            return
+        closes = [
+            (product.id, product.auction_end_time) for product in products
+            if product.sales_type in ('AUCTION', 'HYBRID') and product.auction_end_time
+            and AuctionScheduler.due(product.auction_end_time)
+        ]
+        if not closes:
+            return
+
+        from .tasks import close_auction
+
+        def enqueue():
+            for product_id, end_time in closes:
+                try:
+                    close_auction.apply_async(args=[product_id, end_time.timestamp()], eta=end_time)
+                except Exception as e:
+                    # close_expired_auctions picks the rest up on its next run
+                    logger.error(f"Failed to schedule close of auction {product_id}: {e}")
+                    return
+
+        transaction.on_commit(enqueue)
 
 class BidService:
     @staticmethod
-    @transaction.atomic
     def place_bid(product: Product, user, amount):
         """
         Places a bid on a product.
-        Handles validation, concurrency locking, and sniper protection.
+        Routes through the Redis bid book when BIDBOOK_ENABLED is set,
+        otherwise locks the product row in the database.
+        """
+        if settings.BIDBOOK_ENABLED:
+            return BidService._measured('bid', 'book', BidService._place_bid_in_book, product, user, amount)
+        return BidService._measured('bid', 'locked', BidService._place_bid_locked, product, user, amount)
+
+    @staticmethod
+    def _measured(kind, path, place, *args):
+        # Counted by outcome; only accepted bids are timed
+        started = time.perf_counter()
+        try:
+            result = place(*args)
+        except ValidationError:
+            BIDS.labels(kind, 'rejected').inc()
+            raise
+        BID_DURATION.labels(path).observe(time.perf_counter() - started)
+        BIDS.labels(kind, 'accepted').inc()
+        return result
+
+    @staticmethod
+    def _place_bid_in_book(product: Product, user, amount):
+        """
+        Accepts the bid against the in-memory bid book without taking the
+        product row lock. The Bid row is written behind by flush_bid_book.
+        """
+        from .bidbook import get_bid_book, to_millis
+
+        amount = Money.parse(amount).decimal
+        previous_leader_id, end_time = get_bid_book().place(product, user, amount)
+
+        if previous_leader_id and previous_leader_id != user.id:
+            from users.models import User
+            previous_bidder = User.objects.filter(pk=previous_leader_id).first()
+            if previous_bidder:
+                BidService._notify_outbid(product, previous_bidder, amount)
+
+        # The book keeps milliseconds, the column microseconds
+        extended = to_millis(end_time) != to_millis(product.auction_end_time)
+        product.current_highest_bid = amount
+        if extended:
+            product.auction_end_time = end_time
+            AuctionScheduler.schedule(product)
+        BidService._broadcast(product, [(user.username, amount)], extended)
+        return product
+
+    @staticmethod
+    def _extend_for_sniping(product: Product, policy):
+        """
+        Applies the sniper protection ``policy`` to a locked product.
+        Returns True when the auction was extended.
+        """
+        if not product.auction_end_time:
+            return False
+        if policy.max_extensions and product.extension_count >= policy.max_extensions:
+            return False
+        if product.auction_end_time - timezone.now() >= policy.window:
+            return False
+        product.auction_end_time += policy.extension
+        product.extension_count += 1
+        return True
+
+    @staticmethod
+    def _broadcast(product: Product, bids, extended):
+        # Pushed to product page subscribers (market/streams.py)
+        from .streams import BidStream
+        events = [(product.id, 'bid', {'amount': amount, 'bidder': username}) for username, amount in bids]
+        if extended:
+            events.append((product.id, 'extended', {'auction_end_time': product.auction_end_time.isoformat()}))
+        BidStream.publish_many(events)
+
+    @staticmethod
+    def _notify_outbid(product: Product, previous_bidder, amount):
+        # Queued in the outbox and delivered by drain_notification_outbox,
+        # so the bid never waits on the mail server
+        from transactions.outbox import NotificationOutbox
+        NotificationOutbox.enqueue(NotificationOutbox.message(
+            previous_bidder,
+            'OUTBID',
+            subject=f"Outbid Alert: {product.title}",
+            body=f"You have been outbid on '{product.title}'.\nThe new highest bid is ${amount}.\n\nGo to product: http://localhost:8000/product/{product.id}/",
+            product=product,
+            notification_type='OUTBID',
+            notification_message=f"You have been outbid on '{product.title}'. The new highest bid is ${amount}.",
+        ))
+
+    @staticmethod
+    def minimum_bid(product: Product):
+        """
+        The lowest acceptable next bid: the starting price, then one
+        increment of the category's price band above the current bid.
         """
+        if product.current_highest_bid == 0:
+            return product.initial_price if product.initial_price else Decimal('1.00')
+        increment = get_auction_rules().increment(product.category_id, product.current_highest_bid)
+        return product.current_highest_bid + increment
+
+    @staticmethod
+    def set_max_bid(product: Product, user, max_amount):
+        """
+        Stores (or raises) the user's maximum bid for an auction and lets the
+        proxy engine bid on their behalf up to it.
+        """
+        if settings.BIDBOOK_ENABLED:
+            # The Redis bid book only knows plain bids
+            raise ValidationError("Automatic bidding is not available for this auction.")
+        return BidService._measured('max_bid', 'locked', BidService._resolve_locked, product, user, max_amount, False)
+
+    @staticmethod
+    def _place_bid_locked(product: Product, user, amount):
+        return BidService._resolve_locked(product, user, amount, exact=True)
+
+    @staticmethod
+    @transaction.atomic
+    def _resolve_locked(product: Product, user, amount, exact):
+        """
+        Handles validation, concurrency locking, proxy bidding and sniper
+        protection. ``exact`` bids are placed as given; otherwise ``amount``
+        is stored as the user's maximum.
+        """
+        from .proxy import Contender, resolve
+
         # Lock the product row for update to prevent race conditions
-        product = Product.objects.select_for_update().get(id=product.id)
+        # The current leader comes along in the same query for the outbid notice
+        started = time.perf_counter()
+        product = Product.objects.select_for_update(of=('self',)).select_related('leading_bidder').get(id=product.id)
+        BID_LOCK_WAIT.observe(time.perf_counter() - started)
+        amount = Money.parse(amount).decimal
 
         # 1. Validation
         if not product.is_active:
@@ -25,53 +228,78 @@ class BidService:
         if product.auction_end_time and timezone.now() > product.auction_end_time:
             raise ValidationError("This auction has ended.")
 
-        # Check minimum bid
-        min_bid = product.current_highest_bid + 1.00 # Minimum increment $1 (configurable)
-        if product.current_highest_bid == 0:
-            min_bid = product.initial_price if product.initial_price else 1.00
+        # Check minimum bid against the category's increment table (cached in-process)
+        rules = get_auction_rules()
+        min_bid = BidService.minimum_bid(product)
 
-        if amount < min_bid:
+        proxy = ProxyBid.objects.filter(product=product, bidder=user).first()
+        if not exact and product.leading_bidder_id == user.id:
+            # The leader may only raise their own maximum, which does not move the price
+            floor = max(product.current_highest_bid, proxy.max_amount if proxy else 0)
+            if amount <= floor:
+                raise ValidationError(f"Your maximum bid must be above {floor}")
+        elif amount < min_bid:
             raise ValidationError(f"Bid must be at least {min_bid}")
 
-        if user == product.seller:
+        if user.id == product.seller_id:
             raise ValidationError("You cannot bid on your own product.")
 
-        # 3.1 Notify Previous Bidder (Outbid)
-        from django.core.mail import send_mail
-        last_bid = Bid.objects.filter(product=product).order_by('-amount').first()
-        if last_bid:
-            previous_bidder = last_bid.bidder
-            # Ensure we don't spam if the user outbids themselves (rare but possible)
-            if previous_bidder != user:
-                try:
-                    send_mail(
-                        subject=f"Outbid Alert: {product.title}",
-                        message=f"You have been outbid on '{product.title}'.\nThe new highest bid is ${amount}.\n\nGo to product: http://localhost:8000/product/{product.id}/",
-                        from_email=None,
-                        recipient_list=[previous_bidder.email],
-                        fail_silently=True 
-                    )
-                except Exception as e:
-                    print(f"Failed to send outbid email: {e}")
+        if not exact:
+            proxy = proxy or ProxyBid(product=product, bidder=user)
+            proxy.max_amount = amount
+            proxy.save()
 
-        # 2. Create Bid
-        Bid.objects.create(
-            bidder=user,
-            product=product,
-            amount=amount
+        # 2. Resolve every live maximum against the new bid in one pass
+        price = product.current_highest_bid
+        contenders = [
+            Contender(p.bidder_id, p.max_amount, p.updated_at, False)
+            for p in ProxyBid.objects.filter(product=product, max_amount__gte=price)
+        ]
+        if product.leading_bidder_id:
+            # The standing bid beats anyone else at the same amount
+            contenders.append(Contender(product.leading_bidder_id, price, EARLIEST, True))
+        if exact:
+            contenders.append(Contender(user.id, amount, timezone.now(), True))
+
+        start_price = product.initial_price if product.initial_price else Decimal('1.00')
+        resolution = resolve(
+            contenders, price, product.leading_bidder_id, start_price,
+            lambda amount: rules.increment(product.category_id, amount),
         )
+        if not resolution.bids:
+            # A leader raising their maximum
+            return product
 
-        # 3. Update Product State
-        product.current_highest_bid = amount
+        # 3. Record the compact history and update the product (row is locked)
+        bids = Bid.objects.bulk_create([
+            Bid(product=product, bidder_id=bidder_id, amount=bid_amount)
+            for bidder_id, bid_amount in resolution.bids
+        ])
+        bidders = {user.id: user}
+        if product.leading_bidder:
+            bidders[product.leading_bidder_id] = product.leading_bidder
+        missing = {bid.bidder_id for bid in bids} - set(bidders)
+        if missing:
+            from users.models import User
+            bidders.update(User.objects.in_bulk(missing))
+
+        # Notify whoever lost the lead or was outbid by a proxy in this pass
+        outbid = {bid.bidder_id for bid in bids} | {product.leading_bidder_id}
+        outbid -= {resolution.leader_id, None}
+        for bidder_id in outbid:
+            BidService._notify_outbid(product, bidders[bidder_id], resolution.price)
+
+        product.current_highest_bid = resolution.price
+        product.bid_count += len(bids)
+        product.leading_bidder = bidders[resolution.leader_id]
+        product.last_bid_at = bids[-1].timestamp
         
         # 4. Sniper Protection Check
-        # If bid is placed in the last 30 seconds, extend by 1 minute
-        if product.auction_end_time:
-            time_remaining = product.auction_end_time - timezone.now()
-            if time_remaining < timedelta(seconds=30):
-                product.auction_end_time += timedelta(minutes=1)
-                # TODO: Notify users about extension
-        
+        # A bid inside the category's window extends the auction, once per pass;
+        # saving the new end time schedules its close (market/models.py)
+        extended = BidService._extend_for_sniping(product, rules.policy(product.category_id))
+
         product.save()
+        BidService._broadcast(product, [(bidders[bid.bidder_id].username, bid.amount) for bid in bids], extended)
 
         return product
@@ -0,0 +1,227 @@
+"""
+Live auction events (new bids, sniper extensions, closes) pushed to
+browsers over Server-Sent Events.
+
+Write paths call ``BidStream.publish_many`` which, once the transaction
+commits, PUBLISHes small JSON events on the products' Redis channels. Every
+ASGI process runs one ``ProductEventHub``: a single Redis pub/sub connection
+subscribed to the channels its clients are watching, fanning each message
+out to per-client in-memory queues. An idle subscriber costs one coroutine
+and one small queue, so a process can hold thousands of them.
+
+The stream is served by ``product_event_stream``, mounted in front of
+Django in ``nexus_core/asgi.py`` at ``/stream/products/<id>/``. It bypasses
+the Django request cycle entirely; events are public auction data, the
+same as the product page. When BID_STREAM_BASE_URL puts it on another
+origin, pages from BID_STREAM_ALLOWED_ORIGINS are allowed to read it
+through CORS.
+"""
+import asyncio
+import json
+import logging
+import re
+import time
+
+import redis
+from django.conf import settings
+from django.db import transaction
+
+logger = logging.getLogger(__name__)
+
+STREAM_PATH = re.compile(r'^/stream/products/(?P<product_id>\d+)/$')
+
+# Comment line sent on idle streams so proxies keep the connection open
+HEARTBEAT_INTERVAL = 15
+
+# Events buffered per client before the oldest are dropped
+CLIENT_QUEUE_SIZE = 32
+
+# Queue markers for the per-client loop
+HEARTBEAT = b': keep-alive\n\n'
+DISCONNECTED = object()
+
+
+def channel_name(product_id):
+    return f'product:{product_id}:events'
+
+
+class BidStream:
+    _client = None
+
+    @classmethod
+    def _redis(cls):
+        if cls._client is None:
+            cls._client = redis.Redis.from_url(settings.BID_STREAM_REDIS_URL)
+        return cls._client
+
+    @staticmethod
+    def publish_many(events):
+        """
+        Broadcasts ``(product_id, event, data)`` triples in one pipeline after
+        the current transaction commits. ``sent_at`` is stamped at commit time
+        so clients can measure delivery latency. Failures are logged and never
+        affect the caller.
+        """
+        if not settings.BID_STREAM_ENABLED or not events:
+            return
+
+        def send():
+            sent_at = time.time()
+            try:
+                pipe = BidStream._redis().pipeline(transaction=False)
+                for product_id, event, data in events:
+                    message = {'event': event, 'product_id': product_id, 'sent_at': sent_at, **data}
+                    pipe.publish(channel_name(product_id), json.dumps(message, default=str))
+                pipe.execute()
+            except Exception as e:
+                logger.error(f"Failed to publish {len(events)} auction events: {e}")
+
+        transaction.on_commit(send)
+
+
+class ProductEventHub:
+    """
+    Per-process fan-out of Redis pub/sub messages to SSE clients.
+    """
+    def __init__(self, url):
+        self.url = url
+        self.pubsub = None
+        self.reader = None
+        self.heartbeat = None
+        self.subscribers = {}
+        self.lock = asyncio.Lock()
+
+    async def subscribe(self, product_id):
+        channel = channel_name(product_id)
+        queue = asyncio.Queue(maxsize=CLIENT_QUEUE_SIZE)
+        async with self.lock:
+            if self.pubsub is None:
+                from redis import asyncio as aioredis
+                self.pubsub = aioredis.Redis.from_url(self.url).pubsub(ignore_subscribe_messages=True)
+            if channel not in self.subscribers:
+                await self.pubsub.subscribe(channel)
+                self.subscribers[channel] = set()
+            self.subscribers[channel].add(queue)
+            if self.reader is None or self.reader.done():
+                self.reader = asyncio.create_task(self._read())
+                self.heartbeat = asyncio.create_task(self._heartbeat())
+        return queue
+
+    async def unsubscribe(self, product_id, queue):
+        channel = channel_name(product_id)
+        async with self.lock:
+            queues = self.subscribers.get(channel)
+            if queues is None:
+                return
+            queues.discard(queue)
+            if not queues:
+                del self.subscribers[channel]
+                await self.pubsub.unsubscribe(channel)
+
+    async def _heartbeat(self):
+        # One timer for the whole process instead of one per client
+        while True:
+            await asyncio.sleep(HEARTBEAT_INTERVAL)
+            for queues in tuple(self.subscribers.values()):
+                for queue in tuple(queues):
+                    if queue.empty():
+                        queue.put_nowait(HEARTBEAT)
+
+    async def _read(self):
+        while True:
+            try:
+                message = await self.pubsub.get_message(ignore_subscribe_messages=True, timeout=1.0)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                # redis-py reconnects and re-subscribes on the next call
+                logger.error(f"Event hub lost its Redis connection: {e}")
+                await asyncio.sleep(1)
+                continue
+            if not message or message['type'] != 'message':
+                continue
+
+            channel = message['channel']
+            if isinstance(channel, bytes):
+                channel = channel.decode()
+            queues = tuple(self.subscribers.get(channel, ()))
+            if not queues:
+                continue
+            # Encoded once, shared by every client
+            body = format_event(message['data'])
+            for queue in queues:
+                if queue.full():
+                    # Slow client, the newest state matters more than history
+                    queue.get_nowait()
+                queue.put_nowait(body)
+
+
+_hub = None
+
+
+def get_event_hub():
+    global _hub
+    if _hub is None:
+        _hub = ProductEventHub(settings.BID_STREAM_REDIS_URL)
+    return _hub
+
+
+def format_event(data):
+    if isinstance(data, bytes):
+        data = data.decode()
+    event = json.loads(data).get('event', 'message')
+    return f'event: {event}\ndata: {data}\n\n'.encode()
+
+
+def response_headers(scope):
+    headers = [
+        (b'content-type', b'text/event-stream'),
+        (b'cache-control', b'no-cache'),
+        # Tell nginx-style proxies not to buffer the stream
+        (b'x-accel-buffering', b'no'),
+        (b'vary', b'origin'),
+    ]
+    origin = dict(scope.get('headers', [])).get(b'origin', b'')
+    if origin and origin.decode('latin-1') in settings.BID_STREAM_ALLOWED_ORIGINS:
+        # EventSource from the site's pages, without credentials
+        headers.append((b'access-control-allow-origin', origin))
+    return headers
+
+
+async def product_event_stream(scope, receive, send, product_id):
+    """
+    ASGI handler streaming a product's events as text/event-stream until the
+    client disconnects.
+    """
+    await send({
+        'type': 'http.response.start',
+        'status': 200,
+        'headers': response_headers(scope),
+    })
+    await send({'type': 'http.response.body', 'body': b'retry: 3000\n\n', 'more_body': True})
+
+    hub = get_event_hub()
+    queue = await hub.subscribe(product_id)
+
+    async def wait_for_disconnect():
+        while (await receive())['type'] != 'http.disconnect':
+            pass
+        if queue.full():
+            queue.get_nowait()
+        queue.put_nowait(DISCONNECTED)
+
+    watcher = asyncio.ensure_future(wait_for_disconnect())
+    try:
+        # One plain await per event; heartbeats and the disconnect arrive
+        # through the same queue
+        while True:
+            body = await queue.get()
+            if body is DISCONNECTED or watcher.done():
+                break
+            await send({'type': 'http.response.body', 'body': body, 'more_body': True})
+    except OSError:
+        # Client went away mid-write
+        pass
+    finally:
+        watcher.cancel()
+        await hub.unsubscribe(product_id, queue)
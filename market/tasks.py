@@ -1,93 +1,294 @@
-from celery import shared_task
+from celery import shared_task, group
+from django.conf import settings
 from django.utils import timezone
+from datetime import timedelta
 from django.db import transaction
+from django.db.models import F, OuterRef, Subquery
 from .models import Product, Bid
+from .cache import invalidate_home_cache
+from .streams import BidStream
 from transactions.models import Transaction
+from nexus_core.metrics import AUCTION_CLOSE_LAG, AUCTIONS_CLOSED
 import logging
+import time
 
 logger = logging.getLogger(__name__)
 
+AUCTION_SALES_TYPES = ['AUCTION', 'HYBRID']
+
+def _flush_bid_book():
+    if settings.BIDBOOK_ENABLED:
+        # Make sure the winning bids are in the database before resolving
+        # winners; raises BidBookBusy rather than closing on a partial flush
+        from .bidbook import get_bid_book
+        get_bid_book().flush(wait=settings.BIDBOOK_FLUSH_WAIT)
+
+def _expired_auctions():
+    return Product.objects.filter(
+        is_active=True,
+        sales_type__in=AUCTION_SALES_TYPES,
+        auction_end_time__lte=timezone.now()
+    )
+
+def _claim_and_close(queryset, limit, skip_locked=True, trigger='sweep'):
+    """
+    Claims up to ``limit`` auctions from ``queryset`` and closes them as one
+    set: winners are resolved in the claiming query, Transactions and result
+    emails are bulk created and the products are flipped inactive with a
+    single UPDATE.
+    Rows locked by another closer are skipped, so concurrent shards never
+    close the same auction twice. Returns the closed products. ``trigger``
+    labels the close metrics: ``scheduled`` for the ETA task, ``sweep`` for
+    the safety net.
+    """
+    top_bid = Bid.objects.filter(product=OuterRef('pk')).order_by('-amount', 'timestamp', 'id')
+
+    with transaction.atomic():
+        claimed = list(
+            queryset.filter(is_active=True)
+            .select_related('seller')
+            .select_for_update(skip_locked=skip_locked, of=('self',))
+            .annotate(winning_bid_id=Subquery(top_bid.values('id')[:1]))
+            .order_by('auction_end_time')[:limit]
+        )
+        if not claimed:
+            return []
+
+        product_ids = [product.id for product in claimed]
+        winning_bids = Bid.objects.select_related('bidder').in_bulk(
+            [product.winning_bid_id for product in claimed if product.winning_bid_id]
+        )
+        # Guard against transactions left behind by an earlier, interrupted run
+        already_settled = set(
+            Transaction.objects.filter(product_id__in=product_ids).values_list('product_id', flat=True)
+        )
+
+        new_transactions = []
+        for product in claimed:
+            product.winning_bid = winning_bids.get(product.winning_bid_id)
+            if product.winning_bid and product.id not in already_settled:
+                new_transactions.append(Transaction(
+                    buyer=product.winning_bid.bidder,
+                    seller=product.seller,
+                    product=product,
+                    amount=product.winning_bid.amount,
+                    status='PENDING'
+                ))
+        Transaction.objects.bulk_create(new_transactions)
+
+        # Close the products
+        Product.objects.filter(id__in=product_ids).update(is_active=False, updated_at=timezone.now())
+        invalidate_home_cache()
+
+        # Result emails are delivered by drain_notification_outbox
+        from transactions.outbox import NotificationOutbox
+        NotificationOutbox.enqueue(*_auction_result_messages(claimed))
+
+        BidStream.publish_many([
+            (product.id, 'closed', {
+                'winner': product.winning_bid.bidder.username if product.winning_bid else None,
+                'amount': product.winning_bid.amount if product.winning_bid else None,
+            })
+            for product in claimed
+        ])
+
+    closed_at = timezone.now()
+    for product in claimed:
+        AUCTION_CLOSE_LAG.labels(trigger).observe(max((closed_at - product.auction_end_time).total_seconds(), 0))
+        AUCTIONS_CLOSED.labels(trigger, 'sold' if product.winning_bid else 'unsold').inc()
+        if product.winning_bid:
+            logger.info(f"Auction {product.id} closed. Winner: {product.winning_bid.bidder.username} - ${product.winning_bid.amount}")
+        else:
+            logger.info(f"Auction {product.id} closed with no bids.")
+
+    if settings.BIDBOOK_ENABLED:
+        from .bidbook import get_bid_book
+        book = get_bid_book()
+        for product_id in product_ids:
+            book.discard(product_id)
+
+    return claimed
+
+def _auction_result_messages(products):
+    """
+    Builds the outbox messages for the winners and sellers of closed auctions.
+    """
+    from transactions.outbox import NotificationOutbox
+
+    messages = []
+    for product in products:
+        highest_bid = product.winning_bid
+        if highest_bid:
+            # Email Winner
+            messages.append(NotificationOutbox.message(
+                highest_bid.bidder,
+                'AUCTION_WON',
+                subject=f"You Won! {product.title}",
+                body=f"Congratulations! You won the auction for '{product.title}' with a bid of ${highest_bid.amount}.\n\nPlease complete your payment here: http://localhost:8000/checkout/{product.id}/",
+                product=product,
+                notification_type='AUCTION_WON',
+                notification_message=f"You won the auction for '{product.title}' with a bid of ${highest_bid.amount}!",
+            ))
+            # Email Seller
+            messages.append(NotificationOutbox.message(
+                product.seller,
+                'ITEM_SOLD',
+                subject=f"Item Sold: {product.title}",
+                body=f"Great news! Your item '{product.title}' has been sold for ${highest_bid.amount} to {highest_bid.bidder.username}.",
+                product=product,
+                notification_type='ITEM_SOLD',
+                notification_message=f"Your item '{product.title}' has been sold for ${highest_bid.amount}!",
+            ))
+        else:
+            # Email Seller (Unsold)
+            messages.append(NotificationOutbox.message(
+                product.seller,
+                'AUCTION_ENDED',
+                subject=f"Auction Ended: {product.title}",
+                body=f"Your auction for '{product.title}' has ended with no bids.",
+                product=product,
+            ))
+    return messages
+
+def _close_auction(product_id):
+    """
+    Closes a single expired auction. Safe to call more than once.
+    Returns True if the auction was closed by this call.
+    """
+    # Wait for an in-flight bid instead of skipping the row. The end time is
+    # checked again under the lock, in case that bid extended the auction
+    return bool(_claim_and_close(_expired_auctions().filter(id=product_id), 1, skip_locked=False, trigger='scheduled'))
+
+@shared_task(bind=True)
+def close_auction(self, product_id, end_timestamp):
+    """
+    Closes one auction at its exact end time.
+    Enqueued with an ETA by AuctionScheduler; ``end_timestamp`` is the end
+    time the task was scheduled for, so tasks superseded by a sniper
+    extension can recognise themselves and exit.
+    """
+    from .bidbook import BidBookBusy
+    try:
+        _flush_bid_book()
+    except BidBookBusy as e:
+        # Another flusher is still writing bids, the winner is not known yet
+        logger.warning(f"Close of auction {product_id} postponed: {e}")
+        raise self.retry(exc=e, countdown=5, max_retries=None)
+
+    product = Product.objects.filter(id=product_id, is_active=True).only('id', 'auction_end_time').first()
+    if not product or not product.auction_end_time:
+        return f"Auction {product_id} already closed."
+
+    if product.auction_end_time.timestamp() != end_timestamp:
+        # Extended after this task was queued, a newer task owns the close
+        return f"Auction {product_id} was rescheduled."
+
+    remaining = (product.auction_end_time - timezone.now()).total_seconds()
+    if remaining > 0:
+        # Worker clock is slightly behind the scheduler, try again at the end time
+        raise self.retry(countdown=remaining, max_retries=None)
+
+    if _close_auction(product_id):
+        return f"Closed auction {product_id}."
+    return f"Auction {product_id} already closed."
+
 @shared_task
-def close_expired_auctions():
+def schedule_auction_closes():
     """
-    Periodic task to close auctions that have passed their end time.
+    Periodic task that enqueues the close tasks of auctions that came within
+    AUCTION_SCHEDULE_HORIZON since its previous run (AUCTION_SCHEDULE_INTERVAL
+    ago). AuctionScheduler leaves closes further out to this task; one
+    missed by a late run is picked up by close_expired_auctions.
     """
-    now = timezone.now()
-    # Find active auctions that have expired
-    expired_products = Product.objects.filter(
+    from .services import AuctionScheduler
+
+    horizon = timezone.now() + timedelta(seconds=settings.AUCTION_SCHEDULE_HORIZON)
+    upcoming = list(Product.objects.filter(
         is_active=True,
-        sales_type='AUCTION',
-        auction_end_time__lte=now
-    )
+        sales_type__in=AUCTION_SALES_TYPES,
+        auction_end_time__gt=horizon - timedelta(seconds=settings.AUCTION_SCHEDULE_INTERVAL),
+        auction_end_time__lte=horizon,
+    ).only('id', 'sales_type', 'auction_end_time'))
+    AuctionScheduler.schedule_many(upcoming)
+    return f"Scheduled {len(upcoming)} auction closes."
 
+@shared_task
+def close_expired_auctions():
+    """
+    Periodic safety net that closes auctions whose scheduled close task was
+    lost (e.g. broker restart). Normally finds nothing to do; a large backlog
+    (e.g. a bulk listing with identical end times) is fanned out across
+    AUCTION_CLOSE_SHARDS batch tasks.
+    """
+    _flush_bid_book()
+
+    shards = settings.AUCTION_CLOSE_SHARDS
+    backlog = _expired_auctions().count()
+    if backlog > settings.AUCTION_CLOSE_BATCH_SIZE and shards > 1:
+        group(close_expired_auctions_batch.s(shard, shards) for shard in range(shards)).apply_async()
+        return f"Dispatched {backlog} expired auctions to {shards} shards."
+
+    return close_expired_auctions_batch(0, 1)
+
+@shared_task
+def close_expired_auctions_batch(shard, shards):
+    """
+    Closes the expired auctions of one shard (``id % shards == shard``) in
+    chunks of AUCTION_CLOSE_BATCH_SIZE until none are left.
+    """
+    _flush_bid_book()
+
+    expired = _expired_auctions().alias(shard=F('id') % shards).filter(shard=shard)
+
+    started = time.monotonic()
     count = 0
-    for product in expired_products:
-        with transaction.atomic():
-            # Lock the row to prevent race conditions
-            product = Product.objects.select_for_update().get(id=product.id)
-            
-            # Double check status after lock
-            if not product.is_active:
-                continue
-
-            # Determine winner
-            highest_bid = product.bids.order_by('-amount').first()
-            
-            if highest_bid:
-                # Create Transaction
-                # Use get_or_create to prevent duplicate transactions if task runs twice
-                Transaction.objects.get_or_create(
-                    product=product,
-                    defaults={
-                        'buyer': highest_bid.bidder,
-                        'seller': product.seller,
-                        'amount': highest_bid.amount,
-                        'status': 'PENDING'
-                    }
-                )
-                logger.info(f"Auction {product.id} closed. Winner: {highest_bid.bidder.username} - ${highest_bid.amount}")
-                logger.info(f"Auction {product.id} closed. Winner: {highest_bid.bidder.username} - ${highest_bid.amount}")
-                
-                # Email Winner
-                try:
-                    from django.core.mail import send_mail
-                    send_mail(
-                        subject=f"You Won! {product.title}",
-                        message=f"Congratulations! You won the auction for '{product.title}' with a bid of ${highest_bid.amount}.\n\nPlease complete your payment here: http://localhost:8000/checkout/{product.id}/",
-                        from_email=None,
-                        recipient_list=[highest_bid.bidder.email],
-                        fail_silently=True
-                    )
-                    
-                    # Email Seller
-                    send_mail(
-                        subject=f"Item Sold: {product.title}",
-                        message=f"Great news! Your item '{product.title}' has been sold for ${highest_bid.amount} to {highest_bid.bidder.username}.",
-                        from_email=None,
-                        recipient_list=[product.seller.email],
-                        fail_silently=True
-                    )
-                except Exception as e:
-                    logger.error(f"Failed to send auction result emails: {e}")
-
-            else:
-                logger.info(f"Auction {product.id} closed with no bids.")
-                # Email Seller (Unsold)
-                try:
-                    from django.core.mail import send_mail
-                    send_mail(
-                        subject=f"Auction Ended: {product.title}",
-                        message=f"Your auction for '{product.title}' has ended with no bids.",
-                        from_email=None,
-                        recipient_list=[product.seller.email],
-                        fail_silently=True
-                    )
-                except Exception as e:
-                    logger.error(f"Failed to send unsold email: {e}")
-
-            # Close the product
-            product.is_active = False
-            product.save()
-            count += 1
-    
+    while True:
+        closed = _claim_and_close(expired, settings.AUCTION_CLOSE_BATCH_SIZE)
+        if not closed:
+            break
+        count += len(closed)
+    elapsed = time.monotonic() - started
+
+    rate = count / elapsed if elapsed else 0
+    if count:
+        logger.info(f"Shard {shard}/{shards} closed {count} auctions in {elapsed:.2f}s ({rate:.1f} auctions/s)")
     return f"Closed {count} auctions."
+
+@shared_task
+def flush_bid_book():
+    """
+    Periodic task that writes bids accepted by the Redis bid book to the database.
+    """
+    if not settings.BIDBOOK_ENABLED:
+        return "Bid book disabled."
+
+    from .bidbook import get_bid_book
+    flushed = get_bid_book().flush()
+    return f"Flushed {flushed} bids."
+
+@shared_task
+def rebuild_bid_books():
+    """
+    Rebuilds the bid book of every active auction from the Bid table.
+    Run after a Redis restart or whenever the book is suspected to have drifted.
+    """
+    from .bidbook import get_bid_book
+    book = get_bid_book()
+
+    count = 0
+    for product in Product.objects.filter(is_active=True).exclude(sales_type='DIRECT'):
+        book.rebuild(product)
+        count += 1
+
+    return f"Rebuilt {count} bid books."
+
+
+@shared_task
+def process_product_images(image_ids):
+    """
+    Renders the card and detail variants of newly uploaded product images.
+    """
+    from .images import ImagePipeline
+
+    processed = ImagePipeline.process(image_ids)
+    return f"Processed {processed} product images."
@@ -42,3 +42,45 @@ def is_expired(end_time):
         return False
     return end_time < timezone.now()
 
+
+from django.utils.html import format_html, format_html_join
+
+@register.simple_tag
+def product_image(image, size='card', **attrs):
+    """
+    Renders a ProductImage as a <picture> with WebP and JPEG srcsets over
+    its pipeline variants (market/images.py), sized for ``size``. Falls back
+    to the original upload until the variants exist. Extra keyword
+    arguments become attributes of the <img>.
+    """
+    if not image:
+        return ''
+    from market.images import VARIANTS
+
+    attrs.setdefault('loading', 'lazy')
+    variants = {}
+    for name in VARIANTS:
+        if name in image.variants:
+            # Small uploads give several variants of the same width
+            variants.setdefault(image.variants[name]['width'], image.variants[name])
+    if not variants:
+        if image.width and image.height:
+            attrs.setdefault('width', image.width)
+            attrs.setdefault('height', image.height)
+        return format_html('<img src="{}" {}>', image.image.url, format_html_join(' ', '{}="{}"', attrs.items()))
+
+    storage = image.image.storage
+    chosen = image.variants.get(size) or variants[max(variants)]
+    attrs.setdefault('width', chosen['width'])
+    attrs.setdefault('height', chosen['height'])
+    srcset = {
+        fmt: ', '.join(f"{storage.url(variant[fmt])} {width}w" for width, variant in sorted(variants.items()))
+        for fmt in ('webp', 'jpeg')
+    }
+    return format_html(
+        '<picture class="contents"><source type="image/webp" srcset="{}" sizes="{}">'
+        '<img src="{}" srcset="{}" sizes="{}" decoding="async" {}></picture>',
+        srcset['webp'], VARIANTS[size][1],
+        storage.url(chosen['jpeg']), srcset['jpeg'], VARIANTS[size][1],
+        format_html_join(' ', '{}="{}"', attrs.items()),
+    )
@@ -1,3 +1,1286 @@
-from django.test import TestCase
+import asyncio
+import json
+import random
+import shutil
+import tempfile
+from datetime import timedelta
+from decimal import Decimal
+from io import BytesIO, StringIO
+from unittest import mock
 
-# Create your tests here.
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import connection
+from django.template import Context, Template
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import NoReverseMatch, reverse
+from django.utils import timezone
+
+from users.models import User
+from transactions.models import Review, Transaction
+import fakeredis
+from prometheus_client import REGISTRY
+
+from nexus_core.queries import assert_queries
+from .models import Category, Product, ProductImage, Bid, IncrementBand, SniperPolicy
+from . import bidbook, ingest, streams, tasks
+from .bidbook import BidBook, BidBookBusy
+from .images import ImagePipeline
+from .ingest import ACCEPTED, PENDING, REJECTED, BidIngest
+from .rules import invalidate_auction_rules
+from .search import ProductSearch
+from .services import AuctionScheduler, BidService
+from .streams import BidStream, ProductEventHub, channel_name, format_event
+from .tasks import close_auction, close_expired_auctions, close_expired_auctions_batch, schedule_auction_closes
+
+
+def make_auction(seller, category, **kwargs):
+    defaults = {
+        'seller': seller,
+        'category': category,
+        'title': 'Vintage Watch',
+        'description': 'Test listing',
+        'condition': 'USED',
+        'location': 'Lima',
+        'sales_type': 'AUCTION',
+        'initial_price': Decimal('10.00'),
+        'auction_end_time': timezone.now() - timedelta(seconds=1),
+    }
+    defaults.update(kwargs)
+    return Product.objects.create(**defaults)
+
+
+class AuctionClosingTests(TestCase):
+    def setUp(self):
+        self.seller = User.objects.create_user(username='seller', email='seller@example.com')
+        self.buyer = User.objects.create_user(username='buyer', email='buyer@example.com')
+        self.category = Category.objects.create(name='Watches')
+
+    def test_close_auction_creates_transaction_for_winner(self):
+        product = make_auction(self.seller, self.category)
+        Bid.objects.create(product=product, bidder=self.buyer, amount=Decimal('15.00'))
+
+        close_auction(product.id, product.auction_end_time.timestamp())
+
+        product.refresh_from_db()
+        self.assertFalse(product.is_active)
+        txn = Transaction.objects.get(product=product)
+        self.assertEqual(txn.buyer, self.buyer)
+        self.assertEqual(txn.amount, Decimal('15.00'))
+
+    def test_superseded_close_task_does_nothing(self):
+        product = make_auction(self.seller, self.category)
+        stale_end = product.auction_end_time - timedelta(minutes=1)
+
+        result = close_auction(product.id, stale_end.timestamp())
+
+        product.refresh_from_db()
+        self.assertTrue(product.is_active)
+        self.assertIn('rescheduled', result)
+
+    def test_close_rechecks_end_time_under_the_row_lock(self):
+        product = make_auction(self.seller, self.category)
+        claim = tasks._claim_and_close
+
+        def extended_while_waiting(*args, **kwargs):
+            # A sniping bid holding the row lock extends the auction
+            Product.objects.filter(pk=product.pk).update(auction_end_time=timezone.now() + timedelta(minutes=1))
+            return claim(*args, **kwargs)
+
+        with mock.patch.object(tasks, '_claim_and_close', extended_while_waiting):
+            close_auction(product.id, product.auction_end_time.timestamp())
+
+        product.refresh_from_db()
+        self.assertTrue(product.is_active)
+
+    def test_safety_net_closes_hybrid_listings_once(self):
+        product = make_auction(self.seller, self.category, sales_type='HYBRID', buy_now_price=Decimal('50.00'))
+        Bid.objects.create(product=product, bidder=self.buyer, amount=Decimal('20.00'))
+
+        self.assertEqual(close_expired_auctions(), "Closed 1 auctions.")
+        self.assertEqual(close_expired_auctions(), "Closed 0 auctions.")
+        self.assertEqual(Transaction.objects.filter(product=product).count(), 1)
+
+    @override_settings(AUCTION_CLOSE_BATCH_SIZE=2)
+    def test_sharded_batches_close_every_auction_exactly_once(self):
+        products = [make_auction(self.seller, self.category) for _ in range(7)]
+        for i, product in enumerate(products[:5]):
+            Bid.objects.create(product=product, bidder=self.buyer, amount=Decimal('11.00') + i)
+
+        close_expired_auctions_batch(0, 2)
+        close_expired_auctions_batch(1, 2)
+        close_expired_auctions_batch(0, 2)
+
+        self.assertFalse(Product.objects.filter(is_active=True).exists())
+        self.assertEqual(Transaction.objects.count(), 5)
+        self.assertEqual(
+            set(Transaction.objects.values_list('product_id', 'amount')),
+            {(p.id, Decimal('11.00') + i) for i, p in enumerate(products[:5])},
+        )
+
+
+@override_settings(AUCTION_SCHEDULE_HORIZON=1800, AUCTION_SCHEDULE_INTERVAL=300)
+class AuctionSchedulerTests(TestCase):
+    def setUp(self):
+        self.seller = User.objects.create_user(username='seller', email='seller@example.com')
+        self.category = Category.objects.create(name='Watches')
+
+    def scheduled(self, create):
+        with mock.patch.object(close_auction, 'apply_async') as apply_async:
+            with self.captureOnCommitCallbacks(execute=True):
+                create()
+        return [call.kwargs['args'][0] for call in apply_async.call_args_list]
+
+    def test_only_closes_within_the_horizon_are_enqueued(self):
+        products = {}
+
+        def create():
+            products['soon'] = make_auction(self.seller, self.category, auction_end_time=timezone.now() + timedelta(minutes=10))
+            products['later'] = make_auction(self.seller, self.category, auction_end_time=timezone.now() + timedelta(days=7))
+
+        self.assertEqual(self.scheduled(create), [products['soon'].id])
+
+    def test_periodic_task_enqueues_closes_entering_the_horizon(self):
+        with mock.patch.object(close_auction, 'apply_async'):
+            entering = make_auction(self.seller, self.category, auction_end_time=timezone.now() + timedelta(minutes=28))
+            make_auction(self.seller, self.category, auction_end_time=timezone.now() + timedelta(minutes=20))
+            make_auction(self.seller, self.category, auction_end_time=timezone.now() + timedelta(hours=2))
+
+        self.assertEqual(self.scheduled(schedule_auction_closes), [entering.id])
+
+    def test_editing_the_end_time_schedules_the_new_close(self):
+        with mock.patch.object(close_auction, 'apply_async'):
+            product = make_auction(self.seller, self.category, auction_end_time=timezone.now() + timedelta(minutes=10))
+        product = Product.objects.get(pk=product.pk)
+
+        def edit_title():
+            product.title = 'Renamed'
+            product.save()
+
+        def edit_end_time():
+            product.auction_end_time += timedelta(minutes=5)
+            product.save()
+
+        self.assertEqual(self.scheduled(edit_title), [])
+        self.assertEqual(self.scheduled(edit_end_time), [product.id])
+        # Saved once, the same end time is not scheduled again
+        self.assertEqual(self.scheduled(edit_title), [])
+
+
+class BidServiceTests(TestCase):
+    def setUp(self):
+        self.seller = User.objects.create_user(username='seller', email='seller@example.com')
+        self.alice = User.objects.create_user(username='alice', email='alice@example.com')
+        self.bob = User.objects.create_user(username='bob', email='bob@example.com')
+        self.product = make_auction(
+            self.seller,
+            Category.objects.create(name='Watches'),
+            auction_end_time=timezone.now() + timedelta(days=1),
+        )
+
+    def test_place_bid_maintains_bid_statistics(self):
+        BidService.place_bid(self.product, self.alice, Decimal('10.00'))
+        BidService.place_bid(self.product, self.bob, Decimal('12.00'))
+
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.bid_count, 2)
+        self.assertEqual(self.product.leading_bidder, self.bob)
+        self.assertEqual(self.product.current_highest_bid, Decimal('12.00'))
+        self.assertEqual(self.product.last_bid_at, self.product.bids.latest('timestamp').timestamp)
+
+
+class AuctionRulesTests(TestCase):
+    def setUp(self):
+        self.seller = User.objects.create_user(username='seller', email='seller@example.com')
+        self.alice = User.objects.create_user(username='alice', email='alice@example.com')
+        self.bob = User.objects.create_user(username='bob', email='bob@example.com')
+        self.art = Category.objects.create(name='Art')
+        self.paintings = Category.objects.create(name='Paintings', parent=self.art)
+        IncrementBand.objects.create(min_amount=Decimal('0.00'), increment=Decimal('1.00'))
+        IncrementBand.objects.create(min_amount=Decimal('100.00'), increment=Decimal('5.00'))
+        IncrementBand.objects.create(category=self.art, min_amount=Decimal('0.00'), increment=Decimal('10.00'))
+        # Rows rolled back after each test never reach the delete signal
+        self.addCleanup(invalidate_auction_rules)
+
+    def auction(self, category, **kwargs):
+        kwargs.setdefault('auction_end_time', timezone.now() + timedelta(days=1))
+        return make_auction(self.seller, category, **kwargs)
+
+    def test_increments_follow_the_price_band_and_category(self):
+        watch = self.auction(Category.objects.create(name='Watches'), initial_price=Decimal('99.00'))
+        watch = BidService.place_bid(watch, self.alice, Decimal('99.00'))
+        self.assertEqual(BidService.minimum_bid(watch), Decimal('100.00'))
+        watch = BidService.place_bid(watch, self.bob, Decimal('100.00'))
+        with self.assertRaisesMessage(ValidationError, 'Bid must be at least 105.00'):
+            BidService.place_bid(watch, self.alice, Decimal('104.00'))
+
+        # Subcategories use their parent's table
+        painting = self.auction(self.paintings)
+        painting = BidService.place_bid(painting, self.alice, Decimal('10.00'))
+        self.assertEqual(BidService.minimum_bid(painting), Decimal('20.00'))
+
+    def test_product_page_shows_the_band_increment(self):
+        watch = self.auction(Category.objects.create(name='Watches'), initial_price=Decimal('99.00'))
+        self.client.force_login(self.bob)
+        self.addCleanup(cache.clear)
+        self.assertContains(self.client.get(reverse('product_detail', args=[watch.pk])), 'Min incr: $1.00')
+
+        BidService.place_bid(watch, self.alice, Decimal('150.00'))
+        self.assertContains(self.client.get(reverse('product_detail', args=[watch.pk])), 'Min incr: $5.00')
+        painting = self.auction(self.paintings)
+        self.assertContains(self.client.get(reverse('product_detail', args=[painting.pk])), 'Min incr: $10.00')
+
+    def test_proxy_bids_step_by_the_band_increment(self):
+        watch = self.auction(Category.objects.create(name='Watches'))
+        BidService.set_max_bid(watch, self.alice, Decimal('500.00'))
+        BidService.set_max_bid(watch, self.bob, Decimal('150.00'))
+
+        watch.refresh_from_db()
+        self.assertEqual((watch.leading_bidder, watch.current_highest_bid), (self.alice, Decimal('155.00')))
+
+    def test_sniper_policy_caps_extensions(self):
+        SniperPolicy.objects.create(category=self.art, window_seconds=120, extension_seconds=300, max_extensions=1)
+        end = timezone.now() + timedelta(seconds=90)
+        painting = self.auction(self.art, auction_end_time=end)
+
+        painting = BidService.place_bid(painting, self.alice, Decimal('10.00'))
+        self.assertEqual(painting.auction_end_time, end + timedelta(minutes=5))
+
+        Product.objects.filter(id=painting.id).update(auction_end_time=end)
+        painting = BidService.place_bid(painting, self.bob, Decimal('20.00'))
+        painting.refresh_from_db()
+        self.assertEqual((painting.auction_end_time, painting.extension_count), (end, 1))
+
+    def test_rules_are_served_from_memory(self):
+        watch = self.auction(Category.objects.create(name='Watches'))
+        BidService.place_bid(watch, self.alice, Decimal('10.00'))
+
+        with CaptureQueriesContext(connection) as queries:
+            BidService.place_bid(watch, self.bob, Decimal('11.00'))
+        tables = ' '.join(query['sql'] for query in queries)
+        self.assertNotIn('incrementband', tables)
+        self.assertNotIn('sniperpolicy', tables)
+
+
+class BidBookTests(TestCase):
+    def setUp(self):
+        self.redis = fakeredis.FakeRedis()
+        self.book = BidBook(self.redis)
+        bidbook._bid_book = self.book
+        self.addCleanup(setattr, bidbook, '_bid_book', None)
+        invalidate_auction_rules()
+        self.seller = User.objects.create_user(username='seller', email='seller@example.com')
+        self.alice = User.objects.create_user(username='alice', email='alice@example.com')
+        self.bob = User.objects.create_user(username='bob', email='bob@example.com')
+        self.product = make_auction(self.seller, Category.objects.create(name='Watches'),
+                                    auction_end_time=timezone.now() + timedelta(hours=1))
+
+    def hold_flush_lock(self):
+        self.redis.set(BidBook.FLUSH_LOCK_KEY, 1)
+
+    def test_place_enforces_minimum_seller_and_end(self):
+        self.assertIsNone(self.book.place(self.product, self.alice, Decimal('10.00'))[0])
+        self.assertEqual(self.book.place(self.product, self.bob, Decimal('11.00'))[0], self.alice.id)
+        with self.assertRaisesMessage(ValidationError, 'Bid must be at least 12.00'):
+            self.book.place(self.product, self.alice, Decimal('11.50'))
+        with self.assertRaisesMessage(ValidationError, 'You cannot bid on your own product.'):
+            self.book.place(self.product, self.seller, Decimal('20.00'))
+
+        self.redis.hset(BidBook.book_key(self.product.id), 'end', 1)
+        with self.assertRaisesMessage(ValidationError, 'This auction has ended.'):
+            self.book.place(self.product, self.alice, Decimal('20.00'))
+
+    def test_late_bid_extends_the_book(self):
+        self.product.auction_end_time = timezone.now() + timedelta(seconds=10)
+        self.product.save()
+
+        _, end_time = self.book.place(self.product, self.alice, Decimal('10.00'))
+
+        self.assertGreater(end_time, self.product.auction_end_time + timedelta(seconds=59))
+        self.assertEqual(self.redis.hget(BidBook.book_key(self.product.id), 'extensions'), b'1')
+
+    def test_load_never_overwrites_a_live_book(self):
+        self.book.place(self.product, self.alice, Decimal('10.00'))
+
+        self.assertFalse(self.book.load(self.product))
+        self.assertEqual(self.redis.hget(BidBook.book_key(self.product.id), 'highest'), b'1000')
+
+    @override_settings(BIDBOOK_ENABLED=True)
+    def test_flush_persists_pending_bids_and_mirrors_the_product(self):
+        BidService.place_bid(self.product, self.alice, Decimal('10.00'))
+        BidService.place_bid(self.product, self.bob, Decimal('12.00'))
+        self.assertFalse(Bid.objects.exists())
+
+        self.assertEqual(self.book.flush(), 2)
+
+        self.product.refresh_from_db()
+        self.assertEqual(list(Bid.objects.order_by('id').values_list('bidder_id', 'amount')),
+                         [(self.alice.id, Decimal('10.00')), (self.bob.id, Decimal('12.00'))])
+        self.assertEqual((self.product.bid_count, self.product.leading_bidder, self.product.current_highest_bid),
+                         (2, self.bob, Decimal('12.00')))
+        self.assertEqual(self.redis.llen(BidBook.PENDING_KEY), 0)
+        self.assertEqual(self.book.flush(), 0)
+
+    def test_failed_persist_keeps_pending_bids(self):
+        self.book.place(self.product, self.alice, Decimal('10.00'))
+
+        with mock.patch.object(Bid.objects, 'bulk_create', side_effect=RuntimeError):
+            with self.assertRaises(RuntimeError):
+                self.book.flush()
+
+        self.assertEqual(self.redis.llen(BidBook.PENDING_KEY), 1)
+        self.assertIsNone(self.redis.get(BidBook.FLUSH_LOCK_KEY))
+        self.assertEqual(self.book.flush(), 1)
+
+    @override_settings(BIDBOOK_FLUSH_WAIT=0.1)
+    def test_busy_flush_lock(self):
+        self.book.place(self.product, self.alice, Decimal('10.00'))
+        self.hold_flush_lock()
+
+        # The periodic flush leaves the work to the holder
+        self.assertEqual(self.book.flush(), 0)
+        # Readers of the Bid table never proceed on a partial flush
+        with self.assertRaises(BidBookBusy):
+            self.book.flush(wait=0.1)
+        with self.assertRaises(BidBookBusy):
+            self.book.rebuild(self.product)
+        self.assertTrue(self.redis.exists(BidBook.book_key(self.product.id)))
+
+    def test_flush_never_trims_or_releases_a_lock_it_lost(self):
+        self.book.place(self.product, self.alice, Decimal('10.00'))
+        persist = self.book._persist
+
+        def slow_persist(entries):
+            # The lock expired mid-batch and another flusher took it
+            self.redis.set(BidBook.FLUSH_LOCK_KEY, 'other')
+            persist(entries)
+
+        with mock.patch.object(self.book, '_persist', slow_persist):
+            with self.assertRaises(BidBookBusy):
+                self.book.flush()
+
+        self.assertEqual(self.redis.get(BidBook.FLUSH_LOCK_KEY), b'other')
+        self.assertEqual(self.redis.llen(BidBook.PENDING_KEY), 1)
+
+    def test_flush_renews_the_lock_after_each_batch(self):
+        self.book.place(self.product, self.alice, Decimal('10.00'))
+        self.book.place(self.product, self.bob, Decimal('11.00'))
+        ttls = []
+        persist = self.book._persist
+
+        def tracked_persist(entries):
+            ttls.append(self.redis.pttl(BidBook.FLUSH_LOCK_KEY))
+            # Most of the TTL spent on this batch
+            self.redis.pexpire(BidBook.FLUSH_LOCK_KEY, 1000)
+            persist(entries)
+
+        with mock.patch.object(self.book, '_persist', tracked_persist):
+            self.assertEqual(self.book.flush(batch_size=1), 2)
+        self.assertEqual(len(ttls), 2)
+        self.assertGreater(min(ttls), 50_000)
+        self.assertIsNone(self.redis.get(BidBook.FLUSH_LOCK_KEY))
+
+    @override_settings(BIDBOOK_ENABLED=True)
+    def test_flush_keeps_the_time_each_bid_was_accepted(self):
+        accepted = timezone.now()
+        BidService.place_bid(self.product, self.alice, Decimal('10.00'))
+
+        with mock.patch('django.utils.timezone.now', return_value=accepted + timedelta(minutes=5)):
+            self.book.flush()
+
+        bid = Bid.objects.get()
+        self.product.refresh_from_db()
+        self.assertLess(abs(bid.timestamp - accepted), timedelta(seconds=5))
+        self.assertEqual(self.product.last_bid_at, bid.timestamp)
+
+    @override_settings(BIDBOOK_ENABLED=True)
+    def test_bid_outside_the_window_does_not_extend(self):
+        end = timezone.now().replace(microsecond=123456) + timedelta(hours=1)
+        Product.objects.filter(pk=self.product.pk).update(auction_end_time=end)
+        self.product.refresh_from_db()
+
+        with mock.patch.object(AuctionScheduler, 'schedule') as schedule, \
+                mock.patch.object(BidService, '_broadcast') as broadcast:
+            product = BidService.place_bid(self.product, self.alice, Decimal('10.00'))
+
+        schedule.assert_not_called()
+        self.assertFalse(broadcast.call_args.args[2])
+        self.assertEqual(product.auction_end_time, end)
+
+    def test_rebuild_reloads_from_the_bid_table(self):
+        self.book.place(self.product, self.alice, Decimal('10.00'))
+        self.redis.hset(BidBook.book_key(self.product.id), 'highest', 99999)
+
+        self.assertTrue(self.book.rebuild(self.product))
+
+        self.assertEqual(self.redis.hget(BidBook.book_key(self.product.id), 'highest'), b'1000')
+        self.assertEqual(self.redis.hget(BidBook.book_key(self.product.id), 'leader'), str(self.alice.id).encode())
+
+    @override_settings(BIDBOOK_ENABLED=True, BIDBOOK_FLUSH_WAIT=0.1)
+    def test_close_waits_for_a_running_flush(self):
+        self.book.place(self.product, self.alice, Decimal('10.00'))
+        ended = timezone.now().replace(microsecond=0) - timedelta(seconds=1)
+        self.redis.hset(BidBook.book_key(self.product.id), 'end', bidbook.to_millis(ended))
+        self.hold_flush_lock()
+
+        with self.assertRaises(BidBookBusy):
+            close_auction(self.product.id, ended.timestamp())
+        self.product.refresh_from_db()
+        self.assertTrue(self.product.is_active)
+
+        self.redis.delete(BidBook.FLUSH_LOCK_KEY)
+        self.assertEqual(close_auction(self.product.id, ended.timestamp()), f"Closed auction {self.product.id}.")
+        self.assertEqual(Transaction.objects.get(product=self.product).buyer, self.alice)
+
+
+@override_settings(BID_STREAM_ENABLED=True)
+class BidStreamTests(TestCase):
+    def setUp(self):
+        self.server = fakeredis.FakeServer()
+        self.redis = fakeredis.FakeRedis(server=self.server)
+        BidStream._client = self.redis
+        self.addCleanup(setattr, BidStream, '_client', None)
+        self.hub = ProductEventHub('redis://unused')
+        self.hub.pubsub = fakeredis.FakeAsyncRedis(server=self.server).pubsub(ignore_subscribe_messages=True)
+        streams._hub = self.hub
+        self.addCleanup(setattr, streams, '_hub', None)
+
+    def tearDown(self):
+        for task in (self.hub.reader, self.hub.heartbeat):
+            if task is not None:
+                task.cancel()
+
+    def listen(self, product_id):
+        pubsub = self.redis.pubsub(ignore_subscribe_messages=True)
+        pubsub.subscribe(channel_name(product_id))
+        self.addCleanup(pubsub.close)
+        # The subscribe confirmation
+        pubsub.get_message(timeout=0.01)
+        return pubsub
+
+    def received(self, pubsub):
+        messages = []
+        while (message := pubsub.get_message(timeout=0.01)) is not None:
+            messages.append(json.loads(message['data']))
+        return messages
+
+    async def until(self, condition):
+        for _ in range(300):
+            if condition():
+                return
+            await asyncio.sleep(0.01)
+        self.fail("Condition not met")
+
+    def test_format_event(self):
+        self.assertEqual(format_event(b'{"event": "bid", "amount": "12.00"}'),
+                         b'event: bid\ndata: {"event": "bid", "amount": "12.00"}\n\n')
+        self.assertEqual(format_event('{"amount": 1}'), b'event: message\ndata: {"amount": 1}\n\n')
+
+    def test_events_are_published_once_the_transaction_commits(self):
+        pubsub = self.listen(7)
+        with self.captureOnCommitCallbacks() as callbacks:
+            BidStream.publish_many([(7, 'bid', {'amount': Decimal('12.00'), 'bidder': 'alice'}),
+                                    (7, 'extended', {'auction_end_time': 'soon'})])
+            self.assertEqual(self.received(pubsub), [])
+        for callback in callbacks:
+            callback()
+
+        events = self.received(pubsub)
+        self.assertEqual([(event['event'], event['product_id']) for event in events], [('bid', 7), ('extended', 7)])
+        self.assertEqual(events[0]['amount'], '12.00')
+        self.assertIn('sent_at', events[0])
+
+    def test_place_bid_broadcasts_the_bid(self):
+        seller = User.objects.create_user(username='seller', email='seller@example.com')
+        alice = User.objects.create_user(username='alice', email='alice@example.com')
+        product = make_auction(seller, Category.objects.create(name='Watches'),
+                               auction_end_time=timezone.now() + timedelta(hours=1))
+        pubsub = self.listen(product.id)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            BidService.place_bid(product, alice, Decimal('10.00'))
+
+        [event] = self.received(pubsub)
+        self.assertEqual((event['event'], event['bidder'], event['amount']), ('bid', 'alice', '10.00'))
+
+    async def test_hub_fans_out_and_drops_the_oldest_for_slow_clients(self):
+        with mock.patch.object(streams, 'CLIENT_QUEUE_SIZE', 2):
+            first = await self.hub.subscribe(1)
+            second = await self.hub.subscribe(1)
+            other = await self.hub.subscribe(2)
+        # Keeps every event, so shows when all three were fanned out
+        tracker = await self.hub.subscribe(1)
+        for amount in (10, 11, 12):
+            self.redis.publish(channel_name(1), json.dumps({'event': 'bid', 'amount': amount}))
+        await self.until(lambda: tracker.qsize() == 3)
+
+        received = [first.get_nowait(), first.get_nowait()]
+        self.assertEqual([json.loads(body.split(b'data: ')[1])['amount'] for body in received], [11, 12])
+        self.assertEqual([second.get_nowait(), second.get_nowait()], received)
+        self.assertTrue(other.empty())
+
+        await self.hub.unsubscribe(1, first)
+        self.assertIn(channel_name(1), self.hub.subscribers)
+        await self.hub.unsubscribe(1, second)
+        await self.hub.unsubscribe(1, tracker)
+        self.assertNotIn(channel_name(1), self.hub.subscribers)
+
+    async def test_asgi_serves_the_stream_until_disconnect(self):
+        from nexus_core import asgi
+
+        inbox = asyncio.Queue()
+        sent = []
+
+        async def send(message):
+            sent.append(message)
+
+        scope = {'type': 'http', 'method': 'GET', 'path': '/stream/products/5/', 'headers': []}
+        with mock.patch.object(asgi, 'django_application', mock.AsyncMock()) as django_application:
+            stream = asyncio.create_task(asgi.application(scope, inbox.get, send))
+            await self.until(lambda: channel_name(5) in self.hub.subscribers)
+            self.redis.publish(channel_name(5), json.dumps({'event': 'closed', 'winner': 'alice'}))
+            await self.until(lambda: len(sent) == 3)
+            await inbox.put({'type': 'http.disconnect'})
+            await asyncio.wait_for(stream, 5)
+
+            await asgi.application({**scope, 'path': '/catalog/'}, inbox.get, send)
+            with self.settings(BID_STREAM_ENABLED=False):
+                await asgi.application(scope, inbox.get, send)
+
+        self.assertEqual(sent[0]['status'], 200)
+        self.assertIn((b'content-type', b'text/event-stream'), sent[0]['headers'])
+        self.assertEqual(sent[1]['body'], b'retry: 3000\n\n')
+        self.assertTrue(sent[2]['body'].startswith(b'event: closed\ndata: '))
+        self.assertNotIn(channel_name(5), self.hub.subscribers)
+        self.assertEqual(django_application.await_count, 2)
+
+    @override_settings(BID_STREAM_ALLOWED_ORIGINS=['https://nexusinc.lat'])
+    def test_stream_allows_the_site_origin_only(self):
+        def allowed(origin):
+            headers = dict(streams.response_headers({'headers': [(b'origin', origin)] if origin else []}))
+            return headers.get(b'access-control-allow-origin')
+
+        self.assertEqual(allowed(b'https://nexusinc.lat'), b'https://nexusinc.lat')
+        self.assertIsNone(allowed(b'https://evil.example'))
+        self.assertIsNone(allowed(None))
+
+
+class BidIngestTests(TestCase):
+    def setUp(self):
+        self.redis = fakeredis.FakeRedis()
+        self.ingest = BidIngest(self.redis, 2)
+        self.seller = User.objects.create_user(username='seller', email='seller@example.com')
+        self.alice = User.objects.create_user(username='alice', email='alice@example.com')
+        self.bob = User.objects.create_user(username='bob', email='bob@example.com')
+        self.product = make_auction(self.seller, Category.objects.create(name='Watches'),
+                                    auction_end_time=timezone.now() + timedelta(hours=1))
+        self.shard = self.ingest.shard_for(self.product.id)
+
+    def status(self, ticket):
+        return self.ingest.ticket(ticket)['status']
+
+    def die_holding(self, count):
+        """
+        A consumer that reads ``count`` entries and dies before acknowledging them.
+        """
+        stream = BidIngest.stream_key(self.shard)
+        self.redis.xgroup_create(stream, BidIngest.GROUP, id='0', mkstream=True)
+        return self.redis.xreadgroup(BidIngest.GROUP, 'dead', {stream: '>'}, count=count)[0][1]
+
+    def test_consume_applies_bids_in_order_and_resolves_tickets(self):
+        first = self.ingest.submit(self.product, self.alice, Decimal('10.00'))
+        second = self.ingest.submit(self.product, self.bob, Decimal('10.00'))
+        self.assertEqual(self.status(first), PENDING)
+
+        self.assertEqual(self.ingest.consume(self.shard, 'applier', block_ms=1), 2)
+
+        self.assertEqual(self.status(first), ACCEPTED)
+        self.assertEqual(self.ingest.ticket(second)['message'], 'Bid must be at least 11.00')
+        self.assertEqual(self.ingest.consume(self.shard, 'applier', block_ms=1), 0)
+
+    def test_malformed_amount_is_rejected_and_acknowledged(self):
+        ticket = self.ingest.submit(self.product, self.alice, 'ten')
+
+        self.ingest.consume(self.shard, 'applier', block_ms=1)
+
+        self.assertEqual((self.status(ticket), self.ingest.ticket(ticket)['message']), (REJECTED, 'Invalid amount.'))
+        self.assertEqual(self.redis.xpending(BidIngest.stream_key(self.shard), BidIngest.GROUP)['pending'], 0)
+
+    def test_replay_skips_resolved_tickets(self):
+        ticket = self.ingest.submit(self.product, self.alice, Decimal('10.00'))
+        self.die_holding(1)
+        self.ingest._resolve(ticket, self.product.id, ACCEPTED, "Bid placed successfully!")
+
+        self.assertEqual(self.ingest.consume(self.shard, 'applier', block_ms=1), 1)
+
+        self.assertFalse(Bid.objects.exists())
+        self.assertEqual(self.status(ticket), ACCEPTED)
+
+    def test_replay_places_entries_the_dead_consumer_never_started(self):
+        ticket = self.ingest.submit(self.product, self.alice, Decimal('10.00'))
+        self.die_holding(1)
+
+        self.ingest.consume(self.shard, 'applier', block_ms=1)
+
+        self.assertEqual(self.status(ticket), ACCEPTED)
+        self.assertEqual(Bid.objects.count(), 1)
+
+    @override_settings(BIDBOOK_ENABLED=True)
+    def test_replay_of_a_written_behind_bid_is_not_placed_twice(self):
+        bidbook._bid_book = BidBook(fakeredis.FakeRedis())
+        self.addCleanup(setattr, bidbook, '_bid_book', None)
+        ticket = self.ingest.submit(self.product, self.alice, Decimal('10.00'))
+        self.die_holding(1)
+        # It died after the book took the bid, before resolving the ticket
+        self.ingest._mark(ticket, applying=1)
+        BidService.place_bid(self.product, self.alice, Decimal('10.00'))
+
+        self.ingest.consume(self.shard, 'applier', block_ms=1)
+
+        self.assertEqual(self.status(ticket), ACCEPTED)
+        self.assertEqual(Bid.objects.count(), 1)
+        self.assertEqual(bidbook._bid_book.redis.llen(BidBook.PENDING_KEY), 0)
+
+    @override_settings(BID_INGEST_ENABLED=True)
+    def test_tickets_are_only_shown_to_their_bidder(self):
+        self.reload_urls()
+        ingest._bid_ingest = self.ingest
+        self.addCleanup(setattr, ingest, '_bid_ingest', None)
+
+        self.client.force_login(self.alice)
+        response = self.client.post(f'/api/products/{self.product.id}/bid/', {'amount': '10.00'})
+        self.assertEqual(response.status_code, 202)
+        ticket = response.json()['ticket']
+        self.assertEqual(response.json()['status_url'], f'/api/bid-tickets/{ticket}/')
+        self.assertEqual(self.client.get(f'/api/bid-tickets/{ticket}/').json()['status'], PENDING)
+
+        self.ingest.consume(self.shard, 'applier', block_ms=1)
+        self.assertEqual(self.client.get(f'/api/bid-tickets/{ticket}/').json()['status'], ACCEPTED)
+
+        self.client.force_login(self.bob)
+        self.assertEqual(self.client.get(f'/api/bid-tickets/{ticket}/').status_code, 404)
+
+    def test_ticket_route_needs_ingest_enabled(self):
+        self.client.force_login(self.alice)
+        self.assertEqual(self.client.get('/api/bid-tickets/abc/').status_code, 404)
+        with self.assertRaises(NoReverseMatch):
+            reverse('bid_ticket', args=['abc'])
+
+    def reload_urls(self):
+        import importlib
+        from django.urls import clear_url_caches
+        import nexus_core.urls
+
+        def reload():
+            importlib.reload(nexus_core.urls)
+            clear_url_caches()
+
+        reload()
+        self.addCleanup(reload)
+
+
+class ProxyBiddingTests(TestCase):
+    def setUp(self):
+        self.seller = User.objects.create_user(username='seller', email='seller@example.com')
+        self.bidders = [User.objects.create_user(username=f'bidder{i}', email=f'b{i}@example.com') for i in range(4)]
+        self.category = Category.objects.create(name='Watches')
+
+    def auction(self, **kwargs):
+        kwargs.setdefault('auction_end_time', timezone.now() + timedelta(days=1))
+        return make_auction(self.seller, self.category, **kwargs)
+
+    @staticmethod
+    def step(state, bidder, amount, is_max):
+        """
+        Reference model: applies one arrival to (price, leader, leader_max)
+        with the classic two-party rule, the higher maximum leads one $1
+        increment above the other and the earlier one wins ties. Returns
+        None when the arrival must be rejected.
+        """
+        price, leader, leader_max = state
+        if leader is None:
+            if amount < Decimal('10.00'):
+                return None
+            return (Decimal('10.00') if is_max else amount), bidder, amount
+        if bidder == leader:
+            if is_max:
+                return (price, leader, amount) if amount > leader_max else None
+            if amount < price + 1:
+                return None
+            return amount, leader, max(leader_max, amount)
+        if amount < price + 1:
+            return None
+        if amount > leader_max:
+            return max(price, min(amount, leader_max + 1) if is_max else amount), bidder, amount
+        return max(price, leader_max if amount == leader_max else min(leader_max, amount + 1)), leader, leader_max
+
+    def test_matches_sequential_reference_on_random_sequences(self):
+        rng = random.Random(20240613)
+        for run in range(40):
+            product = self.auction(title=f'Lot {run}')
+            state = (Decimal('0.00'), None, None)
+            for _ in range(rng.randint(2, 8)):
+                bidder = rng.choice(self.bidders)
+                # A narrow range so ties and near misses are common
+                amount = Decimal(rng.randint(8, 30)) + rng.choice([Decimal('0.00'), Decimal('0.50')])
+                is_max = rng.random() < 0.7
+                expected = self.step(state, bidder.id, amount, is_max)
+                place = BidService.set_max_bid if is_max else BidService.place_bid
+                with self.subTest(run=run, bidder=bidder.id, amount=amount, is_max=is_max):
+                    try:
+                        place(product, bidder, amount)
+                        accepted = True
+                    except ValidationError:
+                        accepted = False
+                    self.assertEqual(accepted, expected is not None)
+                    state = expected or state
+
+                    product.refresh_from_db()
+                    self.assertEqual((product.current_highest_bid, product.leading_bidder_id), state[:2])
+
+            # History never goes down and its top bid is the one that closes
+            amounts = list(product.bids.order_by('timestamp', 'id').values_list('amount', flat=True))
+            self.assertEqual(amounts, sorted(amounts))
+            self.assertEqual(product.bid_count, len(amounts))
+            if amounts:
+                top = product.bids.order_by('-amount', 'timestamp', 'id').first()
+                self.assertEqual((top.amount, top.bidder_id), state[:2])
+
+    def test_bidding_war_is_resolved_in_one_pass(self):
+        alice, bob = self.bidders[:2]
+        product = self.auction()
+        BidService.set_max_bid(product, alice, Decimal('100.00'))
+        BidService.set_max_bid(product, bob, Decimal('60.00'))
+
+        product.refresh_from_db()
+        self.assertEqual(product.leading_bidder, alice)
+        self.assertEqual(product.current_highest_bid, Decimal('61.00'))
+        self.assertEqual(
+            list(product.bids.order_by('timestamp', 'id').values_list('bidder__username', 'amount')),
+            [('bidder0', Decimal('10.00')), ('bidder1', Decimal('60.00')), ('bidder0', Decimal('61.00'))],
+        )
+
+    def test_equal_maximums_go_to_the_earlier_bidder(self):
+        alice, bob = self.bidders[:2]
+        product = self.auction()
+        BidService.set_max_bid(product, alice, Decimal('50.00'))
+        BidService.set_max_bid(product, bob, Decimal('50.00'))
+
+        end = timezone.now() - timedelta(seconds=1)
+        Product.objects.filter(id=product.id).update(auction_end_time=end)
+        close_auction(product.id, end.timestamp())
+
+        txn = Transaction.objects.get(product=product)
+        self.assertEqual((txn.buyer, txn.amount), (alice, Decimal('50.00')))
+
+    def test_sniper_protection_extends_once_per_pass(self):
+        alice, bob = self.bidders[:2]
+        product = self.auction()
+        BidService.set_max_bid(product, alice, Decimal('100.00'))
+        end = timezone.now() + timedelta(seconds=10)
+        Product.objects.filter(id=product.id).update(auction_end_time=end)
+
+        # Records bob's bid and alice's proxy response
+        BidService.place_bid(product, bob, Decimal('40.00'))
+
+        product.refresh_from_db()
+        self.assertEqual(product.bid_count, 3)
+        self.assertEqual(product.auction_end_time, end + timedelta(minutes=1))
+
+
+class ProductSearchTests(TestCase):
+    def setUp(self):
+        self.seller = User.objects.create_user(username='seller', email='seller@example.com')
+        self.watches = Category.objects.create(name='Watches')
+        self.art = Category.objects.create(name='Art')
+        self.watch = make_auction(self.seller, self.watches, title='Vintage Omega Watch', description='Swiss made')
+        self.painting = make_auction(self.seller, self.art, title='Oil Painting', description='A vintage landscape')
+
+    def search(self, query):
+        return list(ProductSearch.filter(Product.objects.all(), query))
+
+    def test_matches_title_description_and_category(self):
+        self.assertEqual(self.search('omega'), [self.watch])
+        self.assertEqual(self.search('landscape'), [self.painting])
+        self.assertEqual(self.search('art'), [self.painting])
+
+    def test_title_matches_rank_first_and_prefixes_match(self):
+        self.assertEqual(self.search('vint'), [self.watch, self.painting])
+
+    def test_index_follows_updates_and_category_renames(self):
+        self.painting.title = 'Marble Sculpture'
+        self.painting.save()
+        self.art.name = 'Fine Art'
+        self.art.save()
+
+        self.assertEqual(self.search('sculpture'), [self.painting])
+        self.assertEqual(self.search('fine'), [self.painting])
+        self.assertEqual(self.search('oil'), [])
+
+    def test_bids_do_not_reindex_the_product(self):
+        # Plant a stale index entry, then see whether saves rewrite it
+        with connection.cursor() as cursor:
+            if connection.vendor == 'postgresql':
+                cursor.execute("UPDATE market_product SET search_vector = to_tsvector('stale') WHERE id = %s", [self.watch.id])
+            else:
+                cursor.execute("UPDATE market_product_fts SET title = 'stale' WHERE rowid = %s", [self.watch.id])
+        self.watch.auction_end_time = timezone.now() + timedelta(days=1)
+        self.watch.save()
+        BidService.place_bid(self.watch, User.objects.create_user(username='bidder', email='b@example.com'), Decimal('10.00'))
+
+        self.assertEqual(self.search('stale'), [self.watch])
+
+        self.watch.refresh_from_db()
+        self.watch.description = 'Swiss automatic'
+        self.watch.save()
+        self.assertEqual(self.search('stale'), [])
+        self.assertEqual(self.search('automatic'), [self.watch])
+
+    def test_punctuation_only_query_matches_nothing(self):
+        self.assertEqual(self.search('"*'), [])
+
+
+class CatalogPaginationTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.seller = User.objects.create_user(username='seller', email='seller@example.com')
+        category = Category.objects.create(name='Watches')
+        now = timezone.now()
+        self.products = []
+        for i in range(30):
+            product = make_auction(
+                self.seller, category,
+                title=f'Watch {i}',
+                initial_price=Decimal('10.00') + i % 7,
+                auction_end_time=now + timedelta(hours=i),
+            )
+            ProductImage.objects.create(product=product, image=f'products/{i}-b.jpg', order=1)
+            ProductImage.objects.create(product=product, image=f'products/{i}-a.jpg', order=0)
+            self.products.append(product)
+
+    def walk(self, sort):
+        seen = []
+        url = f"{reverse('catalog')}?sort={sort}"
+        while url:
+            response = self.client.get(url)
+            seen.extend(response.context['products'])
+            url = response.context['next_url'] and reverse('catalog') + response.context['next_url']
+        return seen
+
+    def test_pages_cover_every_product_in_order(self):
+        self.assertEqual(
+            [p.id for p in self.walk('price_asc')],
+            [p.id for p in sorted(self.products, key=lambda p: (p.initial_price, p.id))],
+        )
+        self.assertEqual(
+            [p.id for p in self.walk('urgent')],
+            [p.id for p in self.products],
+        )
+
+    def test_previous_page_returns_the_preceding_rows(self):
+        first = self.client.get(reverse('catalog') + '?sort=price_desc')
+        second = self.client.get(reverse('catalog') + first.context['next_url'])
+        back = self.client.get(reverse('catalog') + second.context['previous_url'])
+
+        self.assertEqual(list(back.context['products']), list(first.context['products']))
+        self.assertIsNone(back.context['previous_url'])
+
+    def test_query_budget_per_page(self):
+        # categories + page + first images + cached count
+        with self.assertNumQueries(4):
+            response = self.client.get(reverse('catalog'))
+        self.assertEqual(response.context['total_count'], 30)
+        self.assertContains(response, 'products/29-a.jpg')
+        self.assertNotContains(response, 'products/29-b.jpg')
+
+        with self.assertNumQueries(3):
+            self.client.get(reverse('catalog') + response.context['next_url'])
+
+
+class HomeCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.seller = User.objects.create_user(username='seller', email='seller@example.com')
+        self.category = Category.objects.create(name='Watches')
+        self.product = make_auction(self.seller, self.category, auction_end_time=timezone.now() + timedelta(hours=1))
+        ProductImage.objects.create(product=self.product, image='products/watch.jpg')
+
+    def test_warm_anonymous_render_issues_no_queries(self):
+        self.client.get(reverse('home'))
+
+        with self.assertNumQueries(0):
+            response = self.client.get(reverse('home'))
+        self.assertContains(response, 'products/watch.jpg')
+        self.assertContains(response, 'Watches')
+
+    def test_product_save_invalidates_sections(self):
+        self.client.get(reverse('home'))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.product.title = 'Renamed Listing'
+            self.product.save()
+
+        self.assertContains(self.client.get(reverse('home')), 'Renamed Listing')
+
+    def test_bids_leave_the_sections_to_their_ttl(self):
+        from .cache import GENERATION_KEY
+        buyer = User.objects.create_user(username='buyer', email='buyer@example.com')
+        self.client.get(reverse('home'))
+        generation = cache.get(GENERATION_KEY)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            BidService.place_bid(Product.objects.get(pk=self.product.pk), buyer, Decimal('10.00'))
+        self.assertEqual(cache.get(GENERATION_KEY), generation)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            product = Product.objects.get(pk=self.product.pk)
+            product.is_active = False
+            product.save()
+        self.assertEqual(cache.get(GENERATION_KEY), generation + 1)
+
+
+class ProductApiTests(TestCase):
+    def setUp(self):
+        self.seller = User.objects.create_user(username='seller', email='seller@example.com')
+        self.category = Category.objects.create(name='Watches')
+        self.bidders = [User.objects.create_user(username=f'bidder{i}', email=f'b{i}@example.com') for i in range(3)]
+        self.products = []
+        for i in range(25):
+            product = make_auction(self.seller, self.category, title=f'Watch {i}',
+                                   auction_end_time=timezone.now() + timedelta(hours=1))
+            ProductImage.objects.create(product=product, image=f'products/{i}-b.jpg', order=1)
+            ProductImage.objects.create(product=product, image=f'products/{i}-a.jpg', order=0)
+            for n, bidder in enumerate(self.bidders):
+                Bid.objects.create(product=product, bidder=bidder, amount=Decimal('11.00') + n)
+            self.products.append(product)
+
+    def test_list_is_slim_and_has_a_fixed_query_budget(self):
+        # count + page (seller and category joined) + first images
+        with self.assertNumQueries(3):
+            response = self.client.get('/api/products/')
+        data = response.json()
+        self.assertEqual(data['count'], 25)
+        self.assertEqual(len(data['results']), 20)
+        first = data['results'][0]
+        self.assertEqual(first['title'], 'Watch 24')
+        self.assertTrue(first['image'].endswith('products/24-a.jpg'))
+        self.assertEqual(first['seller'], {
+            'id': self.seller.id, 'username': 'seller', 'is_verified': False,
+            'rating_average': 0.0, 'rating_count': 0,
+        })
+        self.assertNotIn('bids', first)
+        self.assertNotIn('description', first)
+
+    def test_detail_and_paginated_bid_history(self):
+        product = self.products[0]
+        with self.assertNumQueries(2):
+            detail = self.client.get(f'/api/products/{product.id}/').json()
+        self.assertEqual(len(detail['images']), 2)
+        self.assertNotIn('bids', detail)
+
+        bids = self.client.get(f'/api/products/{product.id}/bids/').json()
+        self.assertEqual([bid['amount'] for bid in bids['results']], ['13.00', '12.00', '11.00'])
+        self.assertEqual(bids['results'][0]['bidder_name'], 'bidder2')
+
+
+class BidAmountTests(TestCase):
+    def setUp(self):
+        self.seller = User.objects.create_user(username='seller', email='seller@example.com')
+        self.bidder = User.objects.create_user(username='bidder', email='bidder@example.com')
+        self.product = make_auction(self.seller, Category.objects.create(name='Watches'),
+                                    auction_end_time=timezone.now() + timedelta(days=1))
+        self.client.force_login(self.bidder)
+
+    def bid(self, amount):
+        return self.client.post(f'/api/products/{self.product.id}/bid/', {'amount': amount})
+
+    def test_amounts_are_kept_to_the_cent(self):
+        self.assertEqual(self.bid('10.10').status_code, 200)
+        self.bid('11.20')
+
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.current_highest_bid, Decimal('11.20'))
+        self.assertEqual(list(self.product.bids.values_list('amount', flat=True).order_by('amount')),
+                         [Decimal('10.10'), Decimal('11.20')])
+
+    def test_malformed_amounts_are_rejected(self):
+        for amount in ['1e3', '12.345', '-15', 'nan', '0']:
+            with self.subTest(amount=amount):
+                self.assertEqual(self.bid(amount).status_code, 400)
+        self.assertFalse(self.product.bids.exists())
+
+    def test_json_numbers_are_accepted_to_the_cent(self):
+        def bid(amount):
+            return self.client.post(f'/api/products/{self.product.id}/bid/', {'amount': amount}, content_type='application/json')
+
+        self.assertEqual(bid(10.5).status_code, 200)
+        self.assertEqual(bid(12).status_code, 200)
+        for amount in [12.345, 13.000000000000002, 1e20, -14.0]:
+            with self.subTest(amount=amount):
+                self.assertEqual(bid(amount).status_code, 400)
+        self.assertEqual(list(self.product.bids.values_list('amount', flat=True).order_by('amount')),
+                         [Decimal('10.50'), Decimal('12.00')])
+
+
+@override_settings(IMAGE_PIPELINE_WORKERS=2)
+class ImagePipelineTests(TestCase):
+    def setUp(self):
+        self.media = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media)
+        override = override_settings(MEDIA_ROOT=self.media)
+        override.enable()
+        self.addCleanup(override.disable)
+
+        from PIL import Image
+        buffer = BytesIO()
+        Image.new('RGB', (2000, 1000), (200, 40, 40)).save(buffer, 'PNG')
+        product = make_auction(User.objects.create_user(username='seller', email='seller@example.com'),
+                               Category.objects.create(name='Watches'))
+        with self.captureOnCommitCallbacks() as callbacks:
+            self.images = [
+                ProductImage.objects.create(product=product, image=SimpleUploadedFile(f'watch{i}.png', buffer.getvalue()), order=i)
+                for i in range(2)
+            ]
+        self.queued = len(callbacks)
+
+    def test_variants_are_rendered_once(self):
+        self.assertEqual(self.queued, 2)
+        self.assertEqual(ImagePipeline.process([image.id for image in self.images]), 2)
+        self.assertEqual(ImagePipeline.process([image.id for image in self.images]), 0)
+
+        image = ProductImage.objects.get(pk=self.images[0].pk)
+        self.assertEqual((image.width, image.height), (2000, 1000))
+        self.assertEqual([(image.variants[name]['width'], image.variants[name]['height']) for name in ('card', 'detail')],
+                         [(480, 240), (1600, 800)])
+        with image.image.storage.open(image.variants['card']['webp']) as f:
+            self.assertEqual(f.read(12)[8:], b'WEBP')
+
+        html = Template("{% load custom_filters %}{% product_image image alt='Watch' %}").render(Context({'image': image}))
+        self.assertIn('type="image/webp"', html)
+        self.assertIn(f"{image.variants['detail']['jpeg']} 1600w", html)
+        self.assertIn('width="480" height="240"', html)
+
+    def test_media_is_served_with_far_future_caching(self):
+        ImagePipeline.process([self.images[0].id])
+        url = '/media/' + ProductImage.objects.get(pk=self.images[0].pk).variants['card']['jpeg']
+
+        response = self.client.get(url)
+        self.assertEqual(response['Content-Type'], 'image/jpeg')
+        self.assertIn('immutable', response['Cache-Control'])
+        self.assertIn('max-age=31536000', response['Cache-Control'])
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag']).status_code, 304)
+        self.assertEqual(self.client.get('/media/products/missing.jpg').status_code, 404)
+
+    def test_invoices_are_not_public_media(self):
+        from django.core.files.storage import default_storage
+        default_storage.save('invoices/invoice_1.pdf', SimpleUploadedFile('x', b'%PDF'))
+
+        self.assertEqual(self.client.get('/media/invoices/invoice_1.pdf').status_code, 404)
+        self.assertEqual(self.client.get('/media/products/../invoices/invoice_1.pdf').status_code, 404)
+
+
+class ListingImportTests(TestCase):
+    def setUp(self):
+        self.seller = User.objects.create_user(username='seller', email='seller@example.com')
+        self.category = Category.objects.create(name='Watches')
+        self.end = (timezone.now() + timedelta(minutes=20)).isoformat()
+        self.dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.dir)
+
+    def test_command_imports_csv_in_batches_and_writes_rejects(self):
+        path = f'{self.dir}/listings.csv'
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write('category,title,description,condition,location,sales_type,initial_price,buy_now_price,auction_end_time\n')
+            for i in range(5):
+                f.write(f'watches,Watch {i},"Steel,\nautomatic",used,Lima,AUCTION,10.50,,{self.end}\n')
+            f.write('watches,Clock,Wall clock,NEW,Lima,DIRECT,12.00,12.00,\n')
+            f.write('shoes,Boots,Leather,NEW,Lima,DIRECT,1.999,,\n')
+            f.write('watches,Late,Expired,NEW,Lima,AUCTION,5,,2001-01-01T00:00:00Z\n')
+
+        from django.core.management import call_command
+        out = StringIO()
+        with self.captureOnCommitCallbacks() as callbacks:
+            call_command('import_listings', path, seller='seller', batch_size=2, stdout=out)
+
+        self.assertIn('Imported 6 of 8 rows', out.getvalue())
+        products = Product.objects.filter(seller=self.seller).order_by('id')
+        self.assertEqual([p.title for p in products], [f'Watch {i}' for i in range(5)] + ['Clock'])
+        self.assertEqual(products[0].description, 'Steel,\nautomatic')
+        self.assertEqual(products[0].initial_price, Decimal('10.50'))
+        self.assertEqual(products[0].condition, 'USED')
+        self.assertIsNone(products[0].buy_now_price)
+        # Three batches, each bumping the home cache and scheduling its auctions
+        self.assertEqual(len(callbacks), 6)
+
+        with open(f'{path}.rejects.jsonl', encoding='utf-8') as f:
+            rejects = [json.loads(line) for line in f]
+        self.assertEqual([reject['line'] for reject in rejects], [13, 14])
+        self.assertEqual(rejects[0]['errors'], {'category': 'Unknown category.', 'initial_price': 'Invalid amount.'})
+        self.assertEqual(rejects[1]['errors'], {'auction_end_time': 'Must be in the future.'})
+
+    def test_api_streams_jsonl_body(self):
+        lines = [
+            {'category': 'watches', 'title': 'Diver', 'description': 'Steel', 'condition': 'NEW',
+             'location': 'Lima', 'sales_type': 'HYBRID', 'initial_price': 25.5, 'buy_now_price': '80',
+             'auction_end_time': self.end},
+            {'category': 'watches', 'title': 'x' * 300, 'description': 'Steel', 'condition': 'NEW',
+             'location': 'Lima', 'initial_price': 5},
+        ]
+        body = '\n'.join(json.dumps(line) for line in lines) + '\n{not json\n'
+        self.client.force_login(self.seller)
+
+        response = self.client.post('/api/products/import/', body, content_type='application/x-ndjson')
+
+        self.assertEqual(response.status_code, 201)
+        data = response.json()
+        self.assertEqual((data['rows'], data['created'], data['rejected']), (3, 1, 2))
+        self.assertEqual(data['rejects'], [
+            {'line': 2, 'errors': {'title': 'At most 255 characters.'}},
+            {'line': 3, 'errors': {'row': 'Not a JSON object.'}},
+        ])
+        product = Product.objects.get(title='Diver')
+        self.assertEqual((product.seller, product.initial_price, product.buy_now_price),
+                         (self.seller, Decimal('25.50'), Decimal('80.00')))
+        self.assertEqual(self.client.post('/api/products/import/', '{}', content_type='application/json').status_code, 415)
+
+    def test_api_refuses_bodies_over_the_limits(self):
+        line = json.dumps({'category': 'watches', 'title': 'Diver', 'description': 'Steel', 'condition': 'NEW',
+                           'location': 'Lima', 'initial_price': 5}) + '\n'
+        self.client.force_login(self.seller)
+
+        with self.settings(LISTING_IMPORT_API_MAX_BYTES=len(line) * 2):
+            response = self.client.post('/api/products/import/', line * 3, content_type='application/x-ndjson')
+        self.assertEqual(response.status_code, 413)
+        self.assertFalse(Product.objects.exists())
+
+        with self.settings(LISTING_IMPORT_API_MAX_ROWS=2):
+            response = self.client.post('/api/products/import/', line * 3, content_type='application/x-ndjson')
+        self.assertEqual(response.status_code, 413)
+        data = response.json()
+        self.assertEqual((data['rows'], data['created'], data['truncated']), (2, 2, True))
+        self.assertEqual(Product.objects.count(), 2)
+
+        with self.settings(LISTING_IMPORT_API_MAX_ROWS=3):
+            response = self.client.post('/api/products/import/', line * 3, content_type='application/x-ndjson')
+        self.assertEqual(response.status_code, 201)
+        self.assertFalse(response.json()['truncated'])
+
+
+class QueryInstrumentationTests(TestCase):
+    def setUp(self):
+        # The header counts of signed-in users are cached per user id
+        self.addCleanup(cache.clear)
+        self.seller = User.objects.create_user(username='seller', email='seller@example.com')
+        category = Category.objects.create(name='Watches')
+        buyers = [User.objects.create_user(username=f'buyer{i}', email=f'buyer{i}@example.com') for i in range(3)]
+        for i in range(6):
+            product = make_auction(self.seller, category, title=f'Watch {i}',
+                                   auction_end_time=timezone.now() + timedelta(hours=1))
+            ProductImage.objects.create(product=product, image=f'products/{i}.jpg')
+            Bid.objects.create(product=product, bidder=buyers[i % 3], amount=Decimal('12.00'))
+            if i < 3:
+                txn = Transaction.objects.create(buyer=buyers[i], seller=self.seller, product=product,
+                                                 amount=Decimal('12.00'), status='PAID')
+                Review.objects.create(author=buyers[i], target_user=self.seller, transaction=txn, rating=5, comment='Great')
+
+    def test_profile_has_no_per_listing_queries(self):
+        self.client.force_login(self.seller)
+        # Only the profile user repeats, loaded again as the request user
+        with assert_queries(max_repeats=2):
+            response = self.client.get(f'/profile/{self.seller.id}/')
+        self.assertContains(response, 'Watch 5')
+        self.assertContains(response, 'REVIEWS (3)')
+
+    def test_assert_queries_points_at_the_lazy_relation(self):
+        with self.assertRaises(AssertionError) as raised:
+            with assert_queries():
+                [str(bid) for bid in Bid.objects.all()]
+        self.assertIn('6x from market/models.py', str(raised.exception))
+
+        with assert_queries(max_queries=1):
+            [str(bid) for bid in Bid.objects.select_related('product', 'bidder')]
+
+    @override_settings(QUERY_INSTRUMENTATION_ENABLED=True, QUERY_INSTRUMENTATION_SAMPLE_RATE=1.0,
+                       QUERY_INSTRUMENTATION_DUPLICATE_THRESHOLD=2)
+    def test_middleware_reports_server_timing_and_logs(self):
+        self.client.force_login(self.seller)
+        with self.assertLogs('nexus_core.queries', 'INFO') as logs:
+            response = self.client.get(f'/profile/{self.seller.id}/')
+
+        # Only the timings reach a regular user, the origin stays in the log
+        self.assertRegex(response['Server-Timing'], r'^db;dur=[\d.]+, app;dur=[\d.]+$')
+        record = json.loads(logs.records[0].getMessage())
+        self.assertEqual(logs.records[0].levelname, 'WARNING')
+        self.assertEqual((record['path'], record['view'], record['status']), (f'/profile/{self.seller.id}/', 'user_profile', 200))
+        self.assertTrue(record['n_plus_one'])
+        self.assertTrue(record['duplicates'][0]['template'] or record['duplicates'][0]['code'])
+
+        User.objects.filter(pk=self.seller.pk).update(is_staff=True)
+        with self.assertLogs('nexus_core.queries', 'INFO'):
+            response = self.client.get(f'/profile/{self.seller.id}/')
+        self.assertRegex(response['Server-Timing'], r'^db;dur=[\d.]+;desc="\d+ queries", db-repeat;desc="2x .*", app;dur=')
+        self.assertEqual(record['duplicates'][0]['count'], 2)
+
+        with override_settings(QUERY_INSTRUMENTATION_SAMPLE_RATE=0.0):
+            self.client = self.client_class()
+            self.assertNotIn('Server-Timing', self.client.get('/catalog/'))
+
+
+def sample(name, **labels):
+    return REGISTRY.get_sample_value(name, labels) or 0
+
+
+class MetricsTests(TestCase):
+    def setUp(self):
+        self.seller = User.objects.create_user(username='seller', email='seller@example.com')
+        self.buyer = User.objects.create_user(username='buyer', email='buyer@example.com')
+        self.category = Category.objects.create(name='Watches')
+
+    def test_bids_are_counted_by_outcome(self):
+        product = make_auction(self.seller, self.category, auction_end_time=timezone.now() + timedelta(days=1))
+        accepted = sample('nexus_bids_total', kind='bid', outcome='accepted')
+        rejected = sample('nexus_bids_total', kind='bid', outcome='rejected')
+        lock_waits = sample('nexus_bid_lock_wait_seconds_count')
+
+        BidService.place_bid(product, self.buyer, Decimal('10.00'))
+        with self.assertRaises(ValidationError):
+            BidService.place_bid(product, self.seller, Decimal('20.00'))
+
+        self.assertEqual(sample('nexus_bids_total', kind='bid', outcome='accepted'), accepted + 1)
+        self.assertEqual(sample('nexus_bids_total', kind='bid', outcome='rejected'), rejected + 1)
+        self.assertEqual(sample('nexus_bid_lock_wait_seconds_count'), lock_waits + 2)
+
+    def test_closes_record_trigger_result_and_lag(self):
+        sold = make_auction(self.seller, self.category, auction_end_time=timezone.now() - timedelta(seconds=30))
+        Bid.objects.create(product=sold, bidder=self.buyer, amount=Decimal('15.00'))
+        make_auction(self.seller, self.category)
+        closed = sample('nexus_auctions_closed_total', trigger='scheduled', result='sold')
+        unsold = sample('nexus_auctions_closed_total', trigger='sweep', result='unsold')
+        lag = sample('nexus_auction_close_lag_seconds_sum', trigger='scheduled')
+
+        close_auction(sold.id, sold.auction_end_time.timestamp())
+        close_expired_auctions()
+
+        self.assertEqual(sample('nexus_auctions_closed_total', trigger='scheduled', result='sold'), closed + 1)
+        self.assertEqual(sample('nexus_auctions_closed_total', trigger='sweep', result='unsold'), unsold + 1)
+        self.assertGreaterEqual(sample('nexus_auction_close_lag_seconds_sum', trigger='scheduled') - lag, 30)
+
+    def test_metrics_endpoint_requires_the_token_or_staff(self):
+        # No token configured denies everyone but staff
+        with override_settings(METRICS_TOKEN=''):
+            self.assertEqual(self.client.get('/metrics/').status_code, 403)
+            self.assertEqual(self.client.get('/metrics/', HTTP_AUTHORIZATION='Bearer ').status_code, 403)
+
+        with override_settings(METRICS_TOKEN='s3cret'):
+            self.assertEqual(self.client.get('/metrics/').status_code, 403)
+            self.assertEqual(self.client.get('/metrics/', HTTP_AUTHORIZATION='Bearer wrong').status_code, 403)
+            response = self.client.get('/metrics/', HTTP_AUTHORIZATION='Bearer s3cret')
+            self.assertEqual(response.status_code, 200)
+            self.assertIn(b'# TYPE nexus_bids_total counter', response.content)
+
+            self.client.force_login(self.seller)
+            self.assertEqual(self.client.get('/metrics/').status_code, 403)
+            User.objects.filter(pk=self.seller.pk).update(is_staff=True)
+            self.assertEqual(self.client.get('/metrics/').status_code, 200)
@@ -1,23 +1,34 @@
 from rest_framework import viewsets, permissions, filters, status
 from rest_framework.decorators import action
 from rest_framework.response import Response
+from rest_framework.views import APIView
 from django_filters.rest_framework import DjangoFilterBackend
-from .models import Category, Product
-from .serializers import CategorySerializer, ProductSerializer, BidSerializer
+from .models import Category, Product, prefetch_first_image
+from .serializers import CategorySerializer, ProductListSerializer, ProductSerializer, BidSerializer
+from .pagination import ProductPagination, BidHistoryPagination
 from .services import BidService
+from .search import ProductSearchFilter
+from .ingest import PENDING, get_bid_ingest, ticket_payload
+from .importer import ListingImporter, guess_format, read_rows
+from django.conf import settings
 from django.core.exceptions import ValidationError
+from django.urls import reverse
+from nexus_core.money import Money
+
+# Rejected rows listed in an import response, the counts cover all of them
+IMPORT_REJECTS_SHOWN = 100
 
 class CategoryViewSet(viewsets.ReadOnlyModelViewSet):
     queryset = Category.objects.all()
     serializer_class = CategorySerializer
 
 class ProductViewSet(viewsets.ModelViewSet):
-    queryset = Product.objects.filter(is_active=True).order_by('-created_at')
+    queryset = Product.objects.filter(is_active=True).select_related('seller', 'category').order_by('-created_at')
     serializer_class = ProductSerializer
+    pagination_class = ProductPagination
     permission_classes = [permissions.IsAuthenticatedOrReadOnly]
-    filter_backends = [DjangoFilterBackend, filters.SearchFilter, filters.OrderingFilter]
+    filter_backends = [DjangoFilterBackend, ProductSearchFilter, filters.OrderingFilter]
     filterset_fields = ['category', 'condition', 'sales_type', 'location']
-    search_fields = ['title', 'description']
     ordering_fields = ['created_at', 'current_highest_bid', 'auction_end_time']
 
     def get_queryset(self):
@@ -26,8 +37,24 @@ class ProductViewSet(viewsets.ModelViewSet):
         ending_soon = self.request.query_params.get('ending_soon')
         if ending_soon:
             queryset = queryset.order_by('auction_end_time')
+        # Prefetch exactly what the serializer for this action renders
+        if self.action == 'list':
+            return queryset.prefetch_related(prefetch_first_image())
+        if self.action == 'retrieve':
+            return queryset.prefetch_related('images')
         return queryset
 
+    def get_serializer_class(self):
+        if self.action == 'list':
+            return ProductListSerializer
+        return super().get_serializer_class()
+
+    @action(detail=True, methods=['get'], pagination_class=BidHistoryPagination, filter_backends=[])
+    def bids(self, request, pk=None):
+        product = self.get_object()
+        page = self.paginate_queryset(product.bids.select_related('bidder'))
+        return self.get_paginated_response(BidSerializer(page, many=True).data)
+
     @action(detail=True, methods=['post'], permission_classes=[permissions.IsAuthenticated])
     def bid(self, request, pk=None):
         product = self.get_object()
@@ -35,9 +62,12 @@ class ProductViewSet(viewsets.ModelViewSet):
         
         if not amount:
             return Response({'error': 'Amount is required'}, status=status.HTTP_400_BAD_REQUEST)
+
+        if settings.BID_INGEST_ENABLED:
+            return self._queue_bid(request, product, amount)
         
         try:
-            amount = float(amount)
+            amount = Money.parse(amount)
             updated_product = BidService.place_bid(product, request.user, amount)
             return Response(ProductSerializer(updated_product).data)
         except ValidationError as e:
@@ -45,8 +75,96 @@ class ProductViewSet(viewsets.ModelViewSet):
         except Exception as e:
             return Response({'error': 'An error occurred'}, status=status.HTTP_400_BAD_REQUEST)
 
+    @action(detail=True, methods=['post'], permission_classes=[permissions.IsAuthenticated])
+    def max_bid(self, request, pk=None):
+        """
+        Stores a maximum; the proxy engine bids for the user up to it.
+        """
+        product = self.get_object()
+        amount = request.data.get('max_amount')
+
+        if not amount:
+            return Response({'error': 'max_amount is required'}, status=status.HTTP_400_BAD_REQUEST)
+
+        if settings.BID_INGEST_ENABLED:
+            return self._queue_bid(request, product, amount, max_bid=True)
+
+        try:
+            updated_product = BidService.set_max_bid(product, request.user, Money.parse(amount))
+            return Response(ProductSerializer(updated_product).data)
+        except ValidationError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+    def _queue_bid(self, request, product, amount, max_bid=False):
+        # Accepted into the product's ingest queue, applied by consume_bids
+        try:
+            amount = Money.parse(amount)
+        except ValidationError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        ticket = get_bid_ingest().submit(product, request.user, amount, max_bid=max_bid)
+        return Response(
+            {'ticket': ticket, 'status': PENDING, 'status_url': reverse('bid_ticket', args=[ticket])},
+            status=status.HTTP_202_ACCEPTED,
+        )
+
+    @action(detail=False, methods=['post'], url_path='import', permission_classes=[permissions.IsAuthenticated])
+    def import_listings(self, request):
+        """
+        Creates the user's listings from a CSV (text/csv) or JSON Lines
+        (application/x-ndjson) request body, streamed rather than parsed up
+        front. See market/importer.py for the columns.
+
+        Bodies over LISTING_IMPORT_API_MAX_BYTES are refused with 413 before
+        anything is read. Past LISTING_IMPORT_API_MAX_ROWS rows the import
+        stops and answers 413 with the report of the rows imported so far.
+        """
+        fmt = guess_format(request.content_type)
+        if fmt is None:
+            return Response({'error': 'Send text/csv or application/x-ndjson'},
+                            status=status.HTTP_415_UNSUPPORTED_MEDIA_TYPE)
+        try:
+            length = int(request.META.get('CONTENT_LENGTH') or 0)
+        except ValueError:
+            length = 0
+        if length > settings.LISTING_IMPORT_API_MAX_BYTES:
+            return Response(
+                {'error': f"The body is over {settings.LISTING_IMPORT_API_MAX_BYTES} bytes, "
+                          "split the file or use manage.py import_listings"},
+                status=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            )
+        if request.stream is None:
+            return Response({'error': 'The request body is empty'}, status=status.HTTP_400_BAD_REQUEST)
+
+        rejects = []
+
+        def on_reject(line, errors, row):
+            if len(rejects) < IMPORT_REJECTS_SHOWN:
+                rejects.append({'line': line, 'errors': errors})
+
+        report = ListingImporter(request.user, on_reject=on_reject).run(
+            read_rows(request.stream, fmt), max_rows=settings.LISTING_IMPORT_API_MAX_ROWS)
+        report['rejects'] = rejects
+        if report['truncated']:
+            report['error'] = (f"Only the first {settings.LISTING_IMPORT_API_MAX_ROWS} rows were imported, "
+                               "send the rest in another request")
+            return Response(report, status=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE)
+        return Response(report, status=status.HTTP_201_CREATED if report['created'] else status.HTTP_200_OK)
+
     @action(detail=True, methods=['post'], permission_classes=[permissions.IsAuthenticated])
     def buy_now(self, request, pk=None):
         # Implementation for Buy Now would go here
         # Similar to bid, validation then Transaction creation
         return Response({'status': 'Buy Now feature in progress'})
+
+class BidTicketView(APIView):
+    """
+    Result of a queued bid: PENDING until consume_bids has applied it, then
+    ACCEPTED or REJECTED with the reason.
+    """
+    permission_classes = [permissions.IsAuthenticated]
+
+    def get(self, request, ticket):
+        state = get_bid_ingest().ticket(ticket)
+        if state is None or int(state['bidder']) != request.user.id:
+            return Response({'error': 'Unknown ticket'}, status=status.HTTP_404_NOT_FOUND)
+        return Response(ticket_payload(ticket, state))
@@ -2,6 +2,9 @@
 ASGI config for nexus_core project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
+Requests to ``/stream/products/<id>/`` are answered by the live auction event
+stream (market/streams.py) without going through Django; everything else is
+handed to Django.
 
 For more information on this file, see
 https://docs.djangoproject.com/en/5.2/howto/deployment/asgi/
@@ -13,4 +16,15 @@ from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'nexus_core.settings')
 
-application = get_asgi_application()
+django_application = get_asgi_application()
+
+from django.conf import settings  # noqa: E402
+from market.streams import STREAM_PATH, product_event_stream  # noqa: E402
+
+
+async def application(scope, receive, send):
+    if settings.BID_STREAM_ENABLED and scope['type'] == 'http':
+        match = STREAM_PATH.match(scope['path'])
+        if match:
+            return await product_event_stream(scope, receive, send, int(match['product_id']))
+    return await django_application(scope, receive, send)
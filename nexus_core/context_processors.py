@@ -1,11 +1,35 @@
-from transactions.models import Notification
+import operator
+
+from django.utils.functional import SimpleLazyObject, new_method_proxy
+
+from users import cache as user_cache
+
+
+class LazyValue(SimpleLazyObject):
+    """
+    SimpleLazyObject that also supports the comparisons and numeric
+    conversions templates apply to counts and balances.
+    """
+    __ge__ = new_method_proxy(operator.ge)
+    __le__ = new_method_proxy(operator.le)
+    __int__ = new_method_proxy(int)
+    __float__ = new_method_proxy(float)
+
 
 def global_context(request):
-    context = {}
-    if request.user.is_authenticated:
-        context['unread_notifications_count'] = Notification.objects.filter(user=request.user, read=False).count()
-        if hasattr(request.user, 'wallet'):
-             context['wallet_balance'] = request.user.wallet.balance
-        else:
-             context['wallet_balance'] = 0.00
-    return context
+    # Evaluated only if a template actually renders the value, and then
+    # served from the per-user cache
+    def unread_notifications_count():
+        if not request.user.is_authenticated:
+            return 0
+        return user_cache.unread_notifications_count(request.user.pk)
+
+    def wallet_balance():
+        if not request.user.is_authenticated:
+            return 0
+        return user_cache.wallet_balance(request.user.pk)
+
+    return {
+        'unread_notifications_count': LazyValue(unread_notifications_count),
+        'wallet_balance': LazyValue(wallet_balance),
+    }
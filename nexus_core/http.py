@@ -0,0 +1,136 @@
+"""
+Serving stored files.
+
+``serve_file`` streams a file from storage with the validators browsers,
+CDNs and download managers rely on: a strong ETag answered with 304 on a
+matching If-None-Match (before the file is opened), and single byte
+ranges (``Range: bytes=...``, honoured only while If-Range still matches)
+answered with 206 Partial Content. With MEDIA_ACCEL_REDIRECT_PREFIX set
+the body is left to the front web server (nginx X-Accel-Redirect), which
+then also handles ranges, and no Python worker streams the bytes.
+
+``serve_media`` replaces ``django.views.static.serve`` for MEDIA_URL.
+"""
+import mimetypes
+import os
+import stat
+from urllib.parse import quote
+
+from django.conf import settings
+from django.core.exceptions import SuspiciousFileOperation
+from django.core.files.storage import default_storage
+from django.http import FileResponse, Http404, HttpResponse, StreamingHttpResponse
+from django.utils._os import safe_join
+from django.utils.cache import patch_cache_control
+from django.utils.http import parse_etags, quote_etag
+
+CHUNK_SIZE = 64 * 1024
+
+# Media served only through their own views (invoices need the buyer or seller)
+PRIVATE_MEDIA = ('invoices/',)
+
+
+def byte_range(header, size):
+    """
+    ``(start, end)`` (inclusive) for a single ``bytes=`` range, None when
+    the header should be ignored, or False when it cannot be satisfied.
+    """
+    unit, _, spec = header.partition('=')
+    if unit.strip() != 'bytes' or ',' in spec:
+        # Multipart ranges are not supported, the full file is sent instead
+        return None
+    first, dash, last = spec.strip().partition('-')
+    if not dash:
+        return None
+    try:
+        if not first:
+            # Suffix range: the last N bytes
+            length = int(last)
+            if length <= 0:
+                return False
+            return max(size - length, 0), size - 1
+        start = int(first)
+        end = min(int(last), size - 1) if last else size - 1
+    except ValueError:
+        return None
+    if start < 0 or start >= size or start > end:
+        return False
+    return start, end
+
+
+def _read(file, start, length):
+    file.seek(start)
+    try:
+        while length > 0:
+            chunk = file.read(min(CHUNK_SIZE, length))
+            if not chunk:
+                break
+            length -= len(chunk)
+            yield chunk
+    finally:
+        file.close()
+
+
+def serve_file(request, storage, name, etag, content_type, filename=None, size=None, **cache_control):
+    """
+    Response for the file ``name`` in ``storage`` with ``etag`` as its
+    validator. ``cache_control`` is passed to patch_cache_control.
+    """
+    etag = quote_etag(etag)
+    if etag in parse_etags(request.headers.get('If-None-Match', '')):
+        response = HttpResponse(status=304)
+    elif settings.MEDIA_ACCEL_REDIRECT_PREFIX:
+        response = HttpResponse(content_type=content_type)
+        response['X-Accel-Redirect'] = settings.MEDIA_ACCEL_REDIRECT_PREFIX + quote(name)
+    else:
+        size = storage.size(name) if size is None else size
+        requested = request.headers.get('Range') if request.method == 'GET' else None
+        if_range = request.headers.get('If-Range')
+        span = byte_range(requested, size) if requested and if_range in (None, etag) else None
+
+        if span is False:
+            response = HttpResponse(status=416)
+            response['Content-Range'] = f'bytes */{size}'
+        elif span:
+            start, end = span
+            response = StreamingHttpResponse(_read(storage.open(name, 'rb'), start, end - start + 1),
+                                             status=206, content_type=content_type)
+            response['Content-Range'] = f'bytes {start}-{end}/{size}'
+            response['Content-Length'] = str(end - start + 1)
+        else:
+            # FileResponse hands real files to wsgi.file_wrapper (sendfile)
+            response = FileResponse(storage.open(name, 'rb'), content_type=content_type)
+            response['Content-Length'] = str(size)
+
+    if filename and response.status_code != 416:
+        response['Content-Disposition'] = f'attachment; filename="{filename}"'
+    response['ETag'] = etag
+    response['Accept-Ranges'] = 'bytes'
+    if cache_control:
+        patch_cache_control(response, **cache_control)
+    return response
+
+
+def serve_media(request, path):
+    """
+    Serves MEDIA_ROOT with far-future caching. Uploaded files are never
+    overwritten, so a URL always names the same bytes.
+    """
+    try:
+        full_path = safe_join(settings.MEDIA_ROOT, path)
+        info = os.stat(full_path)
+    except (OSError, SuspiciousFileOperation):
+        raise Http404
+    # Checked on the resolved path, "products/../invoices/..." is private too
+    path = os.path.relpath(full_path, settings.MEDIA_ROOT).replace(os.sep, '/')
+    if path.startswith(PRIVATE_MEDIA) or not stat.S_ISREG(info.st_mode):
+        raise Http404
+
+    content_type, _ = mimetypes.guess_type(path)
+    return serve_file(
+        request, default_storage, path,
+        etag=f'{info.st_mtime_ns:x}-{info.st_size:x}',
+        content_type=content_type or 'application/octet-stream',
+        size=info.st_size,
+        public=True, max_age=settings.MEDIA_CACHE_MAX_AGE, immutable=True,
+    )
@@ -0,0 +1,112 @@
+"""
+Prometheus metrics for the hot paths.
+
+Bids (outcome, duration and how long ``place_bid`` waited for the product
+row lock), auction closes (lag between ``auction_end_time`` and the close),
+checkouts and payment gateway calls, email delivery and every Celery task
+are counted here and served as Prometheus text on ``/metrics``.
+
+gunicorn runs several worker processes, and each would only report its own
+counts. With ``PROMETHEUS_MULTIPROC_DIR`` set (start.sh does) every process
+writes its samples to memory-mapped files in that directory and ``/metrics``
+merges them, whichever worker answers. The directory has to be emptied
+before the server starts. A Celery worker that does not share the web
+container's directory can serve its own endpoint on METRICS_WORKER_PORT.
+
+Recording a sample is a dictionary lookup and a lock-protected add (an
+mmap write in multiprocess mode), a few microseconds per call; see
+benchmarks/metrics.py.
+"""
+import hmac
+import logging
+import os
+import time
+
+from celery.signals import task_postrun, task_prerun, worker_ready
+from django.conf import settings
+from django.http import HttpResponse, HttpResponseForbidden
+from prometheus_client import CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Histogram, generate_latest
+from prometheus_client import multiprocess, start_http_server
+
+logger = logging.getLogger(__name__)
+
+# Seconds; row lock waits and bids are milliseconds, closes lag by seconds
+# to minutes, tasks and SMTP round trips anywhere in between
+FAST_BUCKETS = (.0005, .001, .0025, .005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5)
+LAG_BUCKETS = (.1, .5, 1, 2, 5, 10, 30, 60, 120, 300, 900, 3600)
+SLOW_BUCKETS = (.01, .05, .1, .25, .5, 1, 2.5, 5, 10, 30, 60, 300)
+
+BIDS = Counter('nexus_bids', 'Bids submitted, by kind (bid, max_bid) and outcome (accepted, rejected).',
+               ['kind', 'outcome'])
+BID_DURATION = Histogram('nexus_bid_duration_seconds', 'BidService time per bid, by path (locked, book).',
+                         ['path'], buckets=FAST_BUCKETS)
+BID_LOCK_WAIT = Histogram('nexus_bid_lock_wait_seconds', 'Time place_bid waited for the product row lock.',
+                          buckets=FAST_BUCKETS)
+
+AUCTIONS_CLOSED = Counter('nexus_auctions_closed', 'Auctions closed, by trigger (scheduled, sweep) and result (sold, unsold).',
+                          ['trigger', 'result'])
+AUCTION_CLOSE_LAG = Histogram('nexus_auction_close_lag_seconds', 'Time from auction_end_time to the close, by trigger.',
+                              ['trigger'], buckets=LAG_BUCKETS)
+
+CHECKOUTS = Counter('nexus_checkouts', 'Wallet checkouts, by outcome.', ['outcome'])
+PAYMENTS = Counter('nexus_payments', 'Payment gateway calls, by provider, step and outcome.',
+                   ['provider', 'step', 'outcome'])
+
+EMAIL_SEND = Histogram('nexus_email_send_seconds', 'Time to hand emails to the mail server, by source and outcome.',
+                       ['source', 'outcome'], buckets=SLOW_BUCKETS)
+EMAILS = Counter('nexus_emails', 'Emails handed to the mail server, by source.', ['source'])
+
+TASK_DURATION = Histogram('nexus_celery_task_seconds', 'Celery task run time, by task and final state.',
+                          ['task', 'state'], buckets=SLOW_BUCKETS)
+
+
+def render():
+    """
+    The metrics of every process (multiprocess mode) or of this one.
+    """
+    if os.environ.get('PROMETHEUS_MULTIPROC_DIR'):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return generate_latest(registry)
+    return generate_latest(REGISTRY)
+
+
+def metrics_view(request):
+    """
+    Prometheus scrape endpoint. The scraper must send METRICS_TOKEN as a
+    bearer token; logged-in staff may read it too. With no token configured
+    nobody else can.
+    """
+    supplied = request.headers.get('Authorization', '').removeprefix('Bearer ')
+    authorized = bool(settings.METRICS_TOKEN) and hmac.compare_digest(supplied.encode(), settings.METRICS_TOKEN.encode())
+    if not authorized and not request.user.is_staff:
+        return HttpResponseForbidden()
+    return HttpResponse(render(), content_type=CONTENT_TYPE_LATEST)
+
+
+# Celery tasks, for the workers and for beat-triggered work alike
+_task_started = {}
+
+
+@task_prerun.connect
+def _start_task_timer(task_id=None, **kwargs):
+    _task_started[task_id] = time.perf_counter()
+
+
+@task_postrun.connect
+def _observe_task(task_id=None, task=None, state=None, **kwargs):
+    started = _task_started.pop(task_id, None)
+    if started is not None:
+        TASK_DURATION.labels(task.name, state or 'UNKNOWN').observe(time.perf_counter() - started)
+
+
+@worker_ready.connect
+def _serve_worker_metrics(**kwargs):
+    if settings.METRICS_WORKER_PORT:
+        if os.environ.get('PROMETHEUS_MULTIPROC_DIR'):
+            registry = CollectorRegistry()
+            multiprocess.MultiProcessCollector(registry)
+        else:
+            registry = REGISTRY
+        start_http_server(settings.METRICS_WORKER_PORT, registry=registry)
+        logger.info(f"Serving worker metrics on port {settings.METRICS_WORKER_PORT}")
@@ -0,0 +1,133 @@
+"""
+Exact money amounts.
+
+``Money`` holds an amount as integer cents, so arithmetic and comparisons
+are plain int operations with no rounding and no float anywhere. User and
+gateway input goes through ``Money.parse``, which validates the text with
+a few string checks instead of a float()/Decimal() round trip. JSON
+numbers arrive as floats; those are read from their shortest repr (the
+digits the client sent), never computed with. Money fields stay
+DecimalFields (NUMERIC, already exact); ``Money.of`` and ``.decimal``
+convert at the model boundary.
+"""
+from decimal import Decimal
+
+from django.core.exceptions import ValidationError
+
+# Largest amount a DecimalField(max_digits=10, decimal_places=2) can hold
+MAX_CENTS = 10 ** 10 - 1
+
+
+def _cents(text):
+    """
+    Integer cents for ``"123"``, ``"123.4"`` or ``"123.45"``, else None.
+    """
+    whole, dot, fraction = text.strip().partition('.')
+    if not dot:
+        fraction = '00'
+    elif len(fraction) == 1:
+        fraction += '0'
+    digits = whole + fraction
+    # isascii() rules out other scripts' digits, which isdigit() accepts
+    if len(fraction) != 2 or not 0 < len(whole) <= 8 or not digits.isdigit() or not digits.isascii():
+        return None
+    return int(digits)
+
+
+class Money:
+    __slots__ = ('cents',)
+
+    def __init__(self, cents):
+        if type(cents) is not int:
+            raise TypeError(f"Money needs integer cents, got {type(cents).__name__}")
+        self.cents = cents
+
+    @classmethod
+    def parse(cls, value):
+        """
+        Validates an amount from a form, API payload or payment gateway:
+        a positive number with at most two decimal places. Accepts strings,
+        ints, floats (a decoded JSON ``10.5``), Decimals and Money; raises
+        ValidationError otherwise.
+        """
+        value_type = type(value)
+        if value_type is str or value_type is float:
+            # repr() is the shortest text that round-trips, e.g. '10.5', so
+            # 0.1 + 0.2 or 1e-05 fail the string checks like any bad input
+            cents = _cents(value if value_type is str else repr(value))
+            if cents is None:
+                raise ValidationError("Invalid amount.")
+            money = _make(cents)
+        elif value_type is Money:
+            money = value
+        elif value_type is Decimal:
+            money = cls.of(value)
+        elif value_type is int:
+            if not 0 <= value <= MAX_CENTS // 100:
+                raise ValidationError("Invalid amount.")
+            money = _make(value * 100)
+        else:
+            raise ValidationError("Invalid amount.")
+        if not money.cents:
+            raise ValidationError("Amount must be greater than zero.")
+        return money
+
+    @classmethod
+    def of(cls, amount):
+        """
+        Converts a Decimal (e.g. a model field) with at most two decimal
+        places. Sub-cent amounts are rejected rather than rounded.
+        """
+        if not isinstance(amount, Decimal):
+            raise ValidationError("Invalid amount.")
+        cents = amount.scaleb(2)
+        if not cents.is_finite() or cents != cents.to_integral_value() or not 0 <= cents <= MAX_CENTS:
+            raise ValidationError("Invalid amount.")
+        return _make(int(cents))
+
+    @property
+    def decimal(self):
+        """
+        The amount as a two-place Decimal, for model fields and templates.
+        """
+        return Decimal(self.cents).scaleb(-2)
+
+    def __str__(self):
+        return f'{self.cents // 100}.{self.cents % 100:02d}'
+
+    def __repr__(self):
+        return f'Money({self})'
+
+    def __add__(self, other):
+        return _make(self.cents + other.cents)
+
+    def __sub__(self, other):
+        return _make(self.cents - other.cents)
+
+    def __eq__(self, other):
+        return isinstance(other, Money) and self.cents == other.cents
+
+    def __lt__(self, other):
+        return self.cents < other.cents
+
+    def __le__(self, other):
+        return self.cents <= other.cents
+
+    def __gt__(self, other):
+        return self.cents > other.cents
+
+    def __ge__(self, other):
+        return self.cents >= other.cents
+
+    def __hash__(self):
+        return hash(self.cents)
+
+    def __bool__(self):
+        return self.cents != 0
+
+
+def _make(cents):
+    # Skips the type check in __init__ for cents computed here
+    money = object.__new__(Money)
+    money.cents = cents
+    return money
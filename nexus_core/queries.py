@@ -0,0 +1,203 @@
+"""
+Per-request SQL instrumentation.
+
+``QueryRecorder`` hooks every database connection through Django's
+``execute_wrapper`` and records each query's time, its fingerprint (the SQL
+with the placeholders of IN lists collapsed, so the same statement for
+different rows counts as one) and where it came from: the innermost
+template line being rendered and the innermost line of our own code. A
+fingerprint seen many times in one request is the signature of a lazy
+relation used in a loop (``product.images.first`` in a template,
+``Bid.__str__`` reaching ``bidder.username``).
+
+``QueryInstrumentationMiddleware`` runs the recorder on a sample of
+requests (QUERY_INSTRUMENTATION_SAMPLE_RATE) and reports on the response
+as a ``Server-Timing`` header, which the browser's network panel shows,
+and as one JSON log line on the ``nexus_core.queries`` logger, at WARNING
+when a fingerprint repeats QUERY_INSTRUMENTATION_DUPLICATE_THRESHOLD times.
+The header only carries the db and app durations; the query count and the
+most repeated query's template or code line are added for staff users and
+with DEBUG, everyone else finds them in the log line.
+Requests outside the sample only pay for one random() call; with
+QUERY_INSTRUMENTATION_ENABLED off the middleware removes itself at startup.
+
+In tests, ``assert_queries`` fails with the same report when a block runs
+more queries, or more repeats of one query, than allowed.
+"""
+import json
+import logging
+import os
+import random
+import re
+import sys
+import time
+from contextlib import ExitStack, contextmanager
+
+import django
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+
+logger = logging.getLogger(__name__)
+
+# Repeated fingerprints listed in the log line and in assertion messages
+REPORTED_DUPLICATES = 5
+
+_IN_LIST = re.compile(r'IN \((?:%s, )*%s\)')
+_SPACES = re.compile(r'\s+')
+
+_DJANGO_DIR = os.path.dirname(django.__file__)
+_PROJECT_DIR = str(settings.BASE_DIR)
+
+
+def fingerprint(sql):
+    return _SPACES.sub(' ', _IN_LIST.sub('IN (...)', sql)).strip()
+
+
+def origin():
+    """
+    ``(template line, code line)`` that triggered the current query, each
+    as ``'path:line'`` or None.
+    """
+    template = code = None
+    frame = sys._getframe(2)
+    while frame is not None and not (template and code):
+        filename = frame.f_code.co_filename
+        if filename.startswith(_DJANGO_DIR):
+            if template is None and frame.f_code.co_name == 'render_annotated':
+                node = frame.f_locals.get('self')
+                token = getattr(node, 'token', None)
+                node_origin = getattr(node, 'origin', None)
+                if token is not None and node_origin is not None:
+                    template = f'{node_origin.template_name}:{token.lineno}'
+        elif code is None and filename.startswith(_PROJECT_DIR) and filename != __file__ and 'site-packages' not in filename:
+            code = f'{os.path.relpath(filename, _PROJECT_DIR)}:{frame.f_lineno}'
+        frame = frame.f_back
+    return template, code
+
+
+class QueryRecorder:
+    """
+    ``execute_wrapper`` that tallies queries; use ``record()`` to install it
+    on every connection.
+    """
+
+    def __init__(self, origins=True):
+        self.origins = origins
+        self.count = 0
+        self.seconds = 0.0
+        # Parameterized SQL -> [count, seconds, first origin]
+        self.statements = {}
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            elapsed = time.perf_counter() - started
+            self.count += 1
+            self.seconds += elapsed
+            entry = self.statements.get(sql)
+            if entry is None:
+                self.statements[sql] = [1, elapsed, origin() if self.origins else (None, None)]
+            else:
+                entry[0] += 1
+                entry[1] += elapsed
+
+    @contextmanager
+    def record(self):
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(self))
+            yield self
+
+    def duplicates(self):
+        """
+        Fingerprints run more than once, most repeated first, as dicts with
+        ``sql``, ``count``, ``ms``, ``template`` and ``code``.
+        """
+        grouped = {}
+        for sql, (count, seconds, (template, code)) in self.statements.items():
+            key = fingerprint(sql)
+            entry = grouped.setdefault(key, {'sql': key, 'count': 0, 'ms': 0.0, 'template': template, 'code': code})
+            entry['count'] += count
+            entry['ms'] += seconds * 1000
+        repeated = [entry for entry in grouped.values() if entry['count'] > 1]
+        for entry in repeated:
+            entry['ms'] = round(entry['ms'], 2)
+        return sorted(repeated, key=lambda entry: (-entry['count'], -entry['ms']))
+
+    def report(self):
+        return {
+            'queries': self.count,
+            'db_ms': round(self.seconds * 1000, 2),
+            'duplicates': self.duplicates()[:REPORTED_DUPLICATES],
+        }
+
+
+class QueryInstrumentationMiddleware:
+    def __init__(self, get_response):
+        if not settings.QUERY_INSTRUMENTATION_ENABLED:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.sample_rate = settings.QUERY_INSTRUMENTATION_SAMPLE_RATE
+        self.threshold = settings.QUERY_INSTRUMENTATION_DUPLICATE_THRESHOLD
+
+    def __call__(self, request):
+        if random.random() >= self.sample_rate:
+            return self.get_response(request)
+
+        started = time.perf_counter()
+        recorder = QueryRecorder()
+        with recorder.record():
+            response = self.get_response(request)
+        total_ms = (time.perf_counter() - started) * 1000
+
+        report = recorder.report()
+        repeated = report['duplicates']
+        user = getattr(request, 'user', None)
+        if settings.DEBUG or getattr(user, 'is_staff', False):
+            # Template names and source lines are not for the public
+            timing = [f'db;dur={report["db_ms"]:.1f};desc="{report["queries"]} queries"']
+            if repeated:
+                timing.append(f'db-repeat;desc="{repeated[0]["count"]}x {repeated[0]["template"] or repeated[0]["code"] or "?"}"')
+        else:
+            timing = [f'db;dur={report["db_ms"]:.1f}']
+        timing.append(f'app;dur={total_ms:.1f}')
+        if response.has_header('Server-Timing'):
+            timing.insert(0, response['Server-Timing'])
+        response['Server-Timing'] = ', '.join(timing)
+
+        suspected = bool(repeated) and repeated[0]['count'] >= self.threshold
+        logger.log(logging.WARNING if suspected else logging.INFO, json.dumps({
+            'event': 'request_queries',
+            'method': request.method,
+            'path': request.path,
+            'view': getattr(request.resolver_match, 'view_name', None),
+            'status': response.status_code,
+            'ms': round(total_ms, 2),
+            'n_plus_one': suspected,
+            **report,
+        }))
+        return response
+
+
+@contextmanager
+def assert_queries(max_queries=None, max_repeats=1):
+    """
+    Fails when the block runs more than ``max_queries`` queries, or one
+    fingerprint more than ``max_repeats`` times. Yields the QueryRecorder.
+    """
+    recorder = QueryRecorder()
+    with recorder.record():
+        yield recorder
+
+    problems = []
+    if max_queries is not None and recorder.count > max_queries:
+        problems.append(f"{recorder.count} queries, at most {max_queries} expected")
+    for entry in recorder.duplicates():
+        if entry['count'] > max_repeats:
+            where = ', '.join(filter(None, (entry['template'], entry['code']))) or 'unknown origin'
+            problems.append(f"{entry['count']}x from {where}: {entry['sql']}")
+    if problems:
+        raise AssertionError('\n'.join(problems))
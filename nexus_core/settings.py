@@ -59,6 +59,9 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    # Outermost so session and auth queries are counted too; removes itself
+    # unless QUERY_INSTRUMENTATION_ENABLED
+    'nexus_core.queries.QueryInstrumentationMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'whitenoise.middleware.WhiteNoiseMiddleware', # Add Whitenoise
     'django.contrib.sessions.middleware.SessionMiddleware',
@@ -103,6 +106,16 @@ DATABASES = {
 }
 
 
+# Cache (shared Redis cache in production, per-process memory otherwise)
+if os.environ.get('REDIS_URL'):
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': os.environ['REDIS_URL'],
+        }
+    }
+
+
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
 
@@ -161,6 +174,12 @@ LOGGING = {
             'level': 'INFO',
             'propagate': False,
         },
+        # One JSON line per sampled request (nexus_core/queries.py)
+        'nexus_core.queries': {
+            'handlers': ['console'],
+            'level': 'INFO',
+            'propagate': False,
+        },
     },
 }
 
@@ -177,15 +196,119 @@ LOGOUT_REDIRECT_URL = 'home'
 import os
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
+# Uploads are immutable (new names on upload, variants named by size), so
+# media is served with far-future caching (see nexus_core/http.py)
+MEDIA_CACHE_MAX_AGE = int(os.environ.get('MEDIA_CACHE_MAX_AGE', 365 * 24 * 3600))
+# Hand media and invoice bodies to the front web server instead of a Python
+# worker, e.g. '/protected-media/' for an nginx internal location on MEDIA_ROOT
+MEDIA_ACCEL_REDIRECT_PREFIX = os.environ.get('MEDIA_ACCEL_REDIRECT_PREFIX', '')
+
+# Card and detail variants of product images (see market/images.py)
+IMAGE_PIPELINE_ENABLED = os.environ.get('IMAGE_PIPELINE_ENABLED', 'True') == 'True'
+IMAGE_PIPELINE_WORKERS = int(os.environ.get('IMAGE_PIPELINE_WORKERS', os.cpu_count() or 1))
+
+# Per-request DB time as Server-Timing headers, and query counts and repeated
+# queries in log lines (see nexus_core/queries.py), on a share of requests
+QUERY_INSTRUMENTATION_ENABLED = os.environ.get('QUERY_INSTRUMENTATION_ENABLED', 'False') == 'True'
+QUERY_INSTRUMENTATION_SAMPLE_RATE = float(os.environ.get('QUERY_INSTRUMENTATION_SAMPLE_RATE', 0.01))
+# A query repeated this often in one request is logged as a suspected N+1
+QUERY_INSTRUMENTATION_DUPLICATE_THRESHOLD = int(os.environ.get('QUERY_INSTRUMENTATION_DUPLICATE_THRESHOLD', 5))
+
+# Prometheus metrics on /metrics (see nexus_core/metrics.py); scrapers must send
+# the token as 'Authorization: Bearer <token>', without one only staff can read it
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN', '')
+# Celery workers serve their own metrics on this port, 0 leaves it off
+METRICS_WORKER_PORT = int(os.environ.get('METRICS_WORKER_PORT', 0))
 
 
 # Celery Configuration
+from celery.schedules import crontab
+
 CELERY_BROKER_URL = os.environ.get('REDIS_URL', 'redis://localhost:6379/0')
 CELERY_RESULT_BACKEND = os.environ.get('REDIS_URL', 'redis://localhost:6379/0')
 CELERY_ACCEPT_CONTENT = ['json']
 CELERY_TASK_SERIALIZER = 'json'
 CELERY_RESULT_SERIALIZER = 'json'
 CELERY_TIMEZONE = TIME_ZONE
+CELERY_BEAT_SCHEDULE = {
+    # Safety net only, auctions are closed by ETA tasks (market.services.AuctionScheduler)
+    'close-expired-auctions': {
+        'task': 'market.tasks.close_expired_auctions',
+        'schedule': 60.0,
+    },
+    'drain-notification-outbox': {
+        'task': 'transactions.tasks.drain_notification_outbox',
+        'schedule': 5.0,
+    },
+    'settle-pending-transactions': {
+        'task': 'transactions.tasks.settle_pending_transactions',
+        'schedule': 60.0,
+    },
+    # Nightly repair of the materialized dashboard stats (transactions/stats.py)
+    'reconcile-dashboard-stats': {
+        'task': 'transactions.tasks.reconcile_dashboard_stats',
+        'schedule': crontab(hour=3, minute=30),
+    },
+}
+
+# Close each auction with an ETA task at its end time (market.services.AuctionScheduler)
+AUCTION_SCHEDULER_ENABLED = os.environ.get('AUCTION_SCHEDULER_ENABLED', 'True') == 'True'
+# Seconds ahead a close is enqueued; later ones are enqueued by
+# schedule_auction_closes every AUCTION_SCHEDULE_INTERVAL seconds
+AUCTION_SCHEDULE_HORIZON = int(os.environ.get('AUCTION_SCHEDULE_HORIZON', 1800))
+AUCTION_SCHEDULE_INTERVAL = int(os.environ.get('AUCTION_SCHEDULE_INTERVAL', 300))
+CELERY_BEAT_SCHEDULE['schedule-auction-closes'] = {
+    'task': 'market.tasks.schedule_auction_closes',
+    'schedule': float(AUCTION_SCHEDULE_INTERVAL),
+}
+# Redis redelivers a task unacknowledged for this long, ETA tasks included;
+# it has to exceed the horizon or every scheduled close runs twice
+CELERY_BROKER_TRANSPORT_OPTIONS = {
+    'visibility_timeout': int(os.environ.get('CELERY_VISIBILITY_TIMEOUT', max(3600, AUCTION_SCHEDULE_HORIZON + 2 * AUCTION_SCHEDULE_INTERVAL))),
+}
+
+# Expired-auction backlogs larger than one batch are split across this many shards
+AUCTION_CLOSE_BATCH_SIZE = int(os.environ.get('AUCTION_CLOSE_BATCH_SIZE', 200))
+AUCTION_CLOSE_SHARDS = int(os.environ.get('AUCTION_CLOSE_SHARDS', 4))
+
+# Site-wide sniper protection, unless a SniperPolicy overrides it (see market/rules.py)
+AUCTION_SNIPER_WINDOW = int(os.environ.get('AUCTION_SNIPER_WINDOW', 30))
+AUCTION_SNIPER_EXTENSION = int(os.environ.get('AUCTION_SNIPER_EXTENSION', 60))
+# 0 extends without limit
+AUCTION_MAX_EXTENSIONS = int(os.environ.get('AUCTION_MAX_EXTENSIONS', 0))
+# How long each process keeps increment tables and sniper policies in memory
+AUCTION_RULES_TTL = int(os.environ.get('AUCTION_RULES_TTL', 60))
+
+# Bid Book (Redis-backed engine for hot auctions, see market/bidbook.py)
+BIDBOOK_ENABLED = os.environ.get('BIDBOOK_ENABLED', 'False') == 'True'
+BIDBOOK_REDIS_URL = os.environ.get('BIDBOOK_REDIS_URL', CELERY_BROKER_URL)
+BIDBOOK_FLUSH_BATCH_SIZE = int(os.environ.get('BIDBOOK_FLUSH_BATCH_SIZE', 500))
+# Seconds closing and rebuilding wait for another process's flush to commit
+BIDBOOK_FLUSH_WAIT = float(os.environ.get('BIDBOOK_FLUSH_WAIT', 10))
+# Only scheduled with the book on, a no-op every second would tie up the worker
+if BIDBOOK_ENABLED:
+    CELERY_BEAT_SCHEDULE['flush-bid-book'] = {
+        'task': 'market.tasks.flush_bid_book',
+        'schedule': 1.0,
+    }
+
+# Live bid/extension/close events over SSE, served by nexus_core.asgi (see market/streams.py)
+BID_STREAM_ENABLED = os.environ.get('BID_STREAM_ENABLED', 'False') == 'True'
+BID_STREAM_REDIS_URL = os.environ.get('BID_STREAM_REDIS_URL', CELERY_BROKER_URL)
+# Origin of the ASGI stream process when it is not served from the same host
+BID_STREAM_BASE_URL = os.environ.get('BID_STREAM_BASE_URL', '')
+# Page origins allowed to read the stream cross-origin (CORS), needed with BID_STREAM_BASE_URL
+BID_STREAM_ALLOWED_ORIGINS = [
+    origin.strip().rstrip('/') for origin in
+    os.environ.get('BID_STREAM_ALLOWED_ORIGINS', os.environ.get('BASE_URL', 'http://localhost:8000')).split(',')
+    if origin.strip()
+]
+
+# Queue bids and return a ticket instead of placing them inline (see market/ingest.py)
+BID_INGEST_ENABLED = os.environ.get('BID_INGEST_ENABLED', 'False') == 'True'
+BID_INGEST_REDIS_URL = os.environ.get('BID_INGEST_REDIS_URL', CELERY_BROKER_URL)
+BID_INGEST_SHARDS = int(os.environ.get('BID_INGEST_SHARDS', 4))
+BID_INGEST_TICKET_TTL = int(os.environ.get('BID_INGEST_TICKET_TTL', 3600))
 
 # Email Configuration
 if DEBUG:
@@ -199,6 +322,28 @@ else:
     EMAIL_HOST_PASSWORD = os.environ.get('EMAIL_HOST_PASSWORD')
     DEFAULT_FROM_EMAIL = EMAIL_HOST_USER
 
+# Outbid/win/sold emails are queued in transactions.OutboxMessage and sent in batches
+NOTIFICATION_OUTBOX_BATCH_SIZE = int(os.environ.get('NOTIFICATION_OUTBOX_BATCH_SIZE', 500))
+# An email the mail server did not take is retried this often, this many times
+NOTIFICATION_OUTBOX_RETRY_DELAY = int(os.environ.get('NOTIFICATION_OUTBOX_RETRY_DELAY', 300))
+NOTIFICATION_OUTBOX_MAX_ATTEMPTS = int(os.environ.get('NOTIFICATION_OUTBOX_MAX_ATTEMPTS', 5))
+
+# Won auctions are paid from the winner's wallet in batches (see transactions/settlement.py)
+SETTLEMENT_BATCH_SIZE = int(os.environ.get('SETTLEMENT_BATCH_SIZE', 1000))
+# A transaction the buyer cannot cover is retried this often, this many times
+SETTLEMENT_RETRY_DELAY = int(os.environ.get('SETTLEMENT_RETRY_DELAY', 3600))
+SETTLEMENT_MAX_ATTEMPTS = int(os.environ.get('SETTLEMENT_MAX_ATTEMPTS', 3))
+
+# Limits on one POST /api/products/import/ body, larger files go through manage.py import_listings
+LISTING_IMPORT_API_MAX_BYTES = int(os.environ.get('LISTING_IMPORT_API_MAX_BYTES', 10 * 1024 * 1024))
+LISTING_IMPORT_API_MAX_ROWS = int(os.environ.get('LISTING_IMPORT_API_MAX_ROWS', 10000))
+
+# The nightly dashboard stats reconcile locks and repairs this many users per transaction
+DASHBOARD_RECONCILE_BATCH_SIZE = int(os.environ.get('DASHBOARD_RECONCILE_BATCH_SIZE', 200))
+
+# Render invoice PDFs in a Celery task when a sale is paid (see transactions/invoices.py)
+INVOICE_PRERENDER_ENABLED = os.environ.get('INVOICE_PRERENDER_ENABLED', 'True') == 'True'
+
 # PayPal Configuration
 PAYPAL_CLIENT_ID = os.environ.get('PAYPAL_CLIENT_ID', 'your-client-id').strip()
 PAYPAL_SECRET = os.environ.get('PAYPAL_SECRET', 'your-secret').strip()
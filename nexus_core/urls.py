@@ -4,7 +4,7 @@ from django.conf import settings
 from django.conf.urls.static import static
 from rest_framework.routers import DefaultRouter
 from users.views import UserViewSet, AddressViewSet
-from market.views import CategoryViewSet, ProductViewSet
+from market.views import CategoryViewSet, ProductViewSet, BidTicketView
 from transactions.views import TransactionViewSet, NotificationViewSet
 from market.frontend_views import (
     home, product_detail, create_product, user_profile, dashboard, 
@@ -14,6 +14,7 @@ from market.frontend_views import (
 from market.auth_views import login_view, logout_view, signup_view
 from market.payment_views import create_checkout_session, paypal_capture, payment_success
 from transactions.views import download_invoice
+from nexus_core.metrics import metrics_view
 
 router = DefaultRouter()
 router.register(r'users', UserViewSet)
@@ -62,11 +63,20 @@ urlpatterns = [
 
     path('api/', include(router.urls)),
     path('api-auth/', include('rest_framework.urls')),
+
+    # Prometheus scrape endpoint
+    path('metrics/', metrics_view, name='metrics'),
 ]
 
-from django.views.static import serve
+if settings.BID_INGEST_ENABLED:
+    # Results of queued bids (market/ingest.py)
+    urlpatterns += [
+        path('api/bid-tickets/<str:ticket>/', BidTicketView.as_view(), name='bid_ticket'),
+    ]
+
 from django.urls import re_path
+from nexus_core.http import serve_media
 
 urlpatterns += [
-    re_path(r'^media/(?P<path>.*)$', serve, {'document_root': settings.MEDIA_ROOT}),
+    re_path(r'^media/(?P<path>.*)$', serve_media),
 ]
@@ -23,5 +23,12 @@ echo "🎁 POPULATING GIFT CARDS"
 echo "-----------------------------------"
 python manage.py populate_gift_cards
 
+echo "Preparing metrics directory..."
+# Gunicorn workers write their samples here and /metrics merges them;
+# stale files from a previous run would be counted again
+export PROMETHEUS_MULTIPROC_DIR=${PROMETHEUS_MULTIPROC_DIR:-/tmp/nexus-metrics}
+rm -rf "$PROMETHEUS_MULTIPROC_DIR"
+mkdir -p "$PROMETHEUS_MULTIPROC_DIR"
+
 echo "Starting Gunicorn..."
 exec gunicorn nexus_core.wsgi --bind 0.0.0.0:${PORT:-8000} --log-file -
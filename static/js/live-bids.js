@@ -0,0 +1,85 @@
+// Live bid, extension and close events for the product page (market/streams.py)
+(function () {
+    const script = document.currentScript;
+    const url = script && script.getAttribute('data-stream-url');
+    // Ticket of this user's queued bid, if the last POST queued one (market/ingest.py)
+    const ticket = script && script.getAttribute('data-ticket');
+    if (!url || !window.EventSource) return;
+
+    const money = new Intl.NumberFormat('en-US', { minimumFractionDigits: 2, maximumFractionDigits: 2 });
+
+    function live(name) {
+        return document.querySelector('[data-live="' + name + '"]');
+    }
+
+    function addToFeed(data) {
+        const feed = live('feed');
+        if (!feed) return;
+        const empty = feed.querySelector('p');
+        if (empty) empty.remove();
+
+        const row = document.createElement('div');
+        row.className = 'flex items-center justify-between text-sm p-2 rounded hover:bg-surface-lighter transition-colors';
+        const who = document.createElement('div');
+        who.className = 'flex items-center gap-2';
+        const name = document.createElement('span');
+        name.className = 'font-bold text-gray-300';
+        name.textContent = data.bidder;
+        const when = document.createElement('span');
+        when.className = 'text-xs text-gray-400';
+        when.textContent = 'just now';
+        who.append(name, when);
+        const amount = document.createElement('span');
+        amount.className = 'font-mono font-bold text-primary';
+        amount.textContent = '$' + money.format(Number(data.amount));
+        row.append(who, amount);
+
+        feed.prepend(row);
+        while (feed.children.length > 5) feed.lastElementChild.remove();
+    }
+
+    const source = new EventSource(url);
+
+    source.addEventListener('bid', function (e) {
+        const data = JSON.parse(e.data);
+        const price = live('current-bid');
+        if (price) price.textContent = '$' + money.format(Number(data.amount));
+        const count = live('bid-count');
+        if (count) count.textContent = Number(count.textContent) + 1;
+        addToFeed(data);
+    });
+
+    source.addEventListener('extended', function (e) {
+        const data = JSON.parse(e.data);
+        // countdown.js re-reads data-end-time every second
+        document.querySelectorAll('.auction-timer').forEach(function (timer) {
+            timer.setAttribute('data-end-time', data.auction_end_time);
+        });
+    });
+
+    function showTicket(data) {
+        const status = live('ticket-status');
+        if (!ticket || data.ticket !== ticket || data.status === 'PENDING' || !status) return;
+        status.textContent = data.message;
+        status.classList.remove('hidden');
+        status.classList.add(data.status === 'ACCEPTED' ? 'text-success' : 'text-red-500');
+    }
+
+    source.addEventListener('ticket', function (e) {
+        showTicket(JSON.parse(e.data));
+    });
+
+    // The result may have been pushed before this page subscribed, ask once
+    if (ticket) {
+        source.addEventListener('open', function () {
+            fetch('/api/bid-tickets/' + ticket + '/', { credentials: 'same-origin' })
+                .then(function (response) { return response.ok ? response.json() : null; })
+                .then(function (data) { if (data) showTicket(data); });
+        }, { once: true });
+    }
+
+    source.addEventListener('closed', function () {
+        source.close();
+        window.location.reload();
+    });
+})();
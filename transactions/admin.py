@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import Transaction, Review, Dispute, Notification
+from .models import Transaction, Review, Dispute, Notification, OutboxMessage
 
 @admin.register(Transaction)
 class TransactionAdmin(admin.ModelAdmin):
@@ -10,3 +10,4 @@ class TransactionAdmin(admin.ModelAdmin):
 admin.site.register(Review)
 admin.site.register(Dispute)
 admin.site.register(Notification)
+admin.site.register(OutboxMessage)
@@ -0,0 +1,117 @@
+"""
+Invoice PDFs.
+
+Rendering an invoice through xhtml2pdf is CPU heavy, so it is done once per
+transaction instead of on every download: when a transaction becomes PAID
+the ``render_invoices`` task renders ``INVOICE_TEMPLATE`` and stores the
+PDF in ``Transaction.invoice_file``, recording the template version it
+came from. Downloads stream the stored file (nexus_core.http.serve_file).
+
+The version is a hash of the template source, so editing the template
+makes every stored invoice stale; stale or missing invoices are rendered
+again on their next download, or ahead of time with
+``manage.py render_invoices``.
+"""
+import hashlib
+import logging
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.db import transaction
+from django.template.loader import get_template
+
+from .models import Transaction
+from .services import render_to_pdf
+
+logger = logging.getLogger(__name__)
+
+INVOICE_TEMPLATE = 'transactions/invoice.html'
+
+# Transactions per render_invoices task
+TASK_BATCH_SIZE = 50
+
+_version = None
+
+
+class InvoiceError(Exception):
+    pass
+
+
+def template_version():
+    global _version
+    if _version is None:
+        source = get_template(INVOICE_TEMPLATE).template.source
+        _version = hashlib.sha256(source.encode()).hexdigest()[:12]
+    return _version
+
+
+class Invoices:
+    @staticmethod
+    def is_current(txn):
+        return bool(txn.invoice_file) and txn.invoice_version == template_version()
+
+    @staticmethod
+    def etag(txn):
+        return f'invoice-{txn.id}-{txn.invoice_version}'
+
+    @staticmethod
+    def store(txn):
+        """
+        Renders the invoice and stores it on ``txn`` (select_related buyer,
+        seller and product to avoid extra queries).
+        """
+        version = template_version()
+        pdf = render_to_pdf(INVOICE_TEMPLATE, {'transaction': txn})
+        if pdf is None:
+            raise InvoiceError(f"Could not render the invoice of transaction {txn.id}")
+
+        previous = txn.invoice_file.name if txn.invoice_file else None
+        txn.invoice_file.save(f'invoice_{txn.id}_{version}.pdf', ContentFile(pdf), save=False)
+        txn.invoice_version = version
+        # update() rather than save(), the Transaction signals need not run
+        Transaction.objects.filter(pk=txn.pk).update(invoice_file=txn.invoice_file.name, invoice_version=version)
+        if previous and previous != txn.invoice_file.name:
+            txn.invoice_file.storage.delete(previous)
+        return txn
+
+    @staticmethod
+    def render_many(transaction_ids):
+        """
+        Stores the invoices of these transactions that are missing or stale.
+        Returns how many were rendered.
+        """
+        rendered = 0
+        transactions = Transaction.objects.filter(id__in=transaction_ids).select_related('buyer', 'seller', 'product')
+        for txn in transactions:
+            if Invoices.is_current(txn):
+                continue
+            try:
+                Invoices.store(txn)
+            except Exception as e:
+                # Rendered on download instead
+                logger.error(f"Failed to render invoice for transaction {txn.id}: {e}")
+            else:
+                rendered += 1
+        return rendered
+
+    @staticmethod
+    def schedule(transaction_ids):
+        """
+        Queues the invoices for rendering once the surrounding transaction
+        commits.
+        """
+        if not settings.INVOICE_PRERENDER_ENABLED or not transaction_ids:
+            return
+
+        from .tasks import render_invoices
+        transaction_ids = list(transaction_ids)
+
+        def enqueue():
+            for start in range(0, len(transaction_ids), TASK_BATCH_SIZE):
+                try:
+                    render_invoices.delay(transaction_ids[start:start + TASK_BATCH_SIZE])
+                except Exception as e:
+                    logger.error(f"Failed to queue invoice rendering: {e}")
+                    return
+
+        transaction.on_commit(enqueue)
@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+from transactions.stats import DashboardStats
+
+
+class Command(BaseCommand):
+    help = 'Recomputes the dashboard stats and sales rollups from the transactions (backfill and repair).'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', type=int, action='append', help='Only these user ids (repeatable).')
+
+    def handle(self, *args, **options):
+        fixed = DashboardStats.reconcile(options['user'])
+        self.stdout.write(self.style.SUCCESS(f"Fixed {fixed} dashboard stats rows."))
@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+from django.db.models import Q
+from transactions.invoices import Invoices, template_version
+from transactions.models import PAID_STATUSES, Transaction
+
+
+class Command(BaseCommand):
+    help = 'Renders the stored invoice PDFs of paid transactions that are missing or older than the current template.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=200)
+
+    def handle(self, *args, **options):
+        stale = (Transaction.objects.filter(status__in=PAID_STATUSES)
+                 .filter(Q(invoice_file='') | Q(invoice_file__isnull=True) | ~Q(invoice_version=template_version()))
+                 .order_by('id').values_list('id', flat=True))
+        ids = list(stale)
+        rendered = 0
+        for start in range(0, len(ids), options['batch_size']):
+            rendered += Invoices.render_many(ids[start:start + options['batch_size']])
+        self.stdout.write(self.style.SUCCESS(
+            f"Rendered {rendered} of {len(ids)} stale invoices (template version {template_version()})."))
@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+from transactions.settlement import Settlement
+
+
+class Command(BaseCommand):
+    help = "Pays due PENDING transactions from the buyers' wallets in batches and reports throughput."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int)
+        parser.add_argument('--max-batches', type=int)
+
+    def handle(self, *args, **options):
+        report = Settlement.run(options['batch_size'], options['max_batches'])
+        self.stdout.write(
+            f"{report['batches']} batches: {report['settled']} settled, {report['failed']} failed "
+            f"in {report['seconds']}s ({report['per_second']} transactions/s)"
+        )
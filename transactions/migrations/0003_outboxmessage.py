@@ -0,0 +1,32 @@
+# Generated by Django 5.2.18 on 2026-10-17 20:44
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('market', '0005_product_active_end_time_index'),
+        ('transactions', '0002_initial'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OutboxMessage',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('OUTBID', 'Outbid Alert'), ('AUCTION_WON', 'Auction Won'), ('ITEM_SOLD', 'Item Sold'), ('AUCTION_ENDED', 'Auction Ended')], max_length=20)),
+                ('email', models.EmailField(blank=True, max_length=254)),
+                ('subject', models.CharField(max_length=255)),
+                ('body', models.TextField()),
+                ('notification_type', models.CharField(blank=True, choices=[('OUTBID', 'Outbid Alert'), ('AUCTION_WON', 'Auction Won'), ('ITEM_SOLD', 'Item Sold'), ('WISHLIST', 'Wishlist Alert')], max_length=20)),
+                ('notification_message', models.CharField(blank=True, max_length=255)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('product', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, to='market.product')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='outbox_messages', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+    ]
@@ -0,0 +1,40 @@
+# Generated by Django 5.2.18 on 2026-10-17 21:22
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('market', '0009_auction_rules'),
+        ('transactions', '0003_outboxmessage'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='transaction',
+            name='settle_after',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='transaction',
+            name='settlement_attempts',
+            field=models.PositiveSmallIntegerField(default=0),
+        ),
+        migrations.AlterField(
+            model_name='notification',
+            name='type',
+            field=models.CharField(choices=[('OUTBID', 'Outbid Alert'), ('AUCTION_WON', 'Auction Won'), ('ITEM_SOLD', 'Item Sold'), ('WISHLIST', 'Wishlist Alert'), ('PAYMENT_SETTLED', 'Payment Settled'), ('PAYMENT_FAILED', 'Payment Failed')], max_length=20),
+        ),
+        migrations.AlterField(
+            model_name='outboxmessage',
+            name='notification_type',
+            field=models.CharField(blank=True, choices=[('OUTBID', 'Outbid Alert'), ('AUCTION_WON', 'Auction Won'), ('ITEM_SOLD', 'Item Sold'), ('WISHLIST', 'Wishlist Alert'), ('PAYMENT_SETTLED', 'Payment Settled'), ('PAYMENT_FAILED', 'Payment Failed')], max_length=20),
+        ),
+        migrations.AddIndex(
+            model_name='transaction',
+            index=models.Index(fields=['status', 'settle_after'], name='transaction_status_edf200_idx'),
+        ),
+    ]
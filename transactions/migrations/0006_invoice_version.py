@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-17 21:29
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('transactions', '0005_dashboard_stats'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='transaction',
+            name='invoice_version',
+            field=models.CharField(blank=True, max_length=16),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-17 21:58
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('transactions', '0006_invoice_version'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='outboxmessage',
+            name='send_after',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='outboxmessage',
+            name='send_attempts',
+            field=models.PositiveSmallIntegerField(default=0),
+        ),
+    ]
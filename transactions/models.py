@@ -2,6 +2,12 @@ from django.db import models
 from django.conf import settings
 from market.models import Product
 
+# Statuses counted as completed sales in the dashboard stats (transactions/stats.py)
+PAID_STATUSES = ('PAID', 'SHIPPED', 'DELIVERED')
+
+# Marks a row whose stats key could not be read from the loaded fields
+UNKNOWN = object()
+
 class Transaction(models.Model):
     STATUS_CHOICES = [
         ('PENDING', 'Pending Payment'),
@@ -19,6 +25,36 @@ class Transaction(models.Model):
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='PENDING')
     transaction_date = models.DateTimeField(auto_now_add=True)
     invoice_file = models.FileField(upload_to='invoices/', null=True, blank=True)
+    # Template version invoice_file was rendered from (transactions/invoices.py)
+    invoice_version = models.CharField(max_length=16, blank=True)
+
+    # Automatic wallet settlement of PENDING transactions (transactions/settlement.py)
+    settlement_attempts = models.PositiveSmallIntegerField(default=0)
+    settle_after = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'settle_after']),
+        ]
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # What the dashboard stats counted for this row when it was loaded
+        instance._stats_key_loaded = instance.stats_key()
+        return instance
+
+    def stats_key(self):
+        """
+        ``(seller_id, buyer_id, amount, transaction_date)`` for a completed
+        sale, None otherwise, or UNKNOWN when a needed field is deferred.
+        """
+        fields = self.__dict__
+        if any(name not in fields for name in ('status', 'seller_id', 'buyer_id', 'amount', 'transaction_date')):
+            return UNKNOWN
+        if fields['status'] not in PAID_STATUSES:
+            return None
+        return fields['seller_id'], fields['buyer_id'], fields['amount'], fields['transaction_date']
 
     def __str__(self):
         return f"Tx #{self.id} - {self.product.title}"
@@ -55,6 +91,8 @@ class Notification(models.Model):
         ('AUCTION_WON', 'Auction Won'),
         ('ITEM_SOLD', 'Item Sold'),
         ('WISHLIST', 'Wishlist Alert'),
+        ('PAYMENT_SETTLED', 'Payment Settled'),
+        ('PAYMENT_FAILED', 'Payment Failed'),
     ]
 
     user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='notifications')
@@ -65,3 +103,125 @@ class Notification(models.Model):
 
     def __str__(self):
         return f"{self.type} - {self.user}"
+
+class OutboxMessage(models.Model):
+    """
+    Email and Notification waiting to be delivered by the outbox consumer.
+    Written in the same database transaction as the event that caused it.
+    """
+    KIND_CHOICES = [
+        ('OUTBID', 'Outbid Alert'),
+        ('AUCTION_WON', 'Auction Won'),
+        ('ITEM_SOLD', 'Item Sold'),
+        ('AUCTION_ENDED', 'Auction Ended'),
+    ]
+
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='outbox_messages')
+    kind = models.CharField(max_length=20, choices=KIND_CHOICES)
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, null=True, blank=True)
+    email = models.EmailField(blank=True)
+    subject = models.CharField(max_length=255)
+    body = models.TextField()
+    notification_type = models.CharField(max_length=20, choices=Notification.TYPE_CHOICES, blank=True)
+    notification_message = models.CharField(max_length=255, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    # Emails the mail server did not take are retried (transactions/outbox.py)
+    send_attempts = models.PositiveSmallIntegerField(default=0)
+    send_after = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return f"{self.kind} - {self.user}"
+
+class UserStats(models.Model):
+    """
+    Dashboard totals per user, kept current by DashboardStats
+    (transactions/stats.py) as transactions are paid, and reconciled nightly.
+    """
+    user = models.OneToOneField(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, primary_key=True, related_name='stats')
+    sales_total = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    sales_count = models.IntegerField(default=0)
+    purchases_total = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    purchases_count = models.IntegerField(default=0)
+
+    class Meta:
+        verbose_name_plural = "User stats"
+
+    def __str__(self):
+        return f"Stats for {self.user_id}"
+
+class SalesRollup(models.Model):
+    """
+    A seller's completed sales in one day or month, for the revenue charts.
+    """
+    class Period(models.TextChoices):
+        DAY = 'DAY', 'Day'
+        MONTH = 'MONTH', 'Month'
+
+    seller = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='sales_rollups')
+    period = models.CharField(max_length=5, choices=Period.choices)
+    # Local date of the day, or the first of the month
+    period_start = models.DateField()
+    total = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    count = models.IntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['seller', 'period', 'period_start'], name='unique_sales_rollup'),
+        ]
+
+    def __str__(self):
+        return f"{self.seller_id} {self.period} {self.period_start}: {self.total}"
+
+# Keep the cached unread count in the page header current
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+@receiver(post_save, sender=Notification)
+def update_unread_count(sender, instance, created, **kwargs):
+    from users.cache import notifications_added, invalidate_unread_notifications
+    if created and not instance.read:
+        notifications_added({instance.user_id: 1})
+    elif not created:
+        invalidate_unread_notifications(instance.user_id)
+
+@receiver(post_delete, sender=Notification)
+def forget_unread_count(sender, instance, **kwargs):
+    from users.cache import invalidate_unread_notifications
+    invalidate_unread_notifications(instance.user_id)
+
+# Keep the seller rating totals on User current
+@receiver(post_save, sender=Review)
+def add_review_rating(sender, instance, created, **kwargs):
+    from users.ratings import rebuild_ratings, review_added
+    if created:
+        review_added(instance.target_user_id, instance.rating)
+    else:
+        # Edited in the admin, the old rating is not known here
+        rebuild_ratings([instance.target_user_id])
+
+@receiver(post_delete, sender=Review)
+def remove_review_rating(sender, instance, **kwargs):
+    from users.ratings import review_removed
+    review_removed(instance.target_user_id, instance.rating)
+
+# Keep the dashboard stats current (bulk updates call DashboardStats themselves)
+@receiver(post_save, sender=Transaction)
+def record_transaction_stats(sender, instance, created, **kwargs):
+    from .stats import DashboardStats
+    old = None if created else getattr(instance, '_stats_key_loaded', UNKNOWN)
+    new = instance.stats_key()
+    DashboardStats.changed(instance, old, new)
+    instance._stats_key_loaded = new
+
+@receiver(post_delete, sender=Transaction)
+def forget_transaction_stats(sender, instance, **kwargs):
+    from .stats import DashboardStats
+    DashboardStats.changed(instance, getattr(instance, '_stats_key_loaded', UNKNOWN), None)
+
+# Pre-render the invoice once the sale is paid (settlement queues its own)
+@receiver(post_save, sender=Transaction)
+def queue_invoice(sender, instance, **kwargs):
+    from .invoices import Invoices
+    fields = instance.__dict__
+    if fields.get('status') in PAID_STATUSES and not fields.get('invoice_file'):
+        Invoices.schedule([instance.pk])
@@ -0,0 +1,154 @@
+from django.conf import settings
+from django.core.mail import EmailMessage, get_connection
+from django.db import transaction
+from django.db.models import F, Q
+from django.utils import timezone
+from nexus_core.metrics import EMAIL_SEND, EMAILS
+from users.cache import notifications_added
+from .models import OutboxMessage, Notification
+import logging
+import time
+from datetime import timedelta
+
+logger = logging.getLogger(__name__)
+
+# Header added to an email when several events of the same kind for the same
+# product are coalesced, e.g. one "outbid 5 times" email instead of five.
+COALESCED_HEADERS = {
+    'OUTBID': "You were outbid {count} times on this item.",
+}
+
+
+class NotificationOutbox:
+    @staticmethod
+    def message(user, kind, subject, body, product=None, notification_type='', notification_message=''):
+        """
+        Builds an unsaved outbox message for ``user``.
+        """
+        return OutboxMessage(
+            user=user,
+            kind=kind,
+            product=product,
+            email=user.email or '',
+            subject=subject,
+            body=body,
+            notification_type=notification_type,
+            notification_message=notification_message[:255],
+        )
+
+    @staticmethod
+    def enqueue(*messages):
+        """
+        Records messages in the outbox. Call inside the transaction that
+        produced the event so they are delivered only if it commits.
+        """
+        OutboxMessage.objects.bulk_create(messages)
+
+    @staticmethod
+    def _due(now):
+        return OutboxMessage.objects.filter(
+            Q(send_after__isnull=True) | Q(send_after__lte=now),
+            send_attempts__lt=settings.NOTIFICATION_OUTBOX_MAX_ATTEMPTS,
+        )
+
+    @staticmethod
+    def drain(batch_size=None):
+        """
+        Delivers one batch of due messages. Messages for the same recipient,
+        kind and product are coalesced into one.
+        The batch is claimed and its Notifications bulk created in one short
+        transaction; the emails then go out over a single SMTP connection
+        with no row locks held, and only messages that were sent (or had no
+        email) are deleted. The others are retried after
+        NOTIFICATION_OUTBOX_RETRY_DELAY, at most NOTIFICATION_OUTBOX_MAX_ATTEMPTS
+        times. Returns the number of outbox rows processed.
+        """
+        batch_size = batch_size or settings.NOTIFICATION_OUTBOX_BATCH_SIZE
+        now = timezone.now()
+
+        with transaction.atomic():
+            # Several consumers can drain concurrently without sharing rows
+            batch = list(
+                NotificationOutbox._due(now).select_for_update(skip_locked=True)
+                .order_by('id')[:batch_size]
+            )
+            if not batch:
+                return 0
+
+            groups = {}
+            for message in batch:
+                key = (message.user_id, message.kind, message.product_id)
+                groups.setdefault(key, []).append(message)
+
+            emails = {}
+            notifications = []
+            done = []
+            for key, messages in groups.items():
+                latest = messages[-1]
+                body = latest.body
+                header = COALESCED_HEADERS.get(latest.kind)
+                if header and len(messages) > 1:
+                    body = f"{header.format(count=len(messages))}\n\n{body}"
+
+                if latest.email:
+                    emails[key] = EmailMessage(subject=latest.subject, body=body, to=[latest.email])
+                else:
+                    done.extend(messages)
+                if latest.notification_type:
+                    notifications.append(Notification(
+                        user_id=latest.user_id,
+                        type=latest.notification_type,
+                        message=latest.notification_message,
+                    ))
+
+            Notification.objects.bulk_create(notifications)
+            # bulk_create sends no post_save, update the cached counts here
+            counts = {}
+            for notification in notifications:
+                counts[notification.user_id] = counts.get(notification.user_id, 0) + 1
+            notifications_added(counts)
+
+            OutboxMessage.objects.filter(id__in=[message.id for message in done]).delete()
+            # Claimed until the retry delay passes, so the emails of a worker
+            # that dies mid-send are retried; their Notifications exist already
+            OutboxMessage.objects.filter(id__in=[message.id for message in batch]).update(
+                send_attempts=F('send_attempts') + 1,
+                send_after=now + timedelta(seconds=settings.NOTIFICATION_OUTBOX_RETRY_DELAY),
+                notification_type='',
+            )
+
+        sent = NotificationOutbox._send(emails)
+        OutboxMessage.objects.filter(
+            id__in=[message.id for key in sent for message in groups[key]]
+        ).delete()
+        for key in emails.keys() - set(sent):
+            latest = groups[key][-1]
+            if latest.send_attempts + 1 >= settings.NOTIFICATION_OUTBOX_MAX_ATTEMPTS:
+                logger.error(f"Giving up on {latest.kind} email to {latest.email} after {latest.send_attempts + 1} attempts")
+
+        return len(batch)
+
+    @staticmethod
+    def _send(emails):
+        """
+        Sends ``{key: EmailMessage}`` over one connection and returns the
+        keys of the emails the mail server took.
+        """
+        if not emails:
+            return []
+
+        sent = []
+        started = time.perf_counter()
+        try:
+            with get_connection() as connection:
+                for key, email in emails.items():
+                    try:
+                        if connection.send_messages([email]):
+                            sent.append(key)
+                    except Exception as e:
+                        logger.error(f"Failed to send outbox email to {email.to[0]}: {e}")
+        except Exception as e:
+            logger.error(f"Failed to send outbox emails: {e}")
+        EMAIL_SEND.labels('outbox', 'sent' if len(sent) == len(emails) else 'failed').observe(time.perf_counter() - started)
+        EMAILS.labels('outbox').inc(len(sent))
+        return sent
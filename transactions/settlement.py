@@ -0,0 +1,141 @@
+"""
+Automatic payment of won auctions.
+
+Closing an auction leaves a PENDING Transaction for the winner.
+``Settlement.settle_batch`` pays a batch of them from the winners' wallets
+as one set: the wallets are locked and moved with
+``WalletLedger.transfer_many``, the settled transactions are flipped to
+PAID with a single UPDATE and counted in the dashboard stats, and the
+buyers and sellers are told with one ``bulk_create`` of Notifications. A
+winner who cannot cover the amount only fails their own row; it stays
+PENDING and is retried after SETTLEMENT_RETRY_DELAY, at most
+SETTLEMENT_MAX_ATTEMPTS times. Meanwhile the winner can pay it on the
+checkout page, which settles the same row under a row lock, so a batch and
+a checkout never charge twice.
+"""
+import logging
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from users.cache import notifications_added
+from users.ledger import WalletLedger
+from .invoices import Invoices
+from .models import Notification, Transaction
+from .stats import DashboardStats
+
+logger = logging.getLogger(__name__)
+
+
+class Settlement:
+    @staticmethod
+    def _due(now):
+        return Transaction.objects.filter(
+            Q(settle_after__isnull=True) | Q(settle_after__lte=now),
+            status='PENDING',
+            settlement_attempts__lt=settings.SETTLEMENT_MAX_ATTEMPTS,
+        )
+
+    @staticmethod
+    def settle_batch(batch_size=None):
+        """
+        Settles one batch of due PENDING transactions.
+        Returns ``(settled, failed)`` counts; ``(0, 0)`` when none are due.
+        """
+        batch_size = batch_size or settings.SETTLEMENT_BATCH_SIZE
+        now = timezone.now()
+
+        with transaction.atomic():
+            # Concurrent workers take disjoint batches
+            batch = list(
+                Settlement._due(now)
+                .select_for_update(skip_locked=True, of=('self',))
+                .select_related('product')
+                .only('id', 'buyer_id', 'seller_id', 'amount', 'transaction_date', 'settlement_attempts', 'product__title')
+                .order_by('id')[:batch_size]
+            )
+            if not batch:
+                return 0, 0
+
+            applied = WalletLedger.transfer_many([
+                (txn.buyer_id, txn.seller_id, txn.amount, f"transaction:{txn.id}") for txn in batch
+            ])
+            settled = [txn for txn, ok in zip(batch, applied) if ok]
+            failed = [txn for txn, ok in zip(batch, applied) if not ok]
+
+            Transaction.objects.filter(id__in=[txn.id for txn in settled]).update(status='PAID')
+            # update() sends no post_save, count the sales here
+            DashboardStats.record(added=[
+                (txn.seller_id, txn.buyer_id, txn.amount, txn.transaction_date) for txn in settled
+            ])
+            Invoices.schedule([txn.id for txn in settled])
+            Transaction.objects.filter(id__in=[txn.id for txn in failed]).update(
+                settlement_attempts=F('settlement_attempts') + 1,
+                settle_after=now + timedelta(seconds=settings.SETTLEMENT_RETRY_DELAY),
+            )
+
+            notifications = Settlement._notifications(settled, failed)
+            Notification.objects.bulk_create(notifications)
+            # bulk_create sends no post_save, update the cached counts here
+            counts = {}
+            for notification in notifications:
+                counts[notification.user_id] = counts.get(notification.user_id, 0) + 1
+            notifications_added(counts)
+
+        for txn in failed:
+            logger.info(f"Transaction {txn.id} not settled: buyer {txn.buyer_id} cannot cover ${txn.amount}")
+        return len(settled), len(failed)
+
+    @staticmethod
+    def _notifications(settled, failed):
+        notifications = []
+        for txn in settled:
+            title = txn.product.title
+            notifications.append(Notification(
+                user_id=txn.buyer_id,
+                type='PAYMENT_SETTLED',
+                message=f"${txn.amount} for '{title}' was paid from your wallet."[:255],
+            ))
+            notifications.append(Notification(
+                user_id=txn.seller_id,
+                type='PAYMENT_SETTLED',
+                message=f"You received ${txn.amount} for '{title}'."[:255],
+            ))
+        for txn in failed:
+            # Only the first failed attempt, retries stay quiet
+            if txn.settlement_attempts == 0:
+                notifications.append(Notification(
+                    user_id=txn.buyer_id,
+                    type='PAYMENT_FAILED',
+                    message=f"We could not charge ${txn.amount} for '{txn.product.title}'. Add funds to your wallet to complete the purchase."[:255],
+                ))
+        return notifications
+
+    @staticmethod
+    def run(batch_size=None, max_batches=None):
+        """
+        Settles batches until nothing is due. Returns a throughput report.
+        """
+        started = time.perf_counter()
+        batches = settled = failed = 0
+        while max_batches is None or batches < max_batches:
+            batch_settled, batch_failed = Settlement.settle_batch(batch_size)
+            if not batch_settled and not batch_failed:
+                break
+            batches += 1
+            settled += batch_settled
+            failed += batch_failed
+
+        seconds = time.perf_counter() - started
+        processed = settled + failed
+        return {
+            'batches': batches,
+            'settled': settled,
+            'failed': failed,
+            'seconds': round(seconds, 3),
+            'per_second': round(processed / seconds, 1) if processed and seconds else 0.0,
+        }
@@ -0,0 +1,243 @@
+"""
+Materialized dashboard statistics.
+
+The dashboard used to aggregate Transaction on every visit (sales total,
+order counts, purchases). Those totals now live in UserStats, and a
+seller's sales per day and per month in SalesRollup, so a dashboard load
+reads a handful of rows however many transactions the user has.
+
+``DashboardStats.record`` applies the transactions that became (or stopped
+being) completed sales as one set: the affected rows are locked in key
+order, adjusted in Python and written back with ``bulk_update``, the same
+way ``WalletLedger.transfer_many`` moves balances. Single saves reach it
+through the Transaction signals; bulk paths such as settlement call it
+directly. ``reconcile`` recomputes everything from Transaction and fixes
+whatever drifted, a batch of users per transaction; it runs nightly.
+"""
+import logging
+from collections import defaultdict
+from datetime import timedelta
+from decimal import Decimal
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.db.models import Count, DateField, Sum
+from django.db.models.functions import TruncDay, TruncMonth
+from django.utils import timezone
+
+from .models import PAID_STATUSES, UNKNOWN, SalesRollup, Transaction, UserStats
+
+logger = logging.getLogger(__name__)
+
+CENT = Decimal('0.01')
+ZERO = Decimal('0.00')
+
+STATS_FIELDS = ['sales_total', 'sales_count', 'purchases_total', 'purchases_count']
+
+
+def _period_starts(when):
+    day = timezone.localdate(when) if timezone.is_aware(when) else when.date()
+    return ((SalesRollup.Period.DAY, day), (SalesRollup.Period.MONTH, day.replace(day=1)))
+
+
+class DashboardStats:
+    @staticmethod
+    def changed(txn, old, new):
+        """
+        Applies one transaction going from stats key ``old`` to ``new``
+        (see Transaction.stats_key).
+        """
+        if old is UNKNOWN or new is UNKNOWN:
+            # Saved from a partially loaded row, recount both users
+            DashboardStats.reconcile([txn.seller_id, txn.buyer_id])
+        elif old != new:
+            DashboardStats.record(added=[new] if new else [], removed=[old] if old else [])
+
+    @staticmethod
+    @transaction.atomic
+    def record(added=(), removed=()):
+        """
+        Counts ``added`` and uncounts ``removed`` completed sales, each a
+        ``(seller_id, buyer_id, amount, transaction_date)`` tuple.
+        """
+        users = defaultdict(lambda: [ZERO, 0, ZERO, 0])
+        rollups = defaultdict(lambda: [ZERO, 0])
+        new_users, new_rollups = set(), set()
+        for sign, sales in ((1, added), (-1, removed)):
+            for seller_id, buyer_id, amount, when in sales:
+                amount = Decimal(amount) * sign
+                users[seller_id][0] += amount
+                users[seller_id][1] += sign
+                users[buyer_id][2] += amount
+                users[buyer_id][3] += sign
+                for period, start in _period_starts(when):
+                    rollups[seller_id, period, start][0] += amount
+                    rollups[seller_id, period, start][1] += sign
+                if sign > 0:
+                    new_users.update((seller_id, buyer_id))
+                    new_rollups.update((seller_id, period, start) for period, start in _period_starts(when))
+        if not users:
+            return
+
+        # Removals never create rows, a user being deleted must not get one back
+        UserStats.objects.bulk_create([UserStats(user_id=user_id) for user_id in new_users], ignore_conflicts=True)
+        stats = list(UserStats.objects.select_for_update().filter(user_id__in=users).order_by('user_id'))
+        for row in stats:
+            for field, delta in zip(STATS_FIELDS, users[row.user_id]):
+                setattr(row, field, getattr(row, field) + delta)
+        UserStats.objects.bulk_update(stats, STATS_FIELDS)
+
+        SalesRollup.objects.bulk_create(
+            [SalesRollup(seller_id=seller_id, period=period, period_start=start) for seller_id, period, start in new_rollups],
+            ignore_conflicts=True,
+        )
+        candidates = SalesRollup.objects.select_for_update().filter(
+            seller_id__in={key[0] for key in rollups},
+            period_start__in={key[2] for key in rollups},
+        ).order_by('id')
+        changed = []
+        for row in candidates:
+            delta = rollups.get((row.seller_id, row.period, row.period_start))
+            if delta:
+                row.total += delta[0]
+                row.count += delta[1]
+                changed.append(row)
+        SalesRollup.objects.bulk_update(changed, ['total', 'count'])
+
+    @staticmethod
+    def for_user(user):
+        """
+        The user's UserStats, or an unsaved all-zero one.
+        """
+        return UserStats.objects.filter(user=user).first() or UserStats(user=user)
+
+    @staticmethod
+    def series(seller, period, length, today=None):
+        """
+        The last ``length`` days or months of the seller's sales, oldest
+        first, as dicts with ``start``, ``total``, ``count`` and ``height``
+        (percent of the busiest bucket, for bar charts). Buckets without
+        sales are filled with zeros.
+        """
+        today = today or timezone.localdate()
+        if period == SalesRollup.Period.DAY:
+            starts = [today - timedelta(days=offset) for offset in range(length - 1, -1, -1)]
+        else:
+            starts = []
+            month = today.replace(day=1)
+            for _ in range(length):
+                starts.insert(0, month)
+                month = (month - timedelta(days=1)).replace(day=1)
+
+        found = {
+            row.period_start: row
+            for row in SalesRollup.objects.filter(seller=seller, period=period, period_start__gte=starts[0])
+        }
+        peak = max((row.total for row in found.values()), default=ZERO)
+        series = []
+        for start in starts:
+            row = found.get(start)
+            total, count = (row.total, row.count) if row else (ZERO, 0)
+            series.append({
+                'start': start,
+                'total': total,
+                'count': count,
+                'height': int(total * 100 / peak) if peak > 0 else 0,
+            })
+        return series
+
+    @staticmethod
+    def computed(user_ids=None):
+        """
+        ``({user_id: [sales_total, sales_count, purchases_total,
+        purchases_count]}, {(seller_id, period, start): [total, count]})``
+        aggregated from Transaction.
+        """
+        paid = Transaction.objects.filter(status__in=PAID_STATUSES)
+        users = defaultdict(lambda: [ZERO, 0, ZERO, 0])
+        sales = paid if user_ids is None else paid.filter(seller_id__in=user_ids)
+        for seller_id, total, count in sales.values('seller_id').annotate(
+                total=Sum('amount'), count=Count('id')).values_list('seller_id', 'total', 'count'):
+            # SQLite sums decimals as floats
+            users[seller_id][0:2] = [Decimal(total).quantize(CENT), count]
+        purchases = paid if user_ids is None else paid.filter(buyer_id__in=user_ids)
+        for buyer_id, total, count in purchases.values('buyer_id').annotate(
+                total=Sum('amount'), count=Count('id')).values_list('buyer_id', 'total', 'count'):
+            users[buyer_id][2:4] = [Decimal(total).quantize(CENT), count]
+
+        rollups = {}
+        for period, trunc in ((SalesRollup.Period.DAY, TruncDay), (SalesRollup.Period.MONTH, TruncMonth)):
+            buckets = sales.annotate(start=trunc('transaction_date', output_field=DateField())).values(
+                'seller_id', 'start').annotate(total=Sum('amount'), count=Count('id'))
+            for row in buckets.values_list('seller_id', 'start', 'total', 'count'):
+                seller_id, start, total, count = row
+                rollups[seller_id, period, start] = [Decimal(total).quantize(CENT), count]
+        return users, rollups
+
+    @staticmethod
+    def reconcile(user_ids=None, batch_size=None):
+        """
+        Rewrites every UserStats and SalesRollup row that differs from
+        Transaction, creating and deleting rows as needed, for ``user_ids``
+        or for everyone. Users are reconciled ``batch_size`` at a time, each
+        batch in its own transaction, so only that batch's rows are locked
+        against sales being recorded. Returns the number of rows changed.
+        """
+        batch_size = batch_size or settings.DASHBOARD_RECONCILE_BATCH_SIZE
+        fixed = 0
+        if user_ids is not None:
+            user_ids = sorted(set(user_ids))
+            for start in range(0, len(user_ids), batch_size):
+                fixed += DashboardStats._reconcile_users(user_ids[start:start + batch_size])
+        else:
+            users = get_user_model().objects.order_by('pk').values_list('pk', flat=True)
+            last = None
+            while batch := list((users if last is None else users.filter(pk__gt=last))[:batch_size]):
+                fixed += DashboardStats._reconcile_users(batch)
+                last = batch[-1]
+        if fixed:
+            logger.info(f"Dashboard stats reconciled: {fixed} rows fixed")
+        return fixed
+
+    @staticmethod
+    @transaction.atomic
+    def _reconcile_users(user_ids):
+        stats = UserStats.objects.select_for_update().filter(user_id__in=user_ids).order_by('user_id')
+        rollups = SalesRollup.objects.select_for_update().filter(seller_id__in=user_ids).order_by('id')
+        # Locked first so no sale is recorded between reading and writing
+        stats = {row.user_id: row for row in stats}
+        rollups = {(row.seller_id, row.period, row.period_start): row for row in rollups}
+        expected_users, expected_rollups = DashboardStats.computed(user_ids)
+
+        changed_stats, created_stats = [], []
+        for user_id in stats.keys() | expected_users.keys():
+            values = expected_users.get(user_id, [ZERO, 0, ZERO, 0])
+            row = stats.get(user_id)
+            if row is None:
+                created_stats.append(UserStats(user_id=user_id, **dict(zip(STATS_FIELDS, values))))
+            elif [getattr(row, field) for field in STATS_FIELDS] != values:
+                for field, value in zip(STATS_FIELDS, values):
+                    setattr(row, field, value)
+                changed_stats.append(row)
+        UserStats.objects.bulk_update(changed_stats, STATS_FIELDS, batch_size=1000)
+        UserStats.objects.bulk_create(created_stats, batch_size=1000)
+
+        changed_rollups, created_rollups, stale = [], [], []
+        for key in rollups.keys() | expected_rollups.keys():
+            row = rollups.get(key)
+            if key not in expected_rollups:
+                stale.append(row.id)
+                continue
+            total, count = expected_rollups[key]
+            if row is None:
+                seller_id, period, start = key
+                created_rollups.append(SalesRollup(seller_id=seller_id, period=period, period_start=start, total=total, count=count))
+            elif (row.total, row.count) != (total, count):
+                row.total, row.count = total, count
+                changed_rollups.append(row)
+        SalesRollup.objects.bulk_update(changed_rollups, ['total', 'count'], batch_size=1000)
+        SalesRollup.objects.bulk_create(created_rollups, batch_size=1000)
+        SalesRollup.objects.filter(id__in=stale).delete()
+
+        return len(changed_stats) + len(created_stats) + len(changed_rollups) + len(created_rollups) + len(stale)
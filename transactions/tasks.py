@@ -0,0 +1,56 @@
+from celery import shared_task
+from .outbox import NotificationOutbox
+import logging
+
+logger = logging.getLogger(__name__)
+
+@shared_task
+def drain_notification_outbox():
+    """
+    Periodic task that delivers pending outbox emails and notifications.
+    """
+    count = 0
+    while True:
+        processed = NotificationOutbox.drain()
+        if not processed:
+            break
+        count += processed
+
+    return f"Delivered {count} outbox messages."
+
+
+@shared_task
+def settle_pending_transactions():
+    """
+    Periodic task that pays due PENDING transactions from the buyers' wallets.
+    """
+    from .settlement import Settlement
+
+    report = Settlement.run()
+    if report['batches']:
+        logger.info(f"Settlement report: {report}")
+    return (f"Settled {report['settled']} transactions, {report['failed']} failed, "
+            f"in {report['seconds']}s ({report['per_second']}/s).")
+
+
+@shared_task
+def reconcile_dashboard_stats():
+    """
+    Nightly task that rebuilds any UserStats or SalesRollup row that drifted
+    from the transactions.
+    """
+    from .stats import DashboardStats
+
+    fixed = DashboardStats.reconcile()
+    return f"Reconciled dashboard stats, {fixed} rows fixed."
+
+
+@shared_task
+def render_invoices(transaction_ids):
+    """
+    Renders and stores the invoice PDFs of paid transactions.
+    """
+    from .invoices import Invoices
+
+    rendered = Invoices.render_many(transaction_ids)
+    return f"Rendered {rendered} invoices."
@@ -1,3 +1,493 @@
-from django.test import TestCase
+import shutil
+import tempfile
+from datetime import timedelta
+from decimal import Decimal
+from unittest import mock
 
-# Create your tests here.
+from django.core import mail
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from users.ledger import WalletLedger
+from users.models import User, Wallet
+from users.ratings import rebuild_ratings
+from market import frontend_views
+from market.models import Category, Product
+from market.services import BidService
+from . import invoices
+from .invoices import Invoices
+from .models import Notification, OutboxMessage, Review, SalesRollup, Transaction, UserStats
+from .outbox import NotificationOutbox
+from .settlement import Settlement
+from .stats import DashboardStats
+
+
+class NotificationOutboxTests(TestCase):
+    def setUp(self):
+        self.seller = User.objects.create_user(username='seller', email='seller@example.com')
+        self.alice = User.objects.create_user(username='alice', email='alice@example.com')
+        self.bob = User.objects.create_user(username='bob', email='bob@example.com')
+        self.product = Product.objects.create(
+            seller=self.seller,
+            category=Category.objects.create(name='Art'),
+            title='Oil Painting',
+            description='Test listing',
+            condition='NEW',
+            location='Lima',
+            sales_type='AUCTION',
+            initial_price=Decimal('10.00'),
+        )
+
+    def test_outbid_is_queued_instead_of_sent(self):
+        BidService.place_bid(self.product, self.alice, Decimal('10.00'))
+        BidService.place_bid(self.product, self.bob, Decimal('11.00'))
+
+        self.assertEqual(len(mail.outbox), 0)
+        self.assertEqual(OutboxMessage.objects.filter(user=self.alice, kind='OUTBID').count(), 1)
+
+    def test_drain_coalesces_per_recipient(self):
+        for amount in range(11, 16):
+            NotificationOutbox.enqueue(NotificationOutbox.message(
+                self.alice,
+                'OUTBID',
+                subject=f"Outbid Alert: {self.product.title}",
+                body=f"The new highest bid is ${amount}.",
+                product=self.product,
+                notification_type='OUTBID',
+                notification_message='You have been outbid.',
+            ))
+
+        self.assertEqual(NotificationOutbox.drain(), 5)
+
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertIn("outbid 5 times", mail.outbox[0].body)
+        self.assertIn("$15", mail.outbox[0].body)
+        self.assertEqual(Notification.objects.filter(user=self.alice, type='OUTBID').count(), 1)
+        self.assertFalse(OutboxMessage.objects.exists())
+
+    @override_settings(NOTIFICATION_OUTBOX_MAX_ATTEMPTS=2)
+    def test_unsent_emails_are_kept_for_retry(self):
+        for user in (self.alice, self.bob):
+            NotificationOutbox.enqueue(NotificationOutbox.message(
+                user, 'OUTBID', subject='Outbid', body='Outbid.', product=self.product,
+                notification_type='OUTBID', notification_message='You have been outbid.',
+            ))
+        send = mail.backends.locmem.EmailBackend.send_messages
+
+        def alice_bounces(backend, messages):
+            if messages[0].to == [self.alice.email]:
+                raise ConnectionError('mail server gone')
+            return send(backend, messages)
+
+        with mock.patch.object(mail.backends.locmem.EmailBackend, 'send_messages', alice_bounces):
+            self.assertEqual(NotificationOutbox.drain(), 2)
+            self.assertEqual(NotificationOutbox.drain(), 0)
+
+        self.assertEqual([email.to for email in mail.outbox], [[self.bob.email]])
+        retry = OutboxMessage.objects.get()
+        self.assertEqual((retry.user, retry.send_attempts), (self.alice, 1))
+        self.assertGreater(retry.send_after, timezone.now())
+
+        OutboxMessage.objects.update(send_after=timezone.now())
+        self.assertEqual(NotificationOutbox.drain(), 1)
+
+        self.assertEqual([email.to for email in mail.outbox], [[self.bob.email], [self.alice.email]])
+        self.assertFalse(OutboxMessage.objects.exists())
+        # Notifications were created on the first pass only
+        self.assertEqual(Notification.objects.filter(type='OUTBID').count(), 2)
+
+    @override_settings(NOTIFICATION_OUTBOX_MAX_ATTEMPTS=1)
+    def test_emails_stop_after_max_attempts(self):
+        NotificationOutbox.enqueue(NotificationOutbox.message(self.alice, 'OUTBID', subject='Outbid', body='Outbid.'))
+
+        with mock.patch.object(mail.backends.locmem.EmailBackend, 'send_messages', side_effect=ConnectionError):
+            with self.assertLogs('transactions.outbox', 'ERROR'):
+                NotificationOutbox.drain()
+        OutboxMessage.objects.update(send_after=timezone.now())
+
+        self.assertEqual(NotificationOutbox.drain(), 0)
+        self.assertEqual(OutboxMessage.objects.get().send_attempts, 1)
+
+
+@override_settings(SETTLEMENT_MAX_ATTEMPTS=2)
+class SettlementTests(TestCase):
+    def setUp(self):
+        self.seller = User.objects.create_user(username='seller', email='seller@example.com')
+        self.buyers = [User.objects.create_user(username=f'buyer{i}', email=f'b{i}@example.com') for i in range(3)]
+        category = Category.objects.create(name='Art')
+        self.transactions = []
+        for i, buyer in enumerate(self.buyers):
+            product = Product.objects.create(
+                seller=self.seller, category=category, title=f'Lot {i}', description='Test listing',
+                condition='NEW', location='Lima', sales_type='AUCTION', initial_price=Decimal('10.00'),
+                is_active=False,
+            )
+            self.transactions.append(Transaction.objects.create(
+                buyer=buyer, seller=self.seller, product=product, amount=Decimal('40.00'),
+            ))
+        WalletLedger.deposit(self.buyers[0], Decimal('100.00'))
+        WalletLedger.deposit(self.buyers[2], Decimal('40.00'))
+
+    def test_batch_settles_what_it_can_and_keeps_going(self):
+        # Fixed per batch: 12 for the payments, 8 for the dashboard stats
+        with self.assertNumQueries(20):
+            self.assertEqual(Settlement.settle_batch(), (2, 1))
+
+        statuses = dict(Transaction.objects.values_list('buyer__username', 'status'))
+        self.assertEqual(statuses, {'buyer0': 'PAID', 'buyer1': 'PENDING', 'buyer2': 'PAID'})
+        balances = dict(Wallet.objects.values_list('user__username', 'balance'))
+        self.assertEqual(balances, {'seller': Decimal('80.00'), 'buyer0': Decimal('60.00'),
+                                    'buyer1': Decimal('0.00'), 'buyer2': Decimal('0.00')})
+        self.assertEqual(WalletLedger.drift(), {})
+        self.assertEqual(DashboardStats.reconcile(), 0)
+        self.assertEqual(Notification.objects.filter(type='PAYMENT_SETTLED').count(), 4)
+        self.assertEqual(Notification.objects.get(type='PAYMENT_FAILED').user, self.buyers[1])
+
+        # The failed row waits for its retry
+        self.assertEqual(Settlement.settle_batch(), (0, 0))
+
+    def test_failed_rows_are_retried_up_to_the_limit(self):
+        Settlement.run()
+        Transaction.objects.update(settle_after=None)
+        report = Settlement.run()
+
+        self.assertEqual((report['settled'], report['failed']), (0, 1))
+        failed = Transaction.objects.get(buyer=self.buyers[1])
+        self.assertEqual((failed.status, failed.settlement_attempts), ('PENDING', 2))
+        # Retries do not repeat the notice
+        self.assertEqual(Notification.objects.filter(type='PAYMENT_FAILED').count(), 1)
+
+        Transaction.objects.update(settle_after=None)
+        self.assertEqual(Settlement.run()['batches'], 0)
+
+    def checkout(self, buyer, txn):
+        self.client.force_login(buyer)
+        return self.client.post(reverse('checkout', args=[txn.product_id]))
+
+    def test_winner_checkout_settles_the_pending_transaction(self):
+        txn = self.transactions[0]
+        self.client.force_login(self.buyers[0])
+        self.assertContains(self.client.get(reverse('checkout', args=[txn.product_id])), '40.00')
+
+        self.assertRedirects(self.checkout(self.buyers[0], txn), reverse('order_success', args=[txn.id]),
+                             fetch_redirect_response=False)
+
+        txn.refresh_from_db()
+        self.assertEqual(txn.status, 'PAID')
+        self.assertEqual(Transaction.objects.filter(product_id=txn.product_id).count(), 1)
+        self.assertEqual(Settlement.settle_batch(), (1, 1))
+        self.assertEqual(Wallet.objects.get(user=self.buyers[0]).balance, Decimal('60.00'))
+        self.assertEqual(WalletLedger.drift(), {})
+
+    def test_checkout_racing_settlement_charges_once(self):
+        txn = self.transactions[0]
+        pay = frontend_views._pay_pending_transaction
+
+        def settled_first(request, transaction_id):
+            # The batch commits between the page's check and the row lock
+            Settlement.settle_batch()
+            return pay(request, transaction_id)
+
+        with mock.patch.object(frontend_views, '_pay_pending_transaction', settled_first):
+            response = self.checkout(self.buyers[0], txn)
+
+        self.assertRedirects(response, reverse('order_success', args=[txn.id]), fetch_redirect_response=False)
+        self.assertEqual(Transaction.objects.filter(product_id=txn.product_id).count(), 1)
+        self.assertEqual(Wallet.objects.get(user=self.buyers[0]).balance, Decimal('60.00'))
+        self.assertEqual(WalletLedger.drift(), {})
+
+        # Following the email link afterwards does not charge again either
+        self.assertRedirects(self.checkout(self.buyers[0], txn), reverse('order_success', args=[txn.id]),
+                             fetch_redirect_response=False)
+        self.assertEqual(Wallet.objects.get(user=self.buyers[0]).balance, Decimal('60.00'))
+
+    def test_checkout_is_refused_to_anyone_but_the_winner(self):
+        txn = self.transactions[0]
+        product_page = reverse('product_detail', args=[txn.product_id])
+
+        self.assertRedirects(self.checkout(self.buyers[2], txn), product_page, fetch_redirect_response=False)
+        Settlement.settle_batch()
+        self.assertRedirects(self.checkout(self.buyers[2], txn), product_page, fetch_redirect_response=False)
+
+        self.assertEqual(Wallet.objects.get(user=self.buyers[2]).balance, Decimal('0.00'))
+        self.assertEqual(Transaction.objects.filter(product_id=txn.product_id).count(), 1)
+
+
+class DirectPurchaseTests(TestCase):
+    def setUp(self):
+        self.seller = User.objects.create_user(username='seller', email='seller@example.com')
+        self.winner = User.objects.create_user(username='winner', email='winner@example.com')
+        self.buyer = User.objects.create_user(username='buyer', email='buyer@example.com')
+        self.product = Product.objects.create(
+            seller=self.seller, category=Category.objects.create(name='Art'), title='Lot', description='Test listing',
+            condition='NEW', location='Lima', sales_type='HYBRID', initial_price=Decimal('10.00'),
+            buy_now_price=Decimal('50.00'), auction_end_time=timezone.now() + timedelta(hours=1),
+        )
+        WalletLedger.deposit(self.buyer, Decimal('100.00'))
+        self.client.force_login(self.buyer)
+
+    def buy_now(self):
+        return self.client.post(reverse('product_detail', args=[self.product.pk]), {'action': 'buy_now'})
+
+    def test_buy_now_sells_the_item_once(self):
+        self.assertRedirects(self.buy_now(), reverse('home'), fetch_redirect_response=False)
+        self.assertRedirects(self.buy_now(), reverse('product_detail', args=[self.product.pk]),
+                             fetch_redirect_response=False)
+
+        self.assertEqual(Transaction.objects.filter(product=self.product).count(), 1)
+        self.assertEqual(Wallet.objects.get(user=self.buyer).balance, Decimal('50.00'))
+
+    def test_buy_now_is_refused_once_the_auction_has_a_winner(self):
+        # Closing committed between the page load and the purchase
+        Transaction.objects.create(buyer=self.winner, seller=self.seller, product=self.product, amount=Decimal('20.00'))
+
+        self.buy_now()
+        self.client.post(reverse('checkout', args=[self.product.pk]))
+
+        self.assertEqual(Transaction.objects.filter(product=self.product).count(), 1)
+        self.assertEqual(Wallet.objects.get(user=self.buyer).balance, Decimal('100.00'))
+
+    def test_checkout_rechecks_availability_under_the_lock(self):
+        lock_for_sale = frontend_views._lock_for_sale
+
+        def sold_meanwhile(product_id):
+            Product.objects.filter(pk=product_id).update(status='SOLD', is_active=False)
+            return lock_for_sale(product_id)
+
+        with mock.patch.object(frontend_views, '_lock_for_sale', sold_meanwhile):
+            response = self.client.post(reverse('checkout', args=[self.product.pk]))
+
+        self.assertRedirects(response, reverse('product_detail', args=[self.product.pk]), fetch_redirect_response=False)
+        self.assertFalse(Transaction.objects.exists())
+        self.assertEqual(Wallet.objects.get(user=self.buyer).balance, Decimal('100.00'))
+
+
+class SellerRatingTests(TestCase):
+    def setUp(self):
+        self.seller = User.objects.create_user(username='seller', email='seller@example.com')
+        self.buyer = User.objects.create_user(username='buyer', email='buyer@example.com')
+        self.product = Product.objects.create(
+            seller=self.seller,
+            category=Category.objects.create(name='Art'),
+            title='Oil Painting',
+            description='Test listing',
+            condition='NEW',
+            location='Lima',
+            sales_type='DIRECT',
+            initial_price=Decimal('10.00'),
+        )
+
+    def review(self, rating):
+        txn = Transaction.objects.create(buyer=self.buyer, seller=self.seller, product=self.product, amount=Decimal('10.00'))
+        return Review.objects.create(author=self.buyer, target_user=self.seller, transaction=txn, rating=rating, comment='ok')
+
+    def seller_totals(self):
+        seller = User.objects.get(pk=self.seller.pk)
+        return seller.rating_sum, seller.rating_count, seller.rating_average
+
+    def test_totals_follow_reviews(self):
+        self.assertEqual(self.seller_totals(), (0, 0, 0.0))
+        first = self.review(5)
+        self.review(4)
+        self.review(4)
+        self.assertEqual(self.seller_totals(), (13, 3, 4.3))
+
+        first.delete()
+        self.assertEqual(self.seller_totals(), (8, 2, 4.0))
+        self.assertEqual(rebuild_ratings(), 0)
+
+    def test_saving_a_stale_user_keeps_the_totals(self):
+        stale = User.objects.get(pk=self.seller.pk)
+        self.review(3)
+        stale.bio = 'Painter'
+        stale.save()
+
+        self.assertEqual(self.seller_totals(), (3, 1, 3.0))
+
+    def test_rebuild_repairs_drifted_totals(self):
+        self.review(5)
+        User.objects.filter(pk=self.seller.pk).update(rating_sum=40, rating_count=9)
+
+        self.assertEqual(rebuild_ratings(), 1)
+        self.assertEqual(self.seller_totals(), (5, 1, 5.0))
+
+    def test_catalog_card_shows_the_seller_rating(self):
+        self.review(5)
+        self.review(4)
+        response = self.client.get(reverse('catalog'))
+        self.assertContains(response, '<span>4.5</span>', html=False)
+
+
+class DashboardStatsTests(TestCase):
+    def setUp(self):
+        self.seller = User.objects.create_user(username='seller', email='seller@example.com')
+        self.buyer = User.objects.create_user(username='buyer', email='buyer@example.com')
+        self.product = Product.objects.create(
+            seller=self.seller,
+            category=Category.objects.create(name='Art'),
+            title='Oil Painting',
+            description='Test listing',
+            condition='NEW',
+            location='Lima',
+            sales_type='DIRECT',
+            initial_price=Decimal('10.00'),
+        )
+
+    def sale(self, amount, status='PAID'):
+        return Transaction.objects.create(
+            buyer=self.buyer, seller=self.seller, product=self.product, amount=Decimal(amount), status=status,
+        )
+
+    def totals(self, user):
+        stats = DashboardStats.for_user(user)
+        return stats.sales_total, stats.sales_count, stats.purchases_total, stats.purchases_count
+
+    def test_stats_follow_status_changes(self):
+        self.sale('25.00')
+        pending = self.sale('10.00', status='PENDING')
+        self.assertEqual(self.totals(self.seller), (Decimal('25.00'), 1, Decimal('0.00'), 0))
+
+        pending = Transaction.objects.get(pk=pending.pk)
+        pending.status = 'PAID'
+        pending.save()
+        self.assertEqual(self.totals(self.seller), (Decimal('35.00'), 2, Decimal('0.00'), 0))
+        self.assertEqual(self.totals(self.buyer), (Decimal('0.00'), 0, Decimal('35.00'), 2))
+
+        pending.status = 'CANCELLED'
+        pending.save()
+        Transaction.objects.get(amount=Decimal('25.00')).delete()
+        self.assertEqual(self.totals(self.seller), (Decimal('0.00'), 0, Decimal('0.00'), 0))
+        # Partially loaded rows fall back to recounting the users
+        txn = Transaction.objects.only('id', 'status').get(pk=pending.pk)
+        txn.status = 'DELIVERED'
+        txn.save()
+        self.assertEqual(self.totals(self.seller), (Decimal('10.00'), 1, Decimal('0.00'), 0))
+        self.assertEqual(DashboardStats.reconcile(), 0)
+
+    def test_rollups_bucket_sales_by_day_and_month(self):
+        self.sale('25.00')
+        self.sale('5.50')
+        today = timezone.localdate()
+
+        daily = DashboardStats.series(self.seller, SalesRollup.Period.DAY, 30)
+        self.assertEqual(len(daily), 30)
+        self.assertEqual((daily[-1]['start'], daily[-1]['total'], daily[-1]['count']), (today, Decimal('30.50'), 2))
+        self.assertEqual(daily[-1]['height'], 100)
+        monthly = DashboardStats.series(self.seller, SalesRollup.Period.MONTH, 12)
+        self.assertEqual(monthly[-1]['start'], today.replace(day=1))
+        self.assertEqual(monthly[-2]['start'], (today.replace(day=1) - timedelta(days=1)).replace(day=1))
+
+    def test_reconcile_repairs_drift(self):
+        self.sale('25.00')
+        UserStats.objects.filter(user=self.seller).update(sales_total=Decimal('999.00'))
+        SalesRollup.objects.filter(period=SalesRollup.Period.DAY).delete()
+        SalesRollup.objects.create(seller=self.buyer, period=SalesRollup.Period.DAY, period_start=timezone.localdate(), total=1, count=1)
+
+        self.assertEqual(DashboardStats.reconcile(), 3)
+        self.assertEqual(self.totals(self.seller), (Decimal('25.00'), 1, Decimal('0.00'), 0))
+        self.assertEqual(
+            list(SalesRollup.objects.values_list('seller__username', 'period', 'total')),
+            [('seller', 'MONTH', Decimal('25.00')), ('seller', 'DAY', Decimal('25.00'))],
+        )
+        self.assertEqual(DashboardStats.reconcile(), 0)
+
+    def test_reconcile_locks_one_batch_of_users_at_a_time(self):
+        self.sale('25.00')
+        UserStats.objects.update(sales_total=Decimal('999.00'), purchases_total=Decimal('999.00'))
+        reconcile_users = DashboardStats._reconcile_users
+
+        with mock.patch.object(DashboardStats, '_reconcile_users', side_effect=reconcile_users) as batches:
+            self.assertEqual(DashboardStats.reconcile(batch_size=1), 2)
+
+        self.assertEqual([call.args[0] for call in batches.call_args_list], [[self.seller.pk], [self.buyer.pk]])
+        self.assertEqual(self.totals(self.seller), (Decimal('25.00'), 1, Decimal('0.00'), 0))
+        self.assertEqual(self.totals(self.buyer), (Decimal('0.00'), 0, Decimal('25.00'), 1))
+
+    def test_dashboard_query_budget_does_not_grow_with_history(self):
+        for _ in range(20):
+            self.sale('5.00')
+        self.client.force_login(self.seller)
+        # session + user, stats, active count, recent sales, the two chart
+        # series, active listings + images, purchases + images, reviews + images
+        with self.assertNumQueries(13):
+            response = self.client.get(reverse('dashboard'))
+        self.assertEqual(response.context['total_sales'], Decimal('100.00'))
+        self.assertEqual(response.context['sold_count'], 20)
+
+
+class InvoiceTests(TestCase):
+    def setUp(self):
+        media = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media)
+        override = override_settings(MEDIA_ROOT=media)
+        override.enable()
+        self.addCleanup(override.disable)
+
+        self.seller = User.objects.create_user(username='seller', email='seller@example.com')
+        self.buyer = User.objects.create_user(username='buyer', email='buyer@example.com')
+        product = Product.objects.create(
+            seller=self.seller,
+            category=Category.objects.create(name='Art'),
+            title='Oil Painting',
+            description='Test listing',
+            condition='NEW',
+            location='Lima',
+            sales_type='DIRECT',
+            initial_price=Decimal('10.00'),
+        )
+        with self.captureOnCommitCallbacks() as callbacks:
+            self.txn = Transaction.objects.create(
+                buyer=self.buyer, seller=self.seller, product=product, amount=Decimal('10.00'), status='PAID',
+            )
+        self.queued = len(callbacks)
+        self.url = reverse('download_invoice', args=[self.txn.id])
+        self.client.force_login(self.buyer)
+
+    def test_paid_transaction_is_rendered_once(self):
+        self.assertEqual(self.queued, 1)
+        self.assertEqual(Invoices.render_many([self.txn.id]), 1)
+        self.assertEqual(Invoices.render_many([self.txn.id]), 0)
+
+        with mock.patch('transactions.invoices.render_to_pdf') as render:
+            response = self.client.get(self.url)
+            body = b''.join(response.streaming_content)
+        render.assert_not_called()
+        self.assertEqual(response['Content-Type'], 'application/pdf')
+        self.assertTrue(body.startswith(b'%PDF'))
+        self.assertEqual(response['Content-Length'], str(len(body)))
+
+    def test_etag_and_ranges(self):
+        response = self.client.get(self.url)
+        body = b''.join(response.streaming_content)
+        etag = response['ETag']
+
+        self.assertEqual(self.client.get(self.url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+        partial = self.client.get(self.url, HTTP_RANGE='bytes=0-99')
+        self.assertEqual(partial.status_code, 206)
+        self.assertEqual(partial['Content-Range'], f'bytes 0-99/{len(body)}')
+        self.assertEqual(b''.join(partial.streaming_content), body[:100])
+
+        tail = self.client.get(self.url, HTTP_RANGE='bytes=-10', HTTP_IF_RANGE=etag)
+        self.assertEqual(b''.join(tail.streaming_content), body[-10:])
+        # A changed file ignores the range and sends everything
+        stale = self.client.get(self.url, HTTP_RANGE='bytes=0-9', HTTP_IF_RANGE='"old"')
+        self.assertEqual(stale.status_code, 200)
+
+        self.assertEqual(self.client.get(self.url, HTTP_RANGE=f'bytes={len(body)}-').status_code, 416)
+
+    def test_template_change_renders_again(self):
+        Invoices.render_many([self.txn.id])
+        first = Transaction.objects.get(pk=self.txn.pk).invoice_file.name
+
+        with mock.patch.object(invoices, '_version', 'newtemplate'):
+            response = self.client.get(self.url)
+            self.assertEqual(response['ETag'], f'"invoice-{self.txn.id}-newtemplate"')
+        txn = Transaction.objects.get(pk=self.txn.pk)
+        self.assertNotEqual(txn.invoice_file.name, first)
+        self.assertFalse(txn.invoice_file.storage.exists(first))
+
+    def test_only_buyer_and_seller_can_download(self):
+        self.client.force_login(User.objects.create_user(username='other', email='other@example.com'))
+        self.assertEqual(self.client.get(self.url).status_code, 401)
@@ -20,19 +20,25 @@ class NotificationViewSet(viewsets.ReadOnlyModelViewSet):
 
 from django.http import HttpResponse
 from django.shortcuts import get_object_or_404
-from .services import render_to_pdf
+from nexus_core.http import serve_file
+from .invoices import InvoiceError, Invoices
 
 def download_invoice(request, transaction_id):
-    transaction = get_object_or_404(Transaction, pk=transaction_id)
+    transaction = get_object_or_404(Transaction.objects.select_related('buyer', 'seller', 'product'), pk=transaction_id)
     # Security: Only buyer or seller can download
     if request.user != transaction.buyer and request.user != transaction.seller:
         return HttpResponse("Unauthorized", status=401)
-        
-    pdf = render_to_pdf('transactions/invoice.html', {'transaction': transaction})
-    if pdf:
-        response = HttpResponse(pdf, content_type='application/pdf')
-        filename = f"Invoice_{transaction.id}.pdf"
-        content = f"attachment; filename={filename}"
-        response['Content-Disposition'] = content
-        return response
-    return HttpResponse("Not Found", status=404)
+
+    # Normally pre-rendered when the sale was paid; rendered here once if
+    # the task has not run yet or the template changed since
+    if not Invoices.is_current(transaction):
+        try:
+            Invoices.store(transaction)
+        except InvoiceError:
+            return HttpResponse("Not Found", status=404)
+
+    invoice = transaction.invoice_file
+    return serve_file(
+        request, invoice.storage, invoice.name, Invoices.etag(transaction), 'application/pdf',
+        filename=f"Invoice_{transaction.id}.pdf", private=True, no_cache=True,
+    )
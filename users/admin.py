@@ -1,6 +1,6 @@
 from django.contrib import admin
 from django.contrib.auth.admin import UserAdmin
-from .models import User, Address
+from .models import User, Address, LedgerEntry
 
 class CustomUserAdmin(UserAdmin):
     model = User
@@ -15,4 +15,20 @@ class AddressAdmin(admin.ModelAdmin):
     list_display = ['user', 'city', 'country', 'is_default']
     search_fields = ['user__username', 'street', 'city']
 
+@admin.register(LedgerEntry)
+class LedgerEntryAdmin(admin.ModelAdmin):
+    list_display = ['created_at', 'user', 'kind', 'amount', 'reference']
+    list_filter = ['kind']
+    search_fields = ['user__username', 'reference']
+
+    # Append-only: corrections are new entries written through WalletLedger
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        return False
+
 admin.site.register(User, CustomUserAdmin)
@@ -0,0 +1,72 @@
+"""
+Per-user values shown in the header of every page: the unread notification
+count and the wallet balance.
+
+Reads go to the cache and only fall back to the database on a miss. The
+write paths keep the entries current: new notifications increment the
+count, anything else that can change it (marking read, deleting) drops the
+key, and wallet saves drop the cached balance. Updates run once the
+surrounding transaction commits, so a rollback never leaves a wrong value
+behind.
+"""
+from decimal import Decimal
+
+from django.core.cache import cache
+from django.db import transaction
+
+# Upper bound on how long a value that missed an update can stay wrong
+TIMEOUT = 300
+
+
+def _unread_key(user_id):
+    return f'user:{user_id}:unread_notifications'
+
+
+def _balance_key(user_id):
+    return f'user:{user_id}:wallet_balance'
+
+
+def unread_notifications_count(user_id):
+    key = _unread_key(user_id)
+    count = cache.get(key)
+    if count is None:
+        from transactions.models import Notification
+        count = Notification.objects.filter(user_id=user_id, read=False).count()
+        cache.add(key, count, TIMEOUT)
+    return count
+
+
+def wallet_balance(user_id):
+    key = _balance_key(user_id)
+    balance = cache.get(key)
+    if balance is None:
+        from .models import Wallet
+        balance = Wallet.objects.filter(user_id=user_id).values_list('balance', flat=True).first()
+        if balance is None:
+            balance = Decimal('0.00')
+        cache.add(key, balance, TIMEOUT)
+    return balance
+
+
+def notifications_added(counts):
+    """
+    Adds newly created unread notifications to the cached counts.
+    ``counts`` maps user id to the number of notifications created.
+    """
+    def apply():
+        for user_id, count in counts.items():
+            try:
+                cache.incr(_unread_key(user_id), count)
+            except ValueError:
+                # Not cached, the next read counts from the database
+                pass
+
+    transaction.on_commit(apply)
+
+
+def invalidate_unread_notifications(user_id):
+    transaction.on_commit(lambda: cache.delete(_unread_key(user_id)))
+
+
+def invalidate_wallet_balance(user_id):
+    transaction.on_commit(lambda: cache.delete(_balance_key(user_id)))
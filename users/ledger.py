@@ -0,0 +1,178 @@
+"""
+Wallet balance changes.
+
+Every movement of money between wallets goes through ``WalletLedger``.
+Balances are changed with single conditional UPDATE statements
+(``balance = balance - x WHERE balance >= x``), so concurrent purchases and
+deposits can neither lose an update nor overdraw a wallet, without reading
+the balance into Python or taking a SELECT ... FOR UPDATE first. Each
+transfer also appends its debit and credit to the LedgerEntry journal in
+the same transaction; ``rebuild_balances`` recomputes wallets from it.
+"""
+import uuid
+from decimal import Decimal
+
+from django.core.exceptions import ValidationError
+from django.db import transaction
+from django.db.models import F, Sum
+
+from nexus_core.money import Money
+from .cache import invalidate_wallet_balance
+from .models import LedgerEntry, Wallet
+
+
+CENT = Decimal('0.01')
+
+
+class InsufficientFunds(ValidationError):
+    pass
+
+
+class WalletLedger:
+    @staticmethod
+    def _credit(user_id, amount):
+        if not Wallet.objects.filter(user_id=user_id).update(balance=F('balance') + amount):
+            # Users created before wallets existed
+            Wallet.objects.get_or_create(user_id=user_id)
+            Wallet.objects.filter(user_id=user_id).update(balance=F('balance') + amount)
+
+    @staticmethod
+    def _debit(user_id, amount):
+        if not Wallet.objects.filter(user_id=user_id, balance__gte=amount).update(balance=F('balance') - amount):
+            raise InsufficientFunds("Insufficient funds.")
+
+    @staticmethod
+    @transaction.atomic
+    def deposit(user, amount, kind=LedgerEntry.Kind.DEPOSIT, reference=''):
+        """
+        Credits ``amount`` from outside the platform (PayPal, gift cards).
+        Returns the transfer id.
+        """
+        amount = Money.parse(amount).decimal
+        transfer_id = uuid.uuid4()
+        WalletLedger._credit(user.pk, amount)
+        LedgerEntry.objects.create(user_id=user.pk, amount=amount, kind=kind, transfer_id=transfer_id, reference=reference)
+        invalidate_wallet_balance(user.pk)
+        return transfer_id
+
+    @staticmethod
+    @transaction.atomic
+    def transfer(payer, payee, amount, reference='',
+                 debit_kind=LedgerEntry.Kind.PURCHASE, credit_kind=LedgerEntry.Kind.SALE):
+        """
+        Moves ``amount`` from the payer's wallet to the payee's, or raises
+        InsufficientFunds and changes nothing. Returns the transfer id.
+        """
+        amount = Money.parse(amount).decimal
+        transfer_id = uuid.uuid4()
+        # Rows are always updated in user id order so two opposite
+        # transfers cannot deadlock
+        for user_id in sorted({payer.pk, payee.pk}):
+            if user_id == payer.pk:
+                WalletLedger._debit(payer.pk, amount)
+            if user_id == payee.pk:
+                WalletLedger._credit(payee.pk, amount)
+        LedgerEntry.objects.bulk_create([
+            LedgerEntry(user_id=payer.pk, amount=-amount, kind=debit_kind, transfer_id=transfer_id, reference=reference),
+            LedgerEntry(user_id=payee.pk, amount=amount, kind=credit_kind, transfer_id=transfer_id, reference=reference),
+        ])
+        invalidate_wallet_balance(payer.pk)
+        invalidate_wallet_balance(payee.pk)
+        return transfer_id
+
+    @staticmethod
+    @transaction.atomic
+    def transfer_many(transfers, debit_kind=LedgerEntry.Kind.PURCHASE, credit_kind=LedgerEntry.Kind.SALE):
+        """
+        Applies ``(payer_id, payee_id, amount, reference)`` transfers in
+        order with a fixed number of statements, however many there are.
+        A transfer its payer cannot cover at that point is skipped and the
+        rest still go through. Returns one boolean per transfer, True when
+        it was applied.
+        """
+        transfers = [(payer_id, payee_id, Money.parse(amount).decimal, reference)
+                     for payer_id, payee_id, amount, reference in transfers]
+        user_ids = {payer_id for payer_id, _, _, _ in transfers} | {payee_id for _, payee_id, _, _ in transfers}
+        Wallet.objects.bulk_create([Wallet(user_id=user_id) for user_id in user_ids], ignore_conflicts=True)
+        # Locked in user id order, the same order transfer() uses
+        wallets = {
+            wallet.user_id: wallet
+            for wallet in Wallet.objects.select_for_update().filter(user_id__in=user_ids).order_by('user_id')
+        }
+
+        applied = []
+        entries = []
+        for payer_id, payee_id, amount, reference in transfers:
+            payer, payee = wallets[payer_id], wallets[payee_id]
+            if payer.balance < amount:
+                applied.append(False)
+                continue
+            payer.balance -= amount
+            payee.balance += amount
+            transfer_id = uuid.uuid4()
+            entries.append(LedgerEntry(user_id=payer_id, amount=-amount, kind=debit_kind,
+                                       transfer_id=transfer_id, reference=reference))
+            entries.append(LedgerEntry(user_id=payee_id, amount=amount, kind=credit_kind,
+                                       transfer_id=transfer_id, reference=reference))
+            applied.append(True)
+
+        # The rows are locked, so writing the computed balances is safe
+        changed = {entry.user_id for entry in entries}
+        Wallet.objects.bulk_update([wallets[user_id] for user_id in changed], ['balance'])
+        LedgerEntry.objects.bulk_create(entries)
+        for user_id in changed:
+            invalidate_wallet_balance(user_id)
+        return applied
+
+    @staticmethod
+    def journal_balances(user_ids=None):
+        """
+        ``{user_id: balance}`` summed from the journal.
+        """
+        entries = LedgerEntry.objects.all()
+        if user_ids is not None:
+            entries = entries.filter(user_id__in=user_ids)
+        totals = entries.values('user_id').annotate(total=Sum('amount')).values_list('user_id', 'total')
+        # SQLite sums decimals as floats
+        return {user_id: total.quantize(CENT) for user_id, total in totals}
+
+    @staticmethod
+    def drift(user_ids=None):
+        """
+        ``{user_id: (wallet balance, journal balance)}`` for every wallet
+        that disagrees with its journal.
+        """
+        journal = WalletLedger.journal_balances(user_ids)
+        wallets = Wallet.objects.all()
+        if user_ids is not None:
+            wallets = wallets.filter(user_id__in=user_ids)
+        return {
+            user_id: (balance, journal.get(user_id, Decimal('0.00')))
+            for user_id, balance in wallets.values_list('user_id', 'balance')
+            if balance != journal.get(user_id, Decimal('0.00'))
+        }
+
+    @staticmethod
+    @transaction.atomic
+    def rebuild_balances(user_ids=None):
+        """
+        Resets wallets that drifted from their journal to the journal
+        balance. Returns the number of wallets changed.
+        """
+        wallets = Wallet.objects.select_for_update()
+        if user_ids is not None:
+            wallets = wallets.filter(user_id__in=user_ids)
+        # Locked first so no transfer lands between reading and writing
+        wallets = list(wallets)
+        journal = WalletLedger.journal_balances(user_ids)
+
+        changed = []
+        for wallet in wallets:
+            balance = journal.get(wallet.user_id, Decimal('0.00'))
+            if wallet.balance != balance:
+                wallet.balance = balance
+                changed.append(wallet)
+        Wallet.objects.bulk_update(changed, ['balance'])
+        for wallet in changed:
+            invalidate_wallet_balance(wallet.user_id)
+        return len(changed)
@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+from users.ratings import rebuild_ratings
+
+
+class Command(BaseCommand):
+    help = 'Recomputes the stored seller rating totals from the reviews (backfill and repair).'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', type=int, action='append', help='Only these user ids (repeatable).')
+
+    def handle(self, *args, **options):
+        changed = rebuild_ratings(options['user'])
+        self.stdout.write(self.style.SUCCESS(f"Updated the rating totals of {changed} users."))
@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand, CommandError
+from users.ledger import WalletLedger
+
+
+class Command(BaseCommand):
+    help = 'Compares every wallet with the sum of its ledger entries and resets the ones that drifted.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', type=int, action='append', help='Only these user ids (repeatable).')
+        parser.add_argument('--check', action='store_true', help='Report drift and fail instead of fixing it.')
+
+    def handle(self, *args, **options):
+        user_ids = options['user']
+        drifted = WalletLedger.drift(user_ids)
+        for user_id, (balance, journal) in sorted(drifted.items()):
+            self.stdout.write(f"User {user_id}: wallet {balance}, ledger {journal}")
+
+        if options['check']:
+            if drifted:
+                raise CommandError(f"{len(drifted)} wallets differ from the ledger.")
+            self.stdout.write(self.style.SUCCESS("All wallets match the ledger."))
+            return
+
+        changed = WalletLedger.rebuild_balances(user_ids)
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt {changed} wallet balances from the ledger."))
@@ -0,0 +1,48 @@
+# Generated by Django 5.2.18 on 2026-10-17 21:19
+
+import uuid
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+def open_balances(apps, schema_editor):
+    # Balances from before the journal become its first entry, so summing
+    # the journal reproduces every wallet
+    Wallet = apps.get_model('users', 'Wallet')
+    LedgerEntry = apps.get_model('users', 'LedgerEntry')
+    LedgerEntry.objects.bulk_create(
+        (
+            LedgerEntry(user_id=user_id, amount=balance, kind='OPENING', transfer_id=uuid.uuid4(), reference='migration')
+            for user_id, balance in Wallet.objects.exclude(balance=0).values_list('user_id', 'balance').iterator()
+        ),
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0002_remove_user_credits_wallet'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LedgerEntry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('amount', models.DecimalField(decimal_places=2, max_digits=12)),
+                ('kind', models.CharField(choices=[('OPENING', 'Opening Balance'), ('DEPOSIT', 'Deposit'), ('PURCHASE', 'Purchase'), ('SALE', 'Sale'), ('REFUND', 'Refund'), ('ADJUSTMENT', 'Adjustment')], max_length=20)),
+                ('transfer_id', models.UUIDField(db_index=True)),
+                ('reference', models.CharField(blank=True, max_length=100)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='ledger_entries', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name_plural': 'Ledger entries',
+                'indexes': [models.Index(fields=['user', 'created_at'], name='users_ledge_user_id_7d8367_idx')],
+            },
+        ),
+        migrations.RunPython(open_balances, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 5.2.18 on 2026-10-17 21:24
+
+from django.db import migrations, models
+from django.db.models import Count, Sum
+
+
+def backfill_ratings(apps, schema_editor):
+    User = apps.get_model('users', 'User')
+    Review = apps.get_model('transactions', 'Review')
+    totals = Review.objects.values('target_user_id').annotate(total=Sum('rating'), count=Count('id'))
+    users = [User(id=row['target_user_id'], rating_sum=row['total'], rating_count=row['count']) for row in totals]
+    User.objects.bulk_update(users, ['rating_sum', 'rating_count'], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0003_wallet_ledger'),
+        ('transactions', '0002_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='user',
+            name='rating_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='user',
+            name='rating_sum',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(backfill_ratings, migrations.RunPython.noop),
+    ]
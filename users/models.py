@@ -12,15 +12,31 @@ class User(AbstractUser):
     profile_picture = models.ImageField(upload_to='profiles/', blank=True, null=True)
     bio = models.TextField(blank=True, null=True)
     is_verified = models.BooleanField(default=False)
+    # Totals of the reviews received, kept current by users/ratings.py
+    rating_sum = models.PositiveIntegerField(default=0)
+    rating_count = models.PositiveIntegerField(default=0)
 
     @property
     def rating_average(self):
-        # Todo: Calculate from Reviews
-        return 0.0
+        if not self.rating_count:
+            return 0.0
+        return round(self.rating_sum / self.rating_count, 1)
+
+    def save(self, *args, **kwargs):
+        # The rating totals are only changed with F() updates; saving a user
+        # loaded earlier (profile edits, admin) must not write them back
+        if not self._state.adding and kwargs.get('update_fields') is None:
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and field.name not in RATING_FIELDS
+            ]
+        super().save(*args, **kwargs)
 
     def __str__(self):
         return self.username
 
+RATING_FIELDS = ('rating_sum', 'rating_count')
+
 class Address(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='addresses')
     street = models.CharField(max_length=255)
@@ -46,6 +62,43 @@ class Wallet(models.Model):
     def __str__(self):
         return f"{self.user.username}'s Wallet: ${self.balance}"
 
+class LedgerEntry(models.Model):
+    """
+    Append-only journal of wallet movements written by WalletLedger
+    (users/ledger.py). Each wallet's balance is the sum of its entries.
+    """
+    class Kind(models.TextChoices):
+        OPENING = 'OPENING', 'Opening Balance'
+        DEPOSIT = 'DEPOSIT', 'Deposit'
+        PURCHASE = 'PURCHASE', 'Purchase'
+        SALE = 'SALE', 'Sale'
+        REFUND = 'REFUND', 'Refund'
+        ADJUSTMENT = 'ADJUSTMENT', 'Adjustment'
+
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='ledger_entries')
+    # Signed: credits are positive, debits negative
+    amount = models.DecimalField(max_digits=12, decimal_places=2)
+    kind = models.CharField(max_length=20, choices=Kind.choices)
+    # Shared by the debit and credit of one transfer
+    transfer_id = models.UUIDField(db_index=True)
+    # What caused the movement, e.g. "transaction:12" or "paypal:<order id>"
+    reference = models.CharField(max_length=100, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        verbose_name_plural = "Ledger entries"
+        indexes = [
+            models.Index(fields=['user', 'created_at']),
+        ]
+
+    def save(self, *args, **kwargs):
+        if not self._state.adding:
+            raise ValueError("Ledger entries are append-only.")
+        super().save(*args, **kwargs)
+
+    def __str__(self):
+        return f"{self.kind} {self.amount} for {self.user_id}"
+
 # Signal to create wallet
 from django.db.models.signals import post_save
 from django.dispatch import receiver
@@ -57,7 +110,12 @@ def create_user_wallet(sender, instance, created, **kwargs):
 
 @receiver(post_save, sender=User)
 def save_user_wallet(sender, instance, **kwargs):
-    try:
-        instance.wallet.save()
-    except Wallet.DoesNotExist:
-        Wallet.objects.create(user=instance)
+    # Only make sure it exists: saving the instance cached on the user would
+    # write back a stale balance over the ledger's updates
+    if not hasattr(instance, 'wallet'):
+        Wallet.objects.get_or_create(user=instance)
+
+@receiver(post_save, sender=Wallet)
+def invalidate_cached_balance(sender, instance, **kwargs):
+    from .cache import invalidate_wallet_balance
+    invalidate_wallet_balance(instance.user_id)
@@ -0,0 +1,63 @@
+"""
+Seller rating totals.
+
+Every user carries ``rating_sum`` and ``rating_count`` for the reviews they
+received, so ``User.rating_average`` and the listing cards read the rating
+from the user row instead of aggregating Review on each view. Review
+signals adjust the totals with F() updates as reviews are written and
+deleted; ``rebuild_ratings`` recomputes them from the Review table.
+"""
+from django.db import transaction
+from django.db.models import Count, F, Sum
+
+from .models import User
+
+
+def review_added(user_id, rating):
+    User.objects.filter(pk=user_id).update(
+        rating_sum=F('rating_sum') + rating,
+        rating_count=F('rating_count') + 1,
+    )
+
+
+def review_removed(user_id, rating):
+    User.objects.filter(pk=user_id, rating_count__gt=0).update(
+        rating_sum=F('rating_sum') - rating,
+        rating_count=F('rating_count') - 1,
+    )
+
+
+def review_totals(user_ids=None):
+    """
+    ``{user_id: (rating_sum, rating_count)}`` aggregated from the reviews.
+    """
+    from transactions.models import Review
+
+    reviews = Review.objects.all()
+    if user_ids is not None:
+        reviews = reviews.filter(target_user_id__in=user_ids)
+    totals = reviews.values('target_user_id').annotate(total=Sum('rating'), count=Count('id'))
+    return {row['target_user_id']: (row['total'], row['count']) for row in totals}
+
+
+@transaction.atomic
+def rebuild_ratings(user_ids=None):
+    """
+    Resets users whose totals differ from their reviews. Returns the number
+    of users changed.
+    """
+    users = User.objects.select_for_update().only('id', 'rating_sum', 'rating_count')
+    if user_ids is not None:
+        users = users.filter(pk__in=user_ids)
+    # Locked first so no review lands between reading and writing
+    users = list(users)
+    totals = review_totals(user_ids)
+
+    changed = []
+    for user in users:
+        rating_sum, rating_count = totals.get(user.pk, (0, 0))
+        if (user.rating_sum, user.rating_count) != (rating_sum, rating_count):
+            user.rating_sum, user.rating_count = rating_sum, rating_count
+            changed.append(user)
+    User.objects.bulk_update(changed, ['rating_sum', 'rating_count'], batch_size=1000)
+    return len(changed)
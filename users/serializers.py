@@ -13,9 +13,18 @@ class UserSerializer(serializers.ModelSerializer):
     
     class Meta:
         model = User
-        fields = ['id', 'username', 'email', 'first_name', 'last_name', 'role', 'wallet_balance', 'title', 'bio', 'is_verified', 'addresses']
+        fields = ['id', 'username', 'email', 'first_name', 'last_name', 'role', 'wallet_balance', 'bio', 'is_verified', 'addresses']
         read_only_fields = ['wallet_balance', 'is_verified']
 
+class UserSummarySerializer(serializers.ModelSerializer):
+    """
+    Public view of a user for embedding in other resources (no addresses or
+    wallet, no extra queries).
+    """
+    class Meta:
+        model = User
+        fields = ['id', 'username', 'is_verified', 'rating_average', 'rating_count']
+
 class RegisterSerializer(serializers.ModelSerializer):
     password = serializers.CharField(write_only=True)
 
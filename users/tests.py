@@ -1,3 +1,162 @@
-from django.test import TestCase
+import random
+import threading
+import time
+from decimal import Decimal
 
-# Create your tests here.
+from django.core.cache import cache
+from django.db import OperationalError, connection
+from django.test import RequestFactory, TestCase, TransactionTestCase
+
+from nexus_core.context_processors import global_context
+from transactions.models import Notification, OutboxMessage
+from transactions.outbox import NotificationOutbox
+from . import cache as user_cache
+from .ledger import InsufficientFunds, WalletLedger
+from .models import LedgerEntry, User, Wallet
+
+
+class GlobalContextCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='alice', email='alice@example.com')
+        request = RequestFactory().get('/')
+        request.user = self.user
+        self.request = request
+
+    def header_values(self):
+        context = global_context(self.request)
+        return int(context['unread_notifications_count']), Decimal(str(context['wallet_balance']))
+
+    def test_values_are_lazy_and_cached(self):
+        with self.assertNumQueries(0):
+            global_context(self.request)
+
+        with self.assertNumQueries(2):
+            self.assertEqual(self.header_values(), (0, Decimal('0.00')))
+        with self.assertNumQueries(0):
+            self.assertEqual(self.header_values(), (0, Decimal('0.00')))
+
+    def test_new_notifications_update_the_cached_count(self):
+        self.header_values()
+        with self.captureOnCommitCallbacks(execute=True):
+            Notification.objects.create(user=self.user, type='OUTBID', message='Outbid')
+        with self.assertNumQueries(0):
+            self.assertEqual(self.header_values()[0], 1)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            NotificationOutbox.enqueue(NotificationOutbox.message(
+                self.user, 'AUCTION_WON', 'Won', 'You won',
+                notification_type='AUCTION_WON', notification_message='You won',
+            ))
+            NotificationOutbox.drain()
+        self.assertFalse(OutboxMessage.objects.exists())
+        with self.assertNumQueries(0):
+            self.assertEqual(self.header_values()[0], 2)
+
+    def test_marking_read_and_wallet_saves_invalidate(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            notification = Notification.objects.create(user=self.user, type='OUTBID', message='Outbid')
+        self.assertEqual(self.header_values(), (1, Decimal('0.00')))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            notification.read = True
+            notification.save()
+            wallet = Wallet.objects.get(user=self.user)
+            wallet.balance += Decimal('25.50')
+            wallet.save()
+        self.assertEqual(self.header_values(), (0, Decimal('25.50')))
+
+
+class WalletLedgerTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.alice = User.objects.create_user(username='alice', email='alice@example.com')
+        self.bob = User.objects.create_user(username='bob', email='bob@example.com')
+        WalletLedger.deposit(self.alice, Decimal('50.00'))
+
+    def balances(self):
+        return dict(Wallet.objects.values_list('user__username', 'balance'))
+
+    def test_transfer_updates_both_wallets_and_the_journal(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            WalletLedger.transfer(self.alice, self.bob, '20.25', reference='transaction:1')
+
+        self.assertEqual(self.balances(), {'alice': Decimal('29.75'), 'bob': Decimal('20.25')})
+        self.assertEqual(
+            list(LedgerEntry.objects.filter(reference='transaction:1').values_list('user__username', 'amount', 'kind')),
+            [('alice', Decimal('-20.25'), 'PURCHASE'), ('bob', Decimal('20.25'), 'SALE')],
+        )
+        self.assertEqual(WalletLedger.drift(), {})
+        # The cached header balance was dropped
+        self.assertEqual(user_cache.wallet_balance(self.bob.id), Decimal('20.25'))
+
+    def test_insufficient_funds_changes_nothing(self):
+        with self.assertRaises(InsufficientFunds):
+            WalletLedger.transfer(self.alice, self.bob, '50.01')
+
+        self.assertEqual(self.balances(), {'alice': Decimal('50.00'), 'bob': Decimal('0.00')})
+        self.assertEqual(LedgerEntry.objects.count(), 1)
+
+    def test_saving_a_user_does_not_overwrite_the_balance(self):
+        stale = User.objects.select_related('wallet').get(pk=self.alice.pk)
+        WalletLedger.deposit(self.alice, Decimal('10.00'))
+        stale.first_name = 'Alice'
+        stale.save()
+
+        self.assertEqual(self.balances()['alice'], Decimal('60.00'))
+
+    def test_rebuild_restores_balances_from_the_journal(self):
+        Wallet.objects.filter(user=self.alice).update(balance=Decimal('999.00'))
+        self.assertEqual(WalletLedger.drift(), {self.alice.id: (Decimal('999.00'), Decimal('50.00'))})
+
+        self.assertEqual(WalletLedger.rebuild_balances(), 1)
+        self.assertEqual(self.balances()['alice'], Decimal('50.00'))
+
+
+class WalletLedgerConcurrencyTests(TransactionTestCase):
+    THREADS = 8
+    TRANSFERS = 25
+
+    def test_concurrent_transfers_never_drift_or_overdraw(self):
+        users = [User.objects.create_user(username=f'user{i}', email=f'u{i}@example.com') for i in range(4)]
+        for user in users:
+            WalletLedger.deposit(user, Decimal('30.00'))
+        failures = []
+
+        def worker(seed):
+            rng = random.Random(seed)
+            try:
+                for _ in range(self.TRANSFERS):
+                    payer, payee = rng.sample(users, 2)
+                    amount = Decimal(rng.randint(100, 1500)).scaleb(-2)
+                    for attempt in range(50):
+                        try:
+                            WalletLedger.transfer(payer, payee, amount)
+                            break
+                        except InsufficientFunds:
+                            break
+                        except OperationalError:
+                            # SQLite reports lock contention instead of waiting
+                            time.sleep(0.01)
+                    else:
+                        failures.append(f"{payer} -> {payee} never got the lock")
+            except Exception as e:
+                failures.append(e)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=worker, args=(seed,)) for seed in range(self.THREADS)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(failures, [])
+        balances = list(Wallet.objects.filter(user__in=users).values_list('balance', flat=True))
+        self.assertEqual(sum(balances), Decimal('120.00'))
+        self.assertTrue(all(balance >= 0 for balance in balances))
+        self.assertEqual(WalletLedger.drift(), {})
+        # Every transfer wrote a balanced pair of journal rows
+        purchases = LedgerEntry.objects.filter(kind='PURCHASE').count()
+        self.assertGreater(purchases, 0)
+        self.assertEqual(LedgerEntry.objects.filter(kind='SALE').count(), purchases)